@@ -0,0 +1,83 @@
+"""
+On-disk cache of raw Enphase API responses, so historical telemetry is only requested once.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+GRANULARITY_PERIODS = {"day": timedelta(days=1), "week": timedelta(days=7)}
+SETTLE_TIME = timedelta(days=2) # Devices can report late; periods ending more recently may still change
+
+class ResponseCache:
+    """
+    Raw response bodies stored under root, one file per request, named by a hash of
+    (system_id, endpoint, granularity, start_at, start_date).
+
+    Only responses for periods that ended more than SETTLE_TIME ago are stored: they are
+    treated as immutable and replayed instead of requested again.
+    """
+    def __init__(self, root) -> None:
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(system_id, endpoint, granularity, start_at=None, start_date=None) -> str:
+        request = json.dumps([system_id, endpoint, granularity, start_at, start_date])
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    @staticmethod
+    def is_complete(granularity, start_at=None, start_date=None, now=None) -> bool:
+        """
+        Whether the requested period is over (and settled), so its response can no longer change
+        """
+        period = GRANULARITY_PERIODS.get(granularity)
+        if period is None:
+            return False
+        if start_at is not None:
+            start = datetime.fromtimestamp(start_at)
+        elif start_date is not None:
+            start = datetime.strptime(start_date, "%Y-%m-%d")
+        else:
+            return False #Most recent period
+        now = now if now is not None else datetime.now()
+        return start + period + SETTLE_TIME < now
+
+    def path(self, key) -> str:
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    def get(self, key):
+        """
+        Parsed response stored under key, or None
+        """
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as f:
+                response_json = json.loads(f.read())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return response_json
+
+    def contains(self, key) -> bool:
+        """
+        True if a response is stored under key (without reading it)
+        """
+        return os.path.exists(self.path(key))
+
+    def put(self, key, response_text:str) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        #Write next to the entry and swap it in, so a crash never leaves a partial response
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(response_text)
+        os.replace(tmp_path, path)
+
+    def put_if_complete(self, key, response_text:str, granularity, start_at=None, start_date=None) -> bool:
+        if not self.is_complete(granularity, start_at, start_date):
+            return False
+        self.put(key, response_text)
+        return True
@@ -0,0 +1,52 @@
+import unittest
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from api_cache import ResponseCache
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = ResponseCache(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_keys(self):
+        key = ResponseCache.make_key(7, "production_meter", "week", 1700000000)
+        self.assertEqual(key, ResponseCache.make_key(7, "production_meter", "week", 1700000000))
+        self.assertNotEqual(key, ResponseCache.make_key(8, "production_meter", "week", 1700000000))
+        self.assertNotEqual(key, ResponseCache.make_key(7, "battery", "week", 1700000000))
+        self.assertNotEqual(key, ResponseCache.make_key(7, "production_meter", "day", 1700000000))
+        self.assertNotEqual(key, ResponseCache.make_key(7, "production_meter", "week", 1700000900))
+
+    def test_put_and_get(self):
+        key = ResponseCache.make_key(7, "production_meter", "week", 1700000000)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, '{"intervals": [{"end_at": 1700000900, "wh_del": 12}]}')
+        self.assertEqual(self.cache.get(key), {"intervals": [{"end_at": 1700000900, "wh_del": 12}]})
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(os.listdir(os.path.dirname(self.cache.path(key))), [key + ".json"])
+
+    def test_only_completed_periods_are_stored(self):
+        now = datetime(2025, 3, 20)
+        self.assertTrue(ResponseCache.is_complete("week", int(datetime(2025, 3, 1).timestamp()), now=now))
+        self.assertFalse(ResponseCache.is_complete("week", int(datetime(2025, 3, 12).timestamp()), now=now))
+        self.assertTrue(ResponseCache.is_complete("day", start_date="2025-03-16", now=now))
+        self.assertFalse(ResponseCache.is_complete("day", start_date="2025-03-17", now=now))
+        self.assertFalse(ResponseCache.is_complete("week", now=now))
+        self.assertFalse(ResponseCache.is_complete("15mins", int(datetime(2025, 1, 1).timestamp()), now=now))
+
+        recent = int((datetime.now() - timedelta(days=3)).timestamp())
+        old = int((datetime.now() - timedelta(days=30)).timestamp())
+        self.assertFalse(self.cache.put_if_complete(ResponseCache.make_key(7, "battery", "week", recent), "{}", "week", recent))
+        self.assertTrue(self.cache.put_if_complete(ResponseCache.make_key(7, "battery", "week", old), "{}", "week", old))
+        self.assertIsNone(self.cache.get(ResponseCache.make_key(7, "battery", "week", recent)))
+        self.assertEqual(self.cache.get(ResponseCache.make_key(7, "battery", "week", old)), {})
+        self.assertTrue(self.cache.contains(ResponseCache.make_key(7, "battery", "week", old)))
+        self.assertFalse(self.cache.contains(ResponseCache.make_key(7, "battery", "week", recent)))
+
+if __name__ == "__main__":
+    unittest.main()
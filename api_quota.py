@@ -0,0 +1,115 @@
+"""
+Monthly Enphase API call ledger, kept in SQLite and shared by every process using the same file.
+"""
+import sqlite3
+from datetime import datetime
+
+MAX_API_CALLS_PER_MONTH = 1000 #Free API limit
+INTERACTIVE_RESERVE = 200 # Calls background fetches leave for token refreshes, system summaries and the like
+
+class QuotaExceededError(ValueError):
+    """
+    A background fetch would use calls reserved for interactive use this month
+    """
+
+def month_key(now=None) -> str:
+    now = now if now is not None else datetime.now()
+    return now.strftime("%Y-%m")
+
+class QuotaLedger:
+    """
+    Calls made each month, by endpoint and user (user_id 0 when unknown).
+
+    Interactive calls are always recorded. Background calls (telemetry fetches) are refused with
+    QuotaExceededError once they would leave less than interactive_reserve of monthly_limit.
+    """
+    def __init__(self, path, monthly_limit=MAX_API_CALLS_PER_MONTH, interactive_reserve=INTERACTIVE_RESERVE) -> None:
+        if interactive_reserve > monthly_limit:
+            raise ValueError("interactive_reserve must not be larger than monthly_limit")
+        self.path = path
+        self.monthly_limit = monthly_limit
+        self.interactive_reserve = interactive_reserve
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS api_calls (month TEXT NOT NULL, user_id INTEGER NOT NULL, endpoint TEXT NOT NULL, "
+                         "calls INTEGER NOT NULL, PRIMARY KEY (month, user_id, endpoint))")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    @property
+    def background_budget(self) -> int:
+        return self.monthly_limit - self.interactive_reserve
+
+    def _check_background(self, used:int, calls:int) -> None:
+        if used + calls > self.background_budget:
+            raise QuotaExceededError(f"Monthly API quota: {used} of {self.monthly_limit} calls used, "
+                                     f"the last {self.interactive_reserve} are reserved for interactive use")
+
+    def _used(self, conn, month:str) -> int:
+        return conn.execute("SELECT COALESCE(SUM(calls), 0) FROM api_calls WHERE month = ?", (month,)).fetchone()[0]
+
+    def record(self, endpoint:str, user_id=None, calls=1, background=False, now=None) -> int:
+        """
+        Count calls against this month. Returns the month's calls so far.
+        Raises QuotaExceededError (recording nothing) if background calls do not fit in the background budget.
+        """
+        month = month_key(now)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE") # Check and count in one step across processes
+            used = self._used(conn, month)
+            if background:
+                self._check_background(used, calls)
+            conn.execute("INSERT INTO api_calls (month, user_id, endpoint, calls) VALUES (?, ?, ?, ?) "
+                         "ON CONFLICT (month, user_id, endpoint) DO UPDATE SET calls = calls + excluded.calls",
+                         (month, user_id if user_id is not None else 0, endpoint, calls))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return used + calls
+
+    def used(self, now=None) -> int:
+        conn = self._connect()
+        try:
+            return self._used(conn, month_key(now))
+        finally:
+            conn.close()
+
+    def usage(self, now=None) -> list:
+        """
+        This month's calls: [(user_id, endpoint, calls)]
+        """
+        conn = self._connect()
+        try:
+            return [tuple(row) for row in conn.execute("SELECT user_id, endpoint, calls FROM api_calls WHERE month = ? "
+                                                       "ORDER BY user_id, endpoint", (month_key(now),))]
+        finally:
+            conn.close()
+
+    def remaining_background(self, now=None) -> int:
+        return max(0, self.background_budget - self.used(now))
+
+    def check_background(self, calls:int, now=None) -> None:
+        """
+        Raise QuotaExceededError unless calls more background calls fit this month
+        """
+        self._check_background(self.used(now), calls)
+
+    def weeks_fetchable(self, calls_per_week:int, now=None) -> int:
+        """
+        Weeks of telemetry that can still be fetched this month, at calls_per_week each
+        """
+        return self.remaining_background(now) // calls_per_week
+
+    def status(self, now=None) -> dict:
+        used = self.used(now)
+        return {"month": month_key(now), "used": used, "monthly_limit": self.monthly_limit,
+                "interactive_reserve": self.interactive_reserve,
+                "remaining_background": max(0, self.background_budget - used)}
@@ -0,0 +1,46 @@
+import unittest
+import os
+import tempfile
+from datetime import datetime
+
+from api_quota import QuotaLedger, QuotaExceededError
+
+class TestQuotaLedger(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.ledger = QuotaLedger(self.path, monthly_limit=20, interactive_reserve=5)
+        self.now = datetime(2025, 3, 10)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_ledger_by_month_endpoint_and_user(self):
+        self.ledger.record("production_meter", 1, background=True, now=self.now)
+        self.ledger.record("production_meter", 1, background=True, now=self.now)
+        self.ledger.record("oauth_token", None, now=self.now)
+        self.assertEqual(self.ledger.record("summary", 2, calls=3, now=self.now), 6)
+        self.ledger.record("summary", 2, now=datetime(2025, 4, 1))
+
+        self.assertEqual(self.ledger.usage(self.now), [(0, "oauth_token", 1), (1, "production_meter", 2), (2, "summary", 3)])
+        self.assertEqual(self.ledger.used(self.now), 6)
+        self.assertEqual(QuotaLedger(self.path).used(datetime(2025, 4, 30)), 1) # Shared through the file
+        self.assertEqual(self.ledger.status(self.now)["remaining_background"], 9)
+
+    def test_background_calls_leave_the_reserve(self):
+        self.assertEqual(self.ledger.weeks_fetchable(5, now=self.now), 3)
+        self.ledger.record("battery", 1, calls=13, background=True, now=self.now)
+        self.assertEqual(self.ledger.weeks_fetchable(5, now=self.now), 0)
+        self.ledger.check_background(2, now=self.now)
+        self.assertRaises(QuotaExceededError, self.ledger.check_background, 3, self.now)
+        with self.assertRaises(QuotaExceededError):
+            self.ledger.record("battery", 1, calls=3, background=True, now=self.now)
+        self.assertEqual(self.ledger.used(self.now), 13) # Refused calls are not counted
+
+        #Interactive calls may use the reserve (and are still counted past the limit)
+        self.assertEqual(self.ledger.record("oauth_token", 1, calls=8, now=self.now), 21)
+        self.assertEqual(self.ledger.remaining_background(self.now), 0)
+        self.assertEqual(self.ledger.weeks_fetchable(5, now=datetime(2025, 4, 1)), 3)
+
+if __name__ == "__main__":
+    unittest.main()
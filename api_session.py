@@ -0,0 +1,167 @@
+"""
+Shared HTTP session for the Enphase API: pooled keep-alive connections, default
+timeouts, per-request timing hooks and retries of throttled or failed requests.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+DEFAULT_BASE_URL = "https://api.enphaseenergy.com"
+DEFAULT_TIMEOUT = (5.0, 30.0) # (connect, read) seconds
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_connections_opened = threading.local() # Per thread, as the request runs in the calling thread
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _connections_opened.count = getattr(_connections_opened, "count", 0) + 1
+        return super()._new_conn()
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _connections_opened.count = getattr(_connections_opened, "count", 0) + 1
+        return super()._new_conn()
+
+class _CountingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _CountingHTTPConnectionPool, "https": _CountingHTTPSConnectionPool}
+
+class RequestTiming:
+    """
+    Passed to latency hooks after every request.
+    """
+    def __init__(self, method:str, url:str, status_code, elapsed_sec:float, response_sec, new_connection:bool) -> None:
+        self.method = method
+        self.url = url
+        self.status_code = status_code # None if the request failed
+        self.elapsed_sec = elapsed_sec # Whole call, including connecting and reading the body
+        self.response_sec = response_sec # Request sent until response headers parsed (None if the request failed)
+        self.new_connection = new_connection # False if a pooled keep-alive connection was reused
+
+def retry_after_sec(response:requests.Response, now=None):
+    """
+    Seconds the Retry-After header of response asks to wait (delay or HTTP date), None without a usable header
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    now = now if now is not None else datetime.now(timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
+
+class RetryPolicy:
+    """
+    When to retry a response with one of RETRY_STATUS_CODES, and how long to wait first.
+
+    Retry-After is followed when present; a wait longer than max_delay_sec is not retried at all,
+    as the API is not expected back soon. Otherwise the wait is a random ("full jitter") part of
+    base_delay_sec doubled for each earlier attempt, so retrying callers spread out.
+    """
+    def __init__(self, max_attempts=4, base_delay_sec=5.0, max_delay_sec=120.0, rng=None) -> None:
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay_sec = base_delay_sec
+        self.max_delay_sec = max_delay_sec
+        self.rng = rng if rng is not None else random.Random()
+
+    def delay(self, response:requests.Response, attempt:int):
+        """
+        Seconds to wait before retrying after attempt (1 for the first) returned response, None to give up
+        """
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_attempts:
+            return None
+        wait_sec = retry_after_sec(response)
+        if wait_sec is None:
+            return self.rng.uniform(0, min(self.max_delay_sec, self.base_delay_sec * 2 ** (attempt - 1)))
+        if wait_sec > self.max_delay_sec:
+            return None
+        return wait_sec
+
+class ApiSession:
+    """
+    requests.Session with a connection pool for the API host. Paths are resolved
+    against base_url (default: ENPHASE_API_BASE_URL or the Enphase API), so a local
+    stand-in server can be used. timeout is (connect, read) seconds, used unless a call
+    passes its own. Each function in latency_hooks is called with a RequestTiming.
+    """
+    def __init__(self, base_url=None, timeout=DEFAULT_TIMEOUT, pool_maxsize=10) -> None:
+        if base_url is None:
+            base_url = os.getenv('ENPHASE_API_BASE_URL', DEFAULT_BASE_URL)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.latency_hooks = []
+        self.session = requests.Session()
+        adapter = _CountingAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def url(self, path:str) -> str:
+        return self.base_url + path
+
+    def request(self, method:str, url:str, **kwargs) -> requests.Response:
+        """
+        Send a request (url may be a path below base_url) and report its timing to the hooks.
+        """
+        if url.startswith("/"):
+            url = self.url(url)
+        kwargs.setdefault("timeout", self.timeout)
+        connections_before = getattr(_connections_opened, "count", 0)
+        start_time = time.perf_counter()
+        response = None
+        try:
+            response = self.session.request(method, url, **kwargs)
+            return response
+        finally:
+            if len(self.latency_hooks) > 0:
+                timing = RequestTiming(method, url,
+                                       status_code=response.status_code if response is not None else None,
+                                       elapsed_sec=time.perf_counter() - start_time,
+                                       response_sec=response.elapsed.total_seconds() if response is not None else None,
+                                       new_connection=getattr(_connections_opened, "count", 0) > connections_before)
+                for hook in self.latency_hooks:
+                    hook(timing)
+
+    def get(self, url:str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url:str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request_with_retry(self, method:str, url:str, retry_policy:RetryPolicy, before_attempt=None, sleep=time.sleep,
+                           **kwargs) -> requests.Response:
+        """
+        Send a request, retrying as retry_policy allows. before_attempt is called before every
+        attempt (to count and space API calls). Returns the last response.
+        """
+        attempt = 1
+        while True:
+            if before_attempt is not None:
+                before_attempt()
+            response = self.request(method, url, **kwargs)
+            wait_sec = retry_policy.delay(response, attempt)
+            if wait_sec is None:
+                return response
+            print(f"Request to {response.url} failed with status code {response.status_code}, retrying in {wait_sec:.1f} seconds")
+            sleep(wait_sec)
+            attempt += 1
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,132 @@
+import unittest
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+from api_session import ApiSession, RetryPolicy, retry_after_sec
+
+fail_counts = {}
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+
+    def do_GET(self):
+        if self.path.startswith("/slow"):
+            time.sleep(0.5)
+        if self.path.startswith("/fail"):
+            # /fail?code=503&times=2[&retry_after=3]: the first `times` requests of this path fail
+            query = parse_qs(urlparse(self.path).query)
+            fail_counts[self.path] = fail_counts.get(self.path, 0) + 1
+            if fail_counts[self.path] <= int(query["times"][0]):
+                self.send_response(int(query["code"][0]))
+                if "retry_after" in query:
+                    self.send_header("Retry-After", query["retry_after"][0])
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        body = json.dumps({"method": "GET", "path": self.path, "key": self.headers.get("key")}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = json.dumps({"method": "POST", "path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestApiSession(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.session = ApiSession(self.base_url)
+        self.timings = []
+        self.session.latency_hooks.append(self.timings.append)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_paths_resolve_against_base_url(self):
+        response = self.session.get("/api/v4/systems?x=1", headers={"key": "abc"})
+        self.assertEqual(response.json(), {"method": "GET", "path": "/api/v4/systems?x=1", "key": "abc"})
+        self.assertEqual(self.session.post("/oauth/token").json(), {"method": "POST", "path": "/oauth/token"})
+        self.assertEqual(self.session.get(self.base_url + "/full").json()["path"], "/full")
+
+    def test_base_url_from_environment(self):
+        os.environ["ENPHASE_API_BASE_URL"] = self.base_url + "/"
+        try:
+            self.assertEqual(ApiSession().url("/oauth/token"), self.base_url + "/oauth/token")
+        finally:
+            del os.environ["ENPHASE_API_BASE_URL"]
+
+    def test_connection_is_reused(self):
+        for _ in range(3):
+            self.session.get("/api/v4/systems")
+        self.assertEqual([timing.new_connection for timing in self.timings], [True, False, False])
+        self.assertEqual([timing.status_code for timing in self.timings], [200]*3)
+        self.assertTrue(all(timing.elapsed_sec >= timing.response_sec > 0 for timing in self.timings))
+        self.assertEqual(self.timings[0].url, self.base_url + "/api/v4/systems")
+
+    def test_timeout(self):
+        self.session.timeout = (1.0, 0.1)
+        with self.assertRaises(requests.exceptions.Timeout):
+            self.session.get("/slow")
+        self.assertIsNone(self.timings[-1].status_code)
+        self.assertEqual(self.session.get("/slow", timeout=5).status_code, 200)
+
+    def test_retry(self):
+        attempts = []
+        sleeps = []
+        policy = RetryPolicy(max_attempts=3, base_delay_sec=1, rng=random.Random(1))
+        response = self.session.request_with_retry("GET", "/fail?code=503&times=2", policy,
+                                                   before_attempt=lambda: attempts.append(1), sleep=sleeps.append)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(attempts), 3) # Every attempt is counted
+        self.assertTrue(0 <= sleeps[0] <= 1 and 0 <= sleeps[1] <= 2) # Jittered exponential backoff
+
+        sleeps.clear()
+        response = self.session.request_with_retry("GET", "/fail?code=429&times=5&retry_after=7", policy, sleep=sleeps.append)
+        self.assertEqual(response.status_code, 429) # Gave up after max_attempts
+        self.assertEqual(sleeps, [7, 7])
+
+        sleeps.clear()
+        response = self.session.request_with_retry("GET", "/fail?code=429&times=1&retry_after=3600", policy, sleep=sleeps.append)
+        self.assertEqual(response.status_code, 429) # Not worth waiting for
+        self.assertEqual(sleeps, [])
+        response = self.session.request_with_retry("GET", "/fail?code=404&times=1", policy, sleep=sleeps.append)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(sleeps, [])
+
+    def test_retry_after_date(self):
+        response = requests.Response()
+        self.assertIsNone(retry_after_sec(response))
+        response.headers["Retry-After"] = "Wed, 21 Oct 2015 07:28:30 GMT"
+        self.assertEqual(retry_after_sec(response, now=datetime(2015, 10, 21, 7, 28, tzinfo=timezone.utc)), 30)
+        self.assertEqual(retry_after_sec(response), 0)
+        response.headers["Retry-After"] = "soon"
+        self.assertIsNone(retry_after_sec(response))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,16 +1,22 @@
 from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, send_file
-from db_models import db, User, SystemDetails, HistoricalData
+from db_models import db, User, SystemDetails, HistoricalData, WeekCoverage, bump_data_version, update_week_coverage, upgrade_schema
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_bcrypt import Bcrypt
 import json
 import os
+import shutil
 from datetime import datetime, timedelta
-import pandas as pd
-
-import copy
 
+import api_quota
+import backfill
 import enphase_api
+import fetch_planner
 import solar_sim
+import ingest
+import interval_archive
+import sizing_optimizer
+import week_coverage
+from history_cache import HistoryCache
 
 # import random  # Example: for simulation logic
 
@@ -27,6 +33,8 @@ port = 5000
 
 app.config["UPLOAD_FOLDER"] = "uploads"  # Directory to save uploaded files
 app.config["REPORTS_FOLDER"] = "reports"  # Directory to save generated reports
+app.config["INTERVAL_ARCHIVE"] = os.getenv('ENPHASE_INTERVAL_ARCHIVE')  # Optional: directory of the monthly interval archive (see interval_archive.py)
+app.config["BACKFILL_IN_WEB"] = os.getenv('ENPHASE_BACKFILL_IN_WEB', '1') != '0'  # Serving processes run the backfill queue (see start_backfill_scheduler)
 
 # Ensure upload folder exists
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
@@ -41,6 +49,10 @@ login_manager.login_view = 'login'
 
 app.user_files = {}
 
+baseline_cache = solar_sim.BaselineCache()
+system_history_cache = HistoryCache()
+archive = interval_archive.IntervalArchive(app.config["INTERVAL_ARCHIVE"]) if app.config["INTERVAL_ARCHIVE"] else None
+
 # def run_simulation(param):
 #     # Example simulation: random number generation based on input
 #     return {"result": random.randint(1, param)}
@@ -56,6 +68,7 @@ def get_token_dict(user_entry) -> dict:
         'refresh_token': user_entry.refresh_token,
         'access_token': user_entry.access_token,
         'access_token_expiration': user_entry.access_token_expiration,
+        'user_id': user_entry.id, #Calls are counted per user in the monthly API quota ledger
         'redirect_uri': f"http://localhost:{port}/enphase_auth" #Needs to be localhost because this isn't a world-accessible server
     }
     return token_dict
@@ -83,9 +96,9 @@ def get_populated_data_week_list(system_id:int):
     install_time = system_details.operational_at
     install_day = adjust_datetime_to_weeks_after_first_day(install_time)
     
-    first_entry = HistoricalData.query.filter_by(system_id=system_id).order_by(HistoricalData.timestamp_end).first()
-    if first_entry is not None:
-        first_downloaded_date = adjust_datetime_to_weeks_after_first_day(first_entry.timestamp_end)
+    first_timestamp_end = db.session.query(db.func.min(WeekCoverage.first_timestamp_end)).filter(WeekCoverage.system_id==system_id).scalar()
+    if first_timestamp_end is not None:
+        first_downloaded_date = adjust_datetime_to_weeks_after_first_day(first_timestamp_end)
     else:
         first_downloaded_date = now
 
@@ -96,45 +109,17 @@ def get_populated_data_week_list(system_id:int):
         first_reported_day = install_day
 
     final_week = adjust_datetime_to_weeks_after_first_day_neg(now)
+    week_starts = week_coverage.week_start_days(first_reported_day, final_week)
+    if len(week_starts) == 0:
+        return []
 
-    week_list = []
-    cur_day = first_reported_day
-    while cur_day <= final_week:
-        if cur_day.day % 7 == 1:
-            week_list.append([cur_day, False])
-        cur_day = adjust_datetime_to_weeks_after_first_day(cur_day + timedelta(days=1))
-        
-    fifteenMin = timedelta(minutes=15)
-    for index, week_entry in enumerate(week_list):
-        if index < len(week_list) - 1:
-            stop_day = week_list[index+1][0] #day to stop before (non-inclusive)
-        else:
-            stop_day = datetime(now.year, now.month, now.day+1)
-
-        cur_start_day = week_entry[0]
-        cur_data_entries = HistoricalData.query.filter( (HistoricalData.system_id==system_id) & 
-                                                          (HistoricalData.timestamp_end > cur_start_day) & 
-                                                          (HistoricalData.timestamp_end <= stop_day)).order_by(HistoricalData.timestamp_end).all()
-        if cur_data_entries is None or len(cur_data_entries) == 0:
-            continue
-        elif (cur_data_entries[0].timestamp_end - cur_start_day) > fifteenMin + timedelta(minutes=1):
-            continue
-        elif (stop_day - cur_data_entries[-1].timestamp_end) > timedelta(minutes=1):
-            continue
-
-        # If there are any periods of > 15min without data, the answer is "False"
-        prev_time = cur_start_day + timedelta(minutes=1)
-        all_data_present = True
-        for cur_entry in cur_data_entries:
-            cur_time = cur_entry.timestamp_end
-            if cur_time - prev_time > fifteenMin:
-                all_data_present = False
-                break
-            prev_time = cur_time
-        if all_data_present:
-            week_list[index][1] = True
+    # Coverage is maintained per week on ingest (WeekCoverage); weeks without a row have no data
+    complete_weeks = set(row[0] for row in db.session.query(WeekCoverage.week_start).filter(
+                                                          (WeekCoverage.system_id==system_id) & 
+                                                          (WeekCoverage.week_start >= week_starts[0]) & 
+                                                          WeekCoverage.complete))
 
-    return week_list
+    return [[week_start, week_start in complete_weeks] for week_start in week_starts]
 
 def adjust_datetime_to_weeks_after_first_day(datetime_in):
     datetime_out = datetime(datetime_in.year, datetime_in.month, datetime_in.day)
@@ -237,10 +222,17 @@ def system_details():
     if system_id is None:
         return "{\"Error\":\"id was not specified}", 400
 
+    sys_details = SystemDetails.query.filter_by(system_id=system_id).first()
     week_populated_list = get_populated_data_week_list(system_id=system_id)
+    backfill_queue = backfill_status_json(system_id)
 
-    return render_template("system_details.html", system_dict=SystemDetails.query.filter_by(system_id=system_id).first(),
-                           week_populated_list=week_populated_list, system_id=system_id)
+    return render_template("system_details.html", system_dict=sys_details,
+                           week_populated_list=week_populated_list, system_id=system_id,
+                           backfill_queue={entry['start_at']: entry for entry in backfill_queue},
+                           backfill_pending=[entry for entry in backfill_queue if entry['position'] is not None],
+                           api_quota=enphase_api.api_quota_ledger.status(),
+                           weeks_fetchable=enphase_api.api_quota_ledger.weeks_fetchable(week_fetch_api_calls(sys_details)),
+                           archive_warning=archive_stale_message(system_id) if archive is not None and archive.is_stale(system_id) else None)
 
 @app.route('/upload_enphase_energy_report', methods=["POST"])
 @login_required
@@ -263,47 +255,125 @@ def upload_report_csv():
         filepath = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
         file.save(filepath)  # Save file
 
-        # Optional: Process CSV using pandas
-        df = pd.read_csv(filepath, usecols=["Date/Time"])
-        first_time_start = datetime.strptime(df["Date/Time"].values[0], "%Y-%m-%d %H:%M:%S %z")
-        second_time_start = datetime.strptime(df["Date/Time"].values[1], "%Y-%m-%d %H:%M:%S %z")
-        csv_time_interval_len = second_time_start - first_time_start
-
-        last_time_end = datetime.strptime(df["Date/Time"].values[-1], "%Y-%m-%d %H:%M:%S %z") + csv_time_interval_len
-
-        #Delete any existing entries between first and last time
-        db.session.query(HistoricalData).filter((HistoricalData.system_id==system_id)
-                                                   & (HistoricalData.timestamp_end >= first_time_start+csv_time_interval_len-timedelta(minutes=3))
-                                                   & (HistoricalData.timestamp_end <= last_time_end+timedelta(minutes=3))).delete()
-
-        for chunk in pd.read_csv(filepath, chunksize=1):        
-            cur_time_start = datetime.strptime(chunk["Date/Time"].values[0], "%Y-%m-%d %H:%M:%S %z")
-            cur_time_end = cur_time_start + csv_time_interval_len
-
-            #TODO: Detect if battery charge/discharge is in the CSV (I don't know the column name..)
-            batt_charge_wh = 0
-            batt_discharge_wh = 0
-
-            new_entry = HistoricalData(user_id=current_user.id,system_id=system_id,
-                                    timestamp_end=cur_time_end,
-                                    interval_len_sec=csv_time_interval_len.total_seconds(),
-                                    production_wh=int(chunk["Energy Produced (Wh)"].values[0]),
-                                    consumption_wh=int(chunk["Energy Consumed (Wh)"].values[0]),
-                                    import_wh=int(chunk["Imported from Grid (Wh)"].values[0]),
-                                    export_wh=int(chunk["Exported to Grid (Wh)"].values[0]),
-                                    batt_charge_wh=batt_charge_wh,
-                                    batt_discharge_wh=batt_discharge_wh)
-            db.session.add(new_entry)
-            
-        db.session.commit()
-
-
-        flash("Processed the CSV")
+        try:
+            stats = ingest.ingest_report_csv(filepath, current_user.id, system_id)
+        except ingest.IngestError as e:
+            if e.stats.rows > 0:
+                #Earlier batches are committed and replaced the stored intervals over their range
+                if not update_archive(system_id, e.stats.first_timestamp_end, e.stats.last_timestamp_end):
+                    flash(archive_stale_message(system_id))
+                flash(f"Could not process all of the CSV: {e}. {e.stats.rows} intervals up to {e.stats.last_timestamp_end} "
+                      "were imported and replaced the stored ones; fix the file and upload it again to import the rest.")
+            else:
+                flash(f"Could not process the CSV: {e}")
+            return redirect(url_for("system_details", id=system_id))
+
+        if stats.rows > 0 and not update_archive(system_id, stats.first_timestamp_end, stats.last_timestamp_end):
+            flash(archive_stale_message(system_id))
+        flash(f"Processed the CSV: {stats.rows} intervals in {stats.elapsed_sec:.1f} s ({stats.rows_per_sec:.0f} rows/s)")
         return redirect(url_for("system_details", id=system_id))
 
     flash("Invalid file format. Please upload a CSV file.")
     return redirect(url_for("system_details", id=system_id))
 
+def plan_week_fetch(sys_details:SystemDetails, week_start:datetime) -> list:
+    """
+    Telemetry calls needed to fill the holes in the week starting at week_start (see fetch_planner)
+    """
+    return fetch_planner.plan_fetch(sys_details.system_id, week_start, week_start + fetch_planner.CALL_SPAN,
+                                    batt_present=sys_details.battery_capacity_wh > 0)
+
+def fetch_and_store_week(user_entry:User, sys_details:SystemDetails, start_at:int) -> bool:
+    """
+    Fetch the telemetry missing from the week starting at start_at (epoch) from the Enphase API and store it.
+    Intervals that already hold an endpoint's data are left as they are; intervals off the 15 minute
+    grid (other lengths or offsets) in the span of each call are deleted.
+    Returns False if the fetched intervals had inconsistent lengths.
+    """
+    system_id = sys_details.system_id
+    batt_present = sys_details.battery_capacity_wh > 0
+    calls = plan_week_fetch(sys_details, datetime.fromtimestamp(start_at))
+    if len(calls) == 0:
+        return True #Nothing missing
+
+    #The calls are independent, so request them together
+    token_dict, responses = enphase_api.get_telemetry_batch(token_dictionary=get_token_dict(user_entry), system_id=system_id, calls=calls)
+    update_user_token_info(user_entry, token_dict)
+
+    rows, consistent_interval_len = fetch_planner.rows_from_telemetry(user_entry.id, system_id, responses, batt_present,
+                                                                      enphase_api.enphase_epoch_to_datetime_noDST)
+    if len(rows) == 0:
+        return consistent_interval_len
+    first_time = rows[0]['timestamp_end']
+    last_time = rows[-1]['timestamp_end']
+
+    #Stored intervals off the fetched grid would be counted twice, drop them
+    ingest.delete_off_grid_intervals(system_id, fetch_planner.call_spans(calls), fetch_planner.INTERVAL)
+    #Fill in the missing endpoint data, keeping data already stored
+    ingest.merge_intervals(rows)
+    update_week_coverage(system_id, first_time, last_time)
+    bump_data_version(system_id)
+    db.session.commit()
+    update_archive(system_id, first_time, last_time)
+    return consistent_interval_len
+
+def week_fetch_api_calls(sys_details:SystemDetails) -> int:
+    # A whole week: production, consumption, export, import and (if present) battery telemetry
+    return len(fetch_planner.system_endpoints(sys_details.battery_capacity_wh > 0))
+
+def run_backfill_job(job):
+    """
+    fetch_week of the backfill scheduler (runs in its thread)
+    """
+    user_entry = db.session.get(User, job.user_id)
+    sys_details = SystemDetails.query.filter((SystemDetails.system_id==job.system_id) & (SystemDetails.user_id==job.user_id)).first()
+    if user_entry is None or sys_details is None:
+        raise ValueError(f"System {job.system_id} of user {job.user_id} no longer exists")
+    fetch_and_store_week(user_entry, sys_details, int(job.week_start.timestamp()))
+
+backfill_scheduler = backfill.BackfillScheduler(app, run_backfill_job, calls_per_minute=enphase_api.api_limiter.rate_per_minute,
+                                                quota=enphase_api.api_quota_ledger)
+
+@app.before_request
+def start_backfill_scheduler():
+    """
+    Every process serving requests (flask run, the development server or WSGI server workers) runs
+    the backfill queue, started on its first request. Set ENPHASE_BACKFILL_IN_WEB=0 to run it only
+    in a separate worker process instead: flask --app app backfill
+    """
+    if app.config["BACKFILL_IN_WEB"]:
+        backfill_scheduler.start()
+
+@app.cli.command("backfill")
+def run_backfill_worker():
+    """
+    Run the backfill queue in the foreground (stop with Ctrl+C)
+    """
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+    backfill_scheduler.run()
+
+def backfill_status_json(system_id:int) -> list:
+    """
+    The system's pending jobs (position, eta) and failed jobs (error)
+    """
+    return [{"start_at": int(entry['week_start'].timestamp()), "status": entry['status'], "position": entry['position'],
+             "eta": entry['eta'].strftime('%Y-%m-%d %H:%M') if entry['eta'] is not None else None, "error": entry['error']}
+            for entry in backfill_scheduler.queue_status(system_id)]
+
+@app.route('/api_status', methods=['GET'])
+@login_required
+def api_status():
+    """
+    Shared API rate limiter state (tokens, next free slot and this process's waits)
+    and this month's API calls by user and endpoint, for monitoring
+    """
+    return jsonify({"rate_limit": enphase_api.api_limiter.status(),
+                    "monthly_quota": enphase_api.api_quota_ledger.status(),
+                    "monthly_usage": [{"user_id": user_id, "endpoint": endpoint, "calls": calls}
+                                      for user_id, endpoint, calls in enphase_api.api_quota_ledger.usage()]})
+
 @app.route('/fetchdata_week',methods=['GET'])
 @login_required
 def fetchdata_week():
@@ -314,88 +384,420 @@ def fetchdata_week():
     if system_id is None:
         return "{\"Error\":\"system_id was not specified}", 400
 
-    # Get data starting at start_at, every 15 minutes (week)
-    # Populate the database with this information (production, consumption, battery usage, etc.)
-
     cur_system = SystemDetails.query.filter((SystemDetails.system_id==system_id) & (SystemDetails.user_id==current_user.id)).first()
     if cur_system is None:
         return "{\"Error\":\"system_id not found!}", 404
-    
-    batt_present = cur_system.battery_capacity_wh > 0
-    token_dict = current_user.access_token
-    token_dict, prod_telemetry = enphase_api.get_production_telemetry(token_dictionary=get_token_dict(current_user), system_id=cur_system.system_id, start_at=start_at)
-    token_dict, cons_telemetry = enphase_api.get_consumption_telemetry(token_dictionary=get_token_dict(current_user), system_id=cur_system.system_id, start_at=start_at)
-    token_dict, export_telemetry = enphase_api.get_energy_export_telemetry(token_dictionary=get_token_dict(current_user), system_id=cur_system.system_id, start_at=start_at)
-    token_dict, import_telemetry = enphase_api.get_energy_import_telemetry(token_dictionary=get_token_dict(current_user), system_id=cur_system.system_id, start_at=start_at)
-
-    if batt_present:
-        token_dict, batt_telemetry = enphase_api.get_battery_telemetry(token_dictionary=get_token_dict(current_user), system_id=cur_system.system_id, start_at=start_at)
+
+    try:
+        consistent_interval_len = fetch_and_store_week(current_user, cur_system, start_at)
+    except api_quota.QuotaExceededError as e:
+        return jsonify({"Error": str(e)}), 429
+    if consistent_interval_len:
+        return "{\"Result\":\"Success!\"}", 200
     else:
-        batt_telemetry = None
-
-    update_user_token_info(current_user, token_dict)
-
-    prod_intervals = prod_telemetry['intervals']
-    cons_intervals = cons_telemetry['intervals']
-    export_intervals = export_telemetry['intervals'] #Outer list element for each day
-    #Flatten
-    export_intervals = [item for sublist in export_intervals for item in sublist]
-    import_intervals = import_telemetry['intervals'] #Outer list element for each day
-    #Flatten
-    import_intervals = [item for sublist in import_intervals for item in sublist]
-    if batt_telemetry is None:
-        batt_intervals = None
+        return "{\"Result\":\"Success, however there were inconsistent interval lengths between data points.\"}", 200
+
+@app.route('/backfill', methods=['POST'])
+@login_required
+def queue_backfill():
+    """
+    Queue background fetches of one week (start_at) or of every week without complete data
+    """
+    system_id = request.args.get('system_id', None, type=int)
+    start_at = request.args.get('start_at', None, type=int)
+    if system_id is None:
+        return "{\"Error\":\"system_id was not specified}", 400
+
+    cur_system = SystemDetails.query.filter((SystemDetails.system_id==system_id) & (SystemDetails.user_id==current_user.id)).first()
+    if cur_system is None:
+        return "{\"Error\":\"system_id not found!}", 404
+
+    if start_at is not None:
+        week_starts = [datetime.fromtimestamp(start_at)]
     else:
-        batt_intervals = batt_telemetry['intervals']
-
-    #first_time = datetime.fromtimestamp(prod_intervals[0]['end_at'])
-    first_time = enphase_api.enphase_epoch_to_datetime_noDST(prod_intervals[0]['end_at'])
-    last_time = enphase_api.enphase_epoch_to_datetime_noDST(prod_intervals[-1]['end_at'])
-    interval_len = enphase_api.enphase_epoch_to_datetime_noDST(prod_intervals[1]['end_at']) - first_time
-
-    #Delete existing entries
-    db.session.query(HistoricalData).filter((HistoricalData.system_id==system_id)
-                                                   & (HistoricalData.timestamp_end >= first_time)
-                                                   & (HistoricalData.timestamp_end <= last_time)).delete()
-
-    #Go through "intervals". Each telemetry output should have the same intervals.
-    #Delete any existing data between intervals[0].end_at and intervals[-1].end_at
-    unexpected_interval_len = False
-    for i in range(0, len(prod_intervals)):
-        if batt_present:
-            batt_charge_wh = batt_intervals[i]['charge']['enwh']
-            batt_discharge_wh = batt_intervals[i]['discharge']['enwh']
+        week_starts = [week_start for week_start, populated in get_populated_data_week_list(system_id) if not populated]
+        week_starts.reverse() #Most recent first
+    #Only the calls needed to fill each week's holes
+    weeks = [(week_start, len(plan_week_fetch(cur_system, week_start))) for week_start in week_starts]
+    queued = backfill.queue_weeks(current_user.id, system_id, [(week_start, api_calls) for week_start, api_calls in weeks if api_calls > 0])
+    backfill_scheduler.notify()
+
+    if start_at is not None:
+        if weeks[0][1] == 0:
+            result = "Nothing missing"
         else:
-            batt_charge_wh = 0
-            batt_discharge_wh = 0
-        
-        cur_timestamp_end = enphase_api.enphase_epoch_to_datetime_noDST(prod_intervals[i]['end_at'])
-        if i > 0:
-            #Check if we hae an unexpected interval length
-            cur_interval_len = cur_timestamp_end - prev_timestamp_end
-            if cur_interval_len > interval_len:
-                print(f"Interval length of fetched data is inconsistent! From {prev_timestamp_end} to {cur_timestamp_end} is greater than {interval_len}")
-                unexpected_interval_len = True
-
-        new_entry = HistoricalData(user_id=current_user.id,system_id=system_id,
-                                   timestamp_end=cur_timestamp_end,
-                                   interval_len_sec=interval_len.total_seconds(),
-                                   production_wh=prod_intervals[i]['wh_del'],
-                                   consumption_wh=cons_intervals[i]['enwh'],
-                                   import_wh=import_intervals[i]['wh_imported'],
-                                   export_wh=export_intervals[i]['wh_exported'],
-                                   batt_charge_wh=batt_charge_wh,
-                                   batt_discharge_wh=batt_discharge_wh)
-        db.session.add(new_entry)
-        
-        prev_timestamp_end = cur_timestamp_end
-    db.session.commit()
+            result = "Queued" if queued > 0 else "Already queued"
+        return jsonify({"Result": result, "queue": backfill_status_json(system_id)}), 200
+    flash(f"Queued {queued} weeks for download, needing {sum(api_calls for _, api_calls in weeks)} API calls "
+          f"({enphase_api.api_quota_ledger.remaining_background()} left this month)")
+    return redirect(url_for("system_details", id=system_id))
 
-    #Populate new entries and commit
-    if unexpected_interval_len:
-        return "{\"Result\":\"Success, however there were inconsistent interval lengths between data points.\"}", 200
+@app.route('/backfill_cancel', methods=['POST'])
+@login_required
+def cancel_backfill():
+    system_id = request.args.get('system_id', None, type=int)
+    if SystemDetails.query.filter((SystemDetails.system_id==system_id) & (SystemDetails.user_id==current_user.id)).first() is None:
+        return "{\"Error\":\"system_id not found!}", 404
+    flash(f"Removed {backfill.cancel_queued(system_id)} queued weeks")
+    return redirect(url_for("system_details", id=system_id))
+
+@app.route('/backfill_status', methods=['GET'])
+@login_required
+def backfill_status():
+    system_id = request.args.get('system_id', None, type=int)
+    if SystemDetails.query.filter((SystemDetails.system_id==system_id) & (SystemDetails.user_id==current_user.id)).first() is None:
+        return "{\"Error\":\"system_id not found!}", 404
+    return jsonify(backfill_status_json(system_id))
+
+def parse_simulation_form(form, sys_details) -> dict:
+    """
+    Convert the submitted simulation form values to proper data types
+    """
+    # Get submitted form values
+    data = form.to_dict()
+
+    # Add system_name explicitly to the data dictionary
+    data['system_name'] = sys_details.name
+
+    data['start_datetime'] = datetime.strptime(data['start_datetime'], "%Y-%m-%dT%H:%M")
+    data['end_datetime'] = datetime.strptime(data['end_datetime'], "%Y-%m-%dT%H:%M")
+
+    data['grid_weekday_on_peak_start'] = parse_time(data['grid_weekday_on_peak_start'])
+    data['grid_weekday_on_peak_end'] = parse_time(data['grid_weekday_on_peak_end'])
+    data['grid_weekend_on_peak_start'] = parse_time(data['grid_weekend_on_peak_start'])
+    data['grid_weekend_on_peak_end'] = parse_time(data['grid_weekend_on_peak_end'])
+    
+
+    #Convert data to proper data types
+    integer_fields = ["module_count"]
+    for field in integer_fields:
+        data[field] = int(data[field])
+
+    float_fields = ["batt_usable_energy_kwh", "batt_charge_eff", "batt_discharge_eff", "batt_max_c_rate",
+                    "grid_weekday_off_peak_cost_per_kwh", "grid_weekday_on_peak_cost_per_kwh", "grid_weekend_off_peak_cost_per_kwh", "grid_weekend_on_peak_cost_per_kwh",
+                    "grid_weekday_off_peak_gen_pay_per_kwh", "grid_weekday_on_peak_gen_pay_per_kwh", "grid_weekday_off_peak_creditable_per_kwh", "grid_weekday_on_peak_creditable_per_kwh",
+                    "grid_weekend_off_peak_gen_pay_per_kwh", "grid_weekend_on_peak_gen_pay_per_kwh", "grid_weekend_off_peak_creditable_per_kwh", "grid_weekend_on_peak_creditable_per_kwh",
+                    "solar_consumption_bias", "initial_credits"]
+    
+    for field in float_fields:
+        data[field] = float(data[field])
+    return data
+
+def iter_simulation_data(system_id:int, data:dict, chunk_size=4096):
+    """
+    Stream the interval data for the form's date range from a server-side cursor.
+    Raises ValueError if data is missing.
+    """
+    query = db.session.query(HistoricalData).filter((HistoricalData.system_id == system_id) &
+                                       (HistoricalData.user_id == current_user.id) &
+                                       (HistoricalData.timestamp_end > data['start_datetime']) &
+                                       (HistoricalData.timestamp_end <= data['end_datetime'])).order_by(HistoricalData.timestamp_end)
+    
+    prev_end = data['start_datetime']
+    for d in query.yield_per(chunk_size):
+        if (d.timestamp_end - prev_end).total_seconds() > d.interval_len_sec+30:
+            #We're missing data!
+            err_msg = f"Error: Missing data between the times specified! {prev_end} --> {d.timestamp_start}"
+            print(err_msg)
+            raise ValueError(err_msg)
+        prev_end = d.timestamp_end
+        yield d
+
+def load_system_history(system_id:int) -> solar_sim.IntervalColumns:
+    """
+    All interval data of a system as columns (selects the values only, no HistoricalData objects)
+    """
+    fields = [getattr(HistoricalData, field) for field in solar_sim.INTERVAL_COLUMN_FIELDS]
+    rows = db.session.query(*fields).filter((HistoricalData.system_id == system_id) &
+                                            (HistoricalData.user_id == current_user.id)).order_by(HistoricalData.timestamp_end).all()
+    return solar_sim.IntervalColumns(*(zip(*rows) if len(rows) > 0 else [[]]*len(fields)))
+
+def archive_stale_message(system_id:int) -> str:
+    return (f"The interval archive of system {system_id} is out of date; simulations read the database until it is "
+            f"re-exported with: python interval_archive.py export {app.config['INTERVAL_ARCHIVE']} --system-id {system_id}")
+
+def update_archive(system_id:int, first_time, last_time) -> bool:
+    """
+    Rewrite the interval archive's months between first_time and last_time from the database (if an archive is configured).
+    The database is already committed, so a failure only marks the system's archive stale. Returns False on failure.
+    """
+    if archive is None:
+        return True
+    try:
+        interval_archive.export_system(archive, system_id, first_time, last_time)
+        return True
+    except Exception as e:
+        print(f"Interval archive update of system {system_id} failed: {e}")
+        print(archive_stale_message(system_id))
+        try:
+            archive.mark_stale(system_id)
+        except OSError as marker_error:
+            print(f"Could not mark the archive of system {system_id} stale: {marker_error}")
+        return False
+
+def load_simulation_data(sys_details:SystemDetails, data:dict):
+    """
+    Interval data for the form's date range, memory-mapped from the interval archive if one
+    is configured (and not stale), otherwise from the system history cache.
+    Returns (columns, err_msg); err_msg is None unless data is missing.
+    """
+    system_id = sys_details.system_id
+    if archive is not None and not archive.is_stale(system_id):
+        # Only the current user's intervals, like load_system_history
+        columns = archive.read(system_id, data['start_datetime'], data['end_datetime'], user_id=current_user.id)
     else:
-        return "{\"Result\":\"Success!\"}", 200
+        # Keyed like load_system_history's query: by user and system
+        columns = system_history_cache.get_range((current_user.id, system_id), sys_details.data_version, lambda: load_system_history(system_id),
+                                                 data['start_datetime'], data['end_datetime'])
+    gap = columns.first_gap(data['start_datetime'])
+    if gap is not None:
+        prev_end = data['start_datetime'] if gap == 0 else columns.timestamp_end[gap-1].item()
+        err_msg = f"Error: Missing data between the times specified! {prev_end} --> {columns.timestamp_start[gap].item()}"
+        print(err_msg)
+        return None, err_msg
+    return columns, None
+
+def build_devices(data:dict):
+    """
+    Solar array and battery described by the simulation form
+    """
+    solar_array = solar_sim.SolarArray(panel_num=data['module_count'])
+    battery = solar_sim.SolarBattery(usable_energy_kwh=data['batt_usable_energy_kwh'],
+                                     charge_eff=data['batt_charge_eff'],
+                                     discharge_eff=data['batt_discharge_eff'],
+                                     max_c_rate=data['batt_max_c_rate'])
+    return solar_array, battery
+
+def summarize_results(aggregates:solar_sim.RunningAggregates, baseline_aggregates:solar_sim.RunningAggregates,
+                      solar_array:solar_sim.SolarArray, battery:solar_sim.SolarBattery, system_name) -> dict:
+    """
+    Aggregated values shown on the results page, from the running totals of a simulation and its grid-only baseline
+    """
+    solar_savings_dollars = baseline_aggregates.total('import_cost') - aggregates.total('import_cost')
+    return {
+        "system_name": system_name,
+        "sum_import_kwh": aggregates.total('imported_wh')/1000,
+        "sum_export_kwh": aggregates.total('exported_wh')/1000,
+        "sim_consumed_kwh": aggregates.total('consumed_wh')/1000,
+        "sim_produced_kwh": aggregates.total('produced_wh')/1000,
+        "sum_import_cost": aggregates.lifetime_import_cost,
+        "sum_export_credits": aggregates.total('credits_earned'),
+        "credits_remaining": aggregates.credits_available,
+        #Extract some values from solar_array and battery
+        "batt_throughput_kwh": battery.throughput_wh / 1000,
+        "sum_generated_energy_kwh": solar_array.lifetime_energy_wh / 1000,
+        "grid_dependence": aggregates.grid_dependence,
+        "solar_savings_dollars": solar_savings_dollars,
+        "percent_solar_savings": 100*solar_savings_dollars / baseline_aggregates.total('import_cost'),
+        "batt_depleted_percentage": aggregates.batt_depleted_percentage(battery.usable_energy_wh),
+        "batt_saturated_percentage": aggregates.batt_saturated_percentage,
+
+        "sum_consumption_peak_kwh": aggregates.peak['consumed_wh']/1000,
+        "sum_consumption_offpeak_kwh": aggregates.offpeak['consumed_wh']/1000,
+        "sum_import_peak_kwh": aggregates.peak['imported_wh']/1000,
+        "sum_import_offpeak_kwh": aggregates.offpeak['imported_wh']/1000,
+        "sum_export_peak_kwh": aggregates.peak['exported_wh']/1000,
+        "sum_export_offpeak_kwh": aggregates.offpeak['exported_wh']/1000,
+        "sum_produced_peak_kwh": aggregates.peak['produced_wh']/1000,
+        "sum_produced_offpeak_kwh": aggregates.offpeak['produced_wh']/1000,
+        "sum_battery_peak_kwh": aggregates.peak['discharge_wh']/1000,
+        "sum_battery_offpeak_kwh": aggregates.offpeak['discharge_wh']/1000,
+
+        "sum_import_peak_cost": aggregates.peak['import_cost'],
+        "sum_import_nopeak_cost": aggregates.offpeak['import_cost'],
+        "sum_import_peak_credits": aggregates.peak['credits_earned'],
+        "sum_import_nopeak_credits": aggregates.offpeak['credits_earned'],
+
+        "sum_import_peak_cost_no_solar": baseline_aggregates.peak['import_cost'],
+        "sum_import_nopeak_cost_no_solar": baseline_aggregates.offpeak['import_cost'],
+    }
+
+def new_report_path(data:dict, solar_array:solar_sim.SolarArray, battery:solar_sim.SolarBattery):
+    """
+    Pick a report filename for this simulation. Returns (filename, file_path).
+    Register it with register_report once the report is written.
+    """
+    current_timestamp = datetime.now().strftime("%m.%d.%Y_%H.%M.%S")
+    start_date = data['start_datetime'].strftime("%m.%d.%Y")
+    end_date = data['end_datetime'].strftime("%m.%d.%Y")
+    filename = f"{current_timestamp}_from_{start_date}_to_{end_date}_{solar_array.panel_num}panels_{battery.usable_energy_kwh}kWh.csv"
+    file_path = os.path.join(app.config["REPORTS_FOLDER"], filename)
+    return filename, file_path
+
+def register_report(filename:str):
+    # Save the filename for the user ID in a dictionary for access control
+    if not hasattr(app, 'user_files'):
+        app.user_files = {}
+    app.user_files[current_user.id] = app.user_files.get(current_user.id, []) + [filename]
+
+def write_report_csv(file_path, body_path, data:dict, solar_array, battery, results_aggregated:dict):
+    """
+    Write the report: metadata lines followed by the simulation output CSV already written to body_path (which is removed)
+    """
+    metadata = [
+        f"Number of Panels: {solar_array.panel_num}",
+        f"Battery Size (kWh): {battery.usable_energy_kwh}",
+        f"Date Range: {data['start_datetime']} to {data['end_datetime']}",
+        f"Total Imported Energy (kWh): {results_aggregated['sum_import_kwh']}",
+        f"Total Exported Energy (kWh): {results_aggregated['sum_export_kwh']}",
+        f"Total Consumption (kWh): {results_aggregated['sim_consumed_kwh']}",
+        f"Total Production (kWh): {results_aggregated['sim_produced_kwh']}",
+        f"Grid Dependence (%): {results_aggregated['grid_dependence']:.2f}",
+        f"Solar Savings ($): {results_aggregated['solar_savings_dollars']:.2f}",
+        f"Battery Throughput (kWh): {results_aggregated['batt_throughput_kwh']:.2f}",
+    ]
+
+    with open(file_path, 'w') as report_file:
+        report_file.write('\n'.join(metadata) + '\n\n')
+        with open(body_path, 'r') as body_file:
+            shutil.copyfileobj(body_file, report_file)
+    os.remove(body_path)
+
+def build_grid(data:dict) -> solar_sim.Grid:
+    return solar_sim.Grid(initial_credits=data['initial_credits'],  # Pass initial_credits to Grid
+                          weekday_on_peak_start=data['grid_weekday_on_peak_start'],
+                          weekday_on_peak_end=data['grid_weekday_on_peak_end'],
+                          weekend_on_peak_start=data['grid_weekend_on_peak_start'],
+                          weekend_on_peak_end=data['grid_weekend_on_peak_end'],
+                          weekday_off_peak_cost_per_kwh=data['grid_weekday_off_peak_cost_per_kwh'],
+                          weekday_on_peak_cost_per_kwh=data['grid_weekday_on_peak_cost_per_kwh'],
+                          weekend_off_peak_cost_per_kwh=data['grid_weekend_off_peak_cost_per_kwh'],
+                          weekend_on_peak_cost_per_kwh=data['grid_weekend_on_peak_cost_per_kwh'],
+                          weekday_off_peak_gen_pay_per_kwh=data['grid_weekday_off_peak_gen_pay_per_kwh'],
+                          weekday_on_peak_gen_pay_per_kwh=data['grid_weekday_on_peak_gen_pay_per_kwh'],
+                          weekday_off_peak_creditable_per_kwh=data['grid_weekday_off_peak_creditable_per_kwh'],
+                          weekday_on_peak_creditable_per_kwh=data['grid_weekday_on_peak_creditable_per_kwh'],
+                          weekend_off_peak_gen_pay_per_kwh=data['grid_weekend_off_peak_gen_pay_per_kwh'],
+                          weekend_on_peak_gen_pay_per_kwh=data['grid_weekend_on_peak_gen_pay_per_kwh'],
+                          weekend_off_peak_creditable_per_kwh=data['grid_weekend_off_peak_creditable_per_kwh'],
+                          weekend_on_peak_creditable_per_kwh=data['grid_weekend_on_peak_creditable_per_kwh'])
+
+def parse_number_list(value:str, num_type=float) -> list:
+    """
+    Convert a comma separated string (e.g. "0, 5, 10") to a sorted list of unique numbers
+    """
+    numbers = sorted(set(num_type(v) for v in value.split(",") if len(v.strip()) > 0))
+    if len(numbers) == 0:
+        raise ValueError("At least one value is required")
+    return numbers
+
+@app.route("/simulation_sweep", methods=["POST"])
+@login_required
+def simulate_sweep():
+    system_id = request.form.get('system_id', None, type=int)
+    if system_id is None:
+        return "{\"Error\":\"system_id was not specified}", 400
+
+    sys_details = db.session.query(SystemDetails).filter((SystemDetails.system_id == system_id) &
+                                           (SystemDetails.user_id == current_user.id)).first()
+    data = parse_simulation_form(request.form, sys_details)
+    try:
+        module_counts = parse_number_list(data['sweep_module_counts'], int)
+        batt_kwh = parse_number_list(data['sweep_batt_usable_energy_kwh'])
+    except ValueError as e:
+        return render_template("simulation_form.html", err_msg=f"Invalid sweep values: {e}", results=None, **data)
+
+    sim_columns, err_msg = load_simulation_data(sys_details, data)
+    if err_msg is None and len(sim_columns) == 0:
+        err_msg = "Error: No data between the times specified!"
+    if err_msg is not None:
+        return render_template("simulation_form.html", err_msg=err_msg, results=None, **data)
+
+    scenarios = solar_sim.sweep_scenarios(module_counts, batt_kwh,
+                                          batt_charge_eff=[data['batt_charge_eff']],
+                                          batt_discharge_eff=[data['batt_discharge_eff']],
+                                          batt_max_c_rate=[data['batt_max_c_rate']])
+    sweep = solar_sim.simulate_sweep(sim_columns, scenarios, build_grid(data),
+                                     sys_details.num_modules, solar_consumption_bias=data['solar_consumption_bias'])
+
+    return render_template("simulation_form.html", err_msg=None, results=None,
+                           sweep_matrix=sweep.savings_matrix(), sweep_percent_matrix=sweep.savings_matrix("percent_solar_savings"), **data)
+
+@app.route("/simulation_optimize", methods=["POST"])
+@login_required
+def simulate_optimize():
+    system_id = request.form.get('system_id', None, type=int)
+    if system_id is None:
+        return "{\"Error\":\"system_id was not specified}", 400
+
+    sys_details = db.session.query(SystemDetails).filter((SystemDetails.system_id == system_id) &
+                                           (SystemDetails.user_id == current_user.id)).first()
+    data = parse_simulation_form(request.form, sys_details)
+    try:
+        opt_fields = {field: float(data[field]) for field in ["opt_panel_cost_dollars", "opt_batt_cost_per_kwh_dollars", "opt_fixed_cost_dollars",
+                                                              "opt_max_module_count", "opt_max_batt_kwh", "opt_batt_kwh_step"]}
+    except ValueError as e:
+        return render_template("simulation_form.html", err_msg=f"Invalid optimizer values: {e}", results=None, **data)
+
+    sim_columns, err_msg = load_simulation_data(sys_details, data)
+    if err_msg is None and len(sim_columns) == 0:
+        err_msg = "Error: No data between the times specified!"
+    if err_msg is not None:
+        return render_template("simulation_form.html", err_msg=err_msg, results=None, **data)
+
+    grid = build_grid(data)
+    baseline_key = solar_sim.BaselineCache.make_key(current_user.id, system_id, data['start_datetime'], data['end_datetime'], sys_details.data_version,
+                                                    grid, data['solar_consumption_bias'])
+    objective = sizing_optimizer.SizingObjective(sim_columns, grid, sys_details.num_modules,
+                                                 panel_cost_dollars=opt_fields['opt_panel_cost_dollars'],
+                                                 batt_cost_per_kwh_dollars=opt_fields['opt_batt_cost_per_kwh_dollars'],
+                                                 fixed_cost_dollars=opt_fields['opt_fixed_cost_dollars'],
+                                                 solar_consumption_bias=data['solar_consumption_bias'],
+                                                 batt_charge_eff=data['batt_charge_eff'],
+                                                 batt_discharge_eff=data['batt_discharge_eff'],
+                                                 batt_max_c_rate=data['batt_max_c_rate'],
+                                                 baseline=baseline_cache.get(baseline_key, sim_columns, grid, data['solar_consumption_bias']))
+    try:
+        optimum = sizing_optimizer.optimize_sizing(objective, max_module_count=int(opt_fields['opt_max_module_count']),
+                                                   max_batt_kwh=opt_fields['opt_max_batt_kwh'],
+                                                   batt_kwh_step=opt_fields['opt_batt_kwh_step'])
+    except ValueError as e:
+        return render_template("simulation_form.html", err_msg=f"Invalid optimizer values: {e}", results=None, **data)
+
+    return render_template("simulation_form.html", err_msg=None, results=None, optimum=optimum.to_dict(), **data)
+
+@app.route("/simulation_report", methods=["POST"])
+@login_required
+def simulate_report():
+    """
+    Simulate and download the CSV report without holding the full series: intervals are
+    read from a server-side cursor and simulated, summarized and written a chunk at a time.
+    """
+    system_id = request.form.get('system_id', None, type=int)
+    if system_id is None:
+        return "{\"Error\":\"system_id was not specified}", 400
+
+    sys_details = db.session.query(SystemDetails).filter((SystemDetails.system_id == system_id) &
+                                           (SystemDetails.user_id == current_user.id)).first()
+    data = parse_simulation_form(request.form, sys_details)
+
+    solar_array, battery = build_devices(data)
+    controller = solar_sim.SimController(panels=solar_array, battery=battery, grid=build_grid(data))
+    aggregates = solar_sim.RunningAggregates()
+    baseline_aggregates = solar_sim.RunningAggregates()
+    filename, file_path = new_report_path(data, solar_array, battery)
+    body_path = file_path + ".part"
+    try:
+        with open(body_path, 'w', newline='') as body_file:
+            chunks = solar_sim.iter_interval_columns(iter_simulation_data(system_id, data))
+            for sim_out, sim_out_no_solar in controller.simulate_stream(chunks, sys_details.num_modules,
+                                                                         solar_consumption_bias=data['solar_consumption_bias'],
+                                                                         baseline_grid=build_grid(data)):
+                sim_out.to_csv(body_file, index=False, header=(aggregates.count_total == 0))
+                aggregates.update(sim_out)
+                baseline_aggregates.update(sim_out_no_solar)
+    except ValueError as e:
+        os.remove(body_path)
+        return render_template("simulation_form.html", err_msg=str(e), results=None, **data)
+
+    if aggregates.count_total == 0:
+        os.remove(body_path)
+        return render_template("simulation_form.html", err_msg="Error: No data between the times specified!", results=None, **data)
+
+    results_aggregated = summarize_results(aggregates, baseline_aggregates, solar_array, battery, sys_details.name)
+    write_report_csv(file_path, body_path, data, solar_array, battery, results_aggregated)
+    register_report(filename)
+    return send_file(file_path, as_attachment=True, download_name=filename)
 
 @app.route("/simulation", methods=["GET", "POST"])
 @login_required
@@ -409,183 +811,31 @@ def simulate():
     sys_details = db.session.query(SystemDetails).filter((SystemDetails.system_id == system_id) &
                                            (SystemDetails.user_id == current_user.id)).first()
     if request.method == "POST":
-        # Get submitted form values
-        data = request.form.to_dict()
-
-        # Add system_name explicitly to the data dictionary
-        data['system_name'] = sys_details.name
-
-        data['start_datetime'] = datetime.strptime(data['start_datetime'], "%Y-%m-%dT%H:%M")
-        data['end_datetime'] = datetime.strptime(data['end_datetime'], "%Y-%m-%dT%H:%M")
-
-        data['grid_weekday_on_peak_start'] = parse_time(data['grid_weekday_on_peak_start'])
-        data['grid_weekday_on_peak_end'] = parse_time(data['grid_weekday_on_peak_end'])
-        data['grid_weekend_on_peak_start'] = parse_time(data['grid_weekend_on_peak_start'])
-        data['grid_weekend_on_peak_end'] = parse_time(data['grid_weekend_on_peak_end'])
-        
-
-        #Convert data to proper data types
-        integer_fields = ["module_count"]
-        for field in integer_fields:
-            data[field] = int(data[field])
-
-        float_fields = ["batt_usable_energy_kwh", "batt_charge_eff", "batt_discharge_eff", "batt_max_c_rate",
-                        "grid_weekday_off_peak_cost_per_kwh", "grid_weekday_on_peak_cost_per_kwh", "grid_weekend_off_peak_cost_per_kwh", "grid_weekend_on_peak_cost_per_kwh",
-                        "grid_weekday_off_peak_gen_pay_per_kwh", "grid_weekday_on_peak_gen_pay_per_kwh", "grid_weekday_off_peak_creditable_per_kwh", "grid_weekday_on_peak_creditable_per_kwh",
-                        "grid_weekend_off_peak_gen_pay_per_kwh", "grid_weekend_on_peak_gen_pay_per_kwh", "grid_weekend_off_peak_creditable_per_kwh", "grid_weekend_on_peak_creditable_per_kwh",
-                        "solar_consumption_bias", "initial_credits"]
-        
-        for field in float_fields:
-            data[field] = float(data[field])
+        data = parse_simulation_form(request.form, sys_details)
+        sim_columns, err_msg = load_simulation_data(sys_details, data)
+        if err_msg is None and len(sim_columns) == 0:
+            err_msg = "Error: No data between the times specified!"
+        if err_msg is not None:
+            return render_template("simulation_form.html", err_msg=err_msg, results=None, **data)
 
-        target_data = db.session.query(HistoricalData).filter((HistoricalData.system_id == system_id) &
-                                           (HistoricalData.user_id == current_user.id) &
-                                           (HistoricalData.timestamp_end > data['start_datetime']) &
-                                           (HistoricalData.timestamp_end <= data['end_datetime'])).order_by(HistoricalData.timestamp_end).all()
-        
-        
-        prev_end = data['start_datetime']
-        for d in target_data:
-            if (d.timestamp_end - prev_end).total_seconds() > d.interval_len_sec+30:
-                #We're missing data!
-                err_msg = f"Error: Missing data between the times specified! {prev_end} --> {d.timestamp_start}"
-                print(err_msg)
-                return render_template("simulation_form.html", err_msg=err_msg, results=None, **data)
-            prev_end = d.timestamp_end
-
-        solar_array = solar_sim.SolarArray(panel_num=data['module_count'])
-        battery = solar_sim.SolarBattery(usable_energy_kwh=data['batt_usable_energy_kwh'],
-                                        charge_eff=data['batt_charge_eff'],
-                                        discharge_eff=data['batt_discharge_eff'],
-                                        max_c_rate=data['batt_max_c_rate'])
-        grid = solar_sim.Grid(initial_credits=data['initial_credits'],  # Pass initial_credits to Grid
-                              weekday_on_peak_start=data['grid_weekday_on_peak_start'],
-                              weekday_on_peak_end=data['grid_weekday_on_peak_end'],
-                              weekend_on_peak_start=data['grid_weekend_on_peak_start'],
-                              weekend_on_peak_end=data['grid_weekend_on_peak_end'],
-                              weekday_off_peak_cost_per_kwh=data['grid_weekday_off_peak_cost_per_kwh'],
-                              weekday_on_peak_cost_per_kwh=data['grid_weekday_on_peak_cost_per_kwh'],
-                              weekend_off_peak_cost_per_kwh=data['grid_weekend_off_peak_cost_per_kwh'],
-                              weekend_on_peak_cost_per_kwh=data['grid_weekend_on_peak_cost_per_kwh'],
-                              weekday_off_peak_gen_pay_per_kwh=data['grid_weekday_off_peak_gen_pay_per_kwh'],
-                              weekday_on_peak_gen_pay_per_kwh=data['grid_weekday_on_peak_gen_pay_per_kwh'],
-                              weekday_off_peak_creditable_per_kwh=data['grid_weekday_off_peak_creditable_per_kwh'],
-                              weekday_on_peak_creditable_per_kwh=data['grid_weekday_on_peak_creditable_per_kwh'],
-                              weekend_off_peak_gen_pay_per_kwh=data['grid_weekend_off_peak_gen_pay_per_kwh'],
-                              weekend_on_peak_gen_pay_per_kwh=data['grid_weekend_on_peak_gen_pay_per_kwh'],
-                              weekend_off_peak_creditable_per_kwh=data['grid_weekend_off_peak_creditable_per_kwh'],
-                              weekend_on_peak_creditable_per_kwh=data['grid_weekend_on_peak_creditable_per_kwh'])
+        solar_array, battery = build_devices(data)
+        grid = build_grid(data)
 
         controller = solar_sim.SimController(panels=solar_array, battery=battery, grid=grid)
-        sim_out = controller.simulate(target_data, sys_details.num_modules, solar_consumption_bias=data['solar_consumption_bias'])
-
-        #Extract some values from solar_array, battery, and grid to get some aggregated values from the simulation
-        sum_generated_energy_kwh = solar_array.lifetime_energy_wh / 1000
-        batt_throughput_kwh = battery.throughput_wh / 1000
-
-        sum_import_kwh = sim_out['imported_wh'].sum()/1000
-        sum_export_kwh = sim_out['exported_wh'].sum()/1000
-        sim_consumed_kwh = sim_out['consumed_wh'].sum()/1000
-        sim_produced_kwh = sim_out['produced_wh'].sum()/1000
-        sum_import_cost = sim_out.iloc[-1]['lifetime_import_cost']
-        sum_export_credits = sim_out['credits_earned'].sum()
-
-        sum_consumption_peak_kwh = sim_out.loc[sim_out['is_peak'], 'consumed_wh'].sum()/1000
-        sum_consumption_offpeak_kwh = sim_out.loc[~sim_out['is_peak'], 'consumed_wh'].sum()/1000
-
-        sum_import_peak_kwh = sim_out.loc[sim_out['is_peak'], 'imported_wh'].sum()/1000
-        sum_import_offpeak_kwh = sim_out.loc[~sim_out['is_peak'], 'imported_wh'].sum()/1000
-
-        sum_export_peak_kwh = sim_out.loc[sim_out['is_peak'], 'exported_wh'].sum()/1000
-        sum_export_offpeak_kwh = sim_out.loc[~sim_out['is_peak'], 'exported_wh'].sum()/1000
-
-        sum_produced_peak_kwh = sim_out.loc[sim_out['is_peak'], 'produced_wh'].sum()/1000
-        sum_produced_offpeak_kwh = sim_out.loc[~sim_out['is_peak'], 'produced_wh'].sum()/1000
-
-        sum_battery_peak_kwh = sim_out.loc[sim_out['is_peak'], 'discharge_wh'].sum()/1000
-        sum_battery_offpeak_kwh = sim_out.loc[~sim_out['is_peak'], 'discharge_wh'].sum()/1000
-
-        sum_import_peak_cost = sim_out.loc[sim_out['is_peak'], 'import_cost'].sum()
-        sum_import_nopeak_cost = sim_out.loc[~sim_out['is_peak'], 'import_cost'].sum()
-
-        sum_import_peak_credits = sim_out.loc[sim_out['is_peak'], 'credits_earned'].sum()
-        sum_import_nopeak_credits = sim_out.loc[~sim_out['is_peak'], 'credits_earned'].sum()
-
-        #Calculate grid dependence (% of time energy was imported from the grid)
-        #Count the number of rows that imported_wh is greater than 0
-        count_imported_wh = (sim_out['imported_wh'] > 0).sum()
-        #Count the number of rows that consumed_wh or imported_wh is greater than 0
-        count_consumed_wh = ((sim_out['consumed_wh'] > 0) | (sim_out['imported_wh'] > 0)).sum()
-        #Calculate the percentage of time energy was imported from the grid
-        grid_dependence = (count_imported_wh / count_consumed_wh) * 100 if count_consumed_wh > 0 else 0
-
-        #Calculate the percentage of time the battery was depleted
-        #Count the number of rows that imported_wh is greater than 0
-        count_battery_depleted = (sim_out['soc'] == 0).sum()
-        #Get total number of rows in the simulation
-        count_total = len(sim_out)
-        batt_depleted_percentage = (count_battery_depleted / count_total) * 100 if battery.usable_energy_wh > 0 else 100
-        
-        #Calculate the percentage of time the battery was saturated
-        count_battery_saturated = (sim_out['soc'] == 1).sum()
-        batt_saturated_percentage = (count_battery_saturated / count_total) * 100
+        sim_out = controller.simulate(sim_columns, sys_details.num_modules, solar_consumption_bias=data['solar_consumption_bias'],
+                                      engine=solar_sim.ENGINE_ARRAY)
 
-
-        #simulate again without any solar panels, without battery. Use to get comparison values
+        #Grid-only comparison values (no solar panels, no battery), cached between what-if runs
         grid.reset_memory()
-        #Note: initial credits are 0
-        no_solar_array = copy.copy(solar_array)
-        no_solar_array.panel_num = 0
-        no_solar_array.reset_memory()
-        no_battery = copy.copy(battery)
-        no_battery.usable_energy_kwh = 0
-        no_battery.reset_memory()
-        controller = solar_sim.SimController(panels=no_solar_array, battery=no_battery, grid=grid)
-        sim_out_no_solar = controller.simulate(target_data, sys_details.num_modules, solar_consumption_bias=data['solar_consumption_bias'])
-
-        sum_import_peak_cost_no_solar = sim_out_no_solar.loc[sim_out_no_solar['is_peak'], 'import_cost'].sum()
-        sum_import_nopeak_cost_no_solar = sim_out_no_solar.loc[~sim_out_no_solar['is_peak'], 'import_cost'].sum()
-
-        solar_savings_dollars = sim_out_no_solar['import_cost'].sum() - sim_out['import_cost'].sum()
-        percent_solar_savings =  100*solar_savings_dollars / sim_out_no_solar['import_cost'].sum()
-        
+        baseline_key = solar_sim.BaselineCache.make_key(current_user.id, system_id, data['start_datetime'], data['end_datetime'], sys_details.data_version,
+                                                        grid, data['solar_consumption_bias'])
+        sim_out_no_solar = baseline_cache.get(baseline_key, sim_columns, grid, data['solar_consumption_bias'])
 
-        results_aggregated = {
-            "system_name": sys_details.name,
-            "sum_import_kwh": sum_import_kwh,
-            "sum_export_kwh": sum_export_kwh,
-            "sim_consumed_kwh": sim_consumed_kwh,
-            "sim_produced_kwh": sim_produced_kwh,
-            "sum_import_cost": sum_import_cost,
-            "sum_export_credits": sum_export_credits,
-            "credits_remaining": sim_out.iloc[-1]['credits_available'],
-            "batt_throughput_kwh": batt_throughput_kwh,
-            "sum_generated_energy_kwh": sum_generated_energy_kwh,
-            "grid_dependence": grid_dependence,
-            "solar_savings_dollars": solar_savings_dollars,
-            "percent_solar_savings": percent_solar_savings,
-            "batt_depleted_percentage": batt_depleted_percentage,
-            "batt_saturated_percentage": batt_saturated_percentage,
-
-            "sum_consumption_peak_kwh": sum_consumption_peak_kwh,
-            "sum_consumption_offpeak_kwh": sum_consumption_offpeak_kwh,
-            "sum_import_peak_kwh": sum_import_peak_kwh,
-            "sum_import_offpeak_kwh": sum_import_offpeak_kwh,
-            "sum_export_peak_kwh": sum_export_peak_kwh,
-            "sum_export_offpeak_kwh": sum_export_offpeak_kwh,
-            "sum_produced_peak_kwh": sum_produced_peak_kwh,
-            "sum_produced_offpeak_kwh": sum_produced_offpeak_kwh,
-            "sum_battery_peak_kwh": sum_battery_peak_kwh,
-            "sum_battery_offpeak_kwh": sum_battery_offpeak_kwh,
-
-            "sum_import_peak_cost": sum_import_peak_cost,
-            "sum_import_nopeak_cost": sum_import_nopeak_cost,
-            "sum_import_peak_credits": sum_import_peak_credits,
-            "sum_import_nopeak_credits":sum_import_nopeak_credits,
-
-            "sum_import_peak_cost_no_solar": sum_import_peak_cost_no_solar,
-            "sum_import_nopeak_cost_no_solar": sum_import_nopeak_cost_no_solar,
-        }
+        aggregates = solar_sim.RunningAggregates()
+        aggregates.update(sim_out)
+        baseline_aggregates = solar_sim.RunningAggregates()
+        baseline_aggregates.update(sim_out_no_solar)
+        results_aggregated = summarize_results(aggregates, baseline_aggregates, solar_array, battery, sys_details.name)
 
         # Calculate time differences in hours
         time_deltas = sim_out["timestamp"].diff().dt.total_seconds() / 3600
@@ -609,38 +859,11 @@ def simulate():
         }
 
         # Change the generated report filename to be dynamic
-        current_timestamp = datetime.now().strftime("%m.%d.%Y_%H.%M.%S")
-        start_date = data['start_datetime'].strftime("%m.%d.%Y")
-        end_date = data['end_datetime'].strftime("%m.%d.%Y")
-        filename = f"{current_timestamp}_from_{start_date}_to_{end_date}_{solar_array.panel_num}panels_{battery.usable_energy_kwh}kWh.csv"
-        file_path = os.path.join(app.config["REPORTS_FOLDER"], filename)
-
-        # Save the file path and user ID in a dictionary for access control
-        if not hasattr(app, 'user_files'):
-            app.user_files = {}
-        app.user_files[current_user.id] = app.user_files.get(current_user.id, []) + [filename]
-
-        sim_out.to_csv(file_path, index=False)
-
+        filename, file_path = new_report_path(data, solar_array, battery)
+        sim_out.to_csv(file_path + ".part", index=False)
         # Add metadata to the top of the CSV file
-        metadata = [
-            f"Number of Panels: {solar_array.panel_num}",
-            f"Battery Size (kWh): {battery.usable_energy_kwh}",
-            f"Date Range: {data['start_datetime']} to {data['end_datetime']}",
-            f"Total Imported Energy (kWh): {results_aggregated['sum_import_kwh']}",
-            f"Total Exported Energy (kWh): {results_aggregated['sum_export_kwh']}",
-            f"Total Consumption (kWh): {results_aggregated['sim_consumed_kwh']}",
-            f"Total Production (kWh): {results_aggregated['sim_produced_kwh']}",
-            f"Grid Dependence (%): {results_aggregated['grid_dependence']:.2f}",
-            f"Solar Savings ($): {results_aggregated['solar_savings_dollars']:.2f}",
-            f"Battery Throughput (kWh): {results_aggregated['batt_throughput_kwh']:.2f}",
-        ]
-
-        with open(file_path, 'r') as original_file:
-            original_content = original_file.read()
-
-        with open(file_path, 'w') as updated_file:
-            updated_file.write('\n'.join(metadata) + '\n\n' + original_content)
+        write_report_csv(file_path, file_path + ".part", data, solar_array, battery, results_aggregated)
+        register_report(filename)
 
         return render_template("simulation_form.html", err_msg=None, results=json.dumps(results_aggregated), filename=filename, **data)
     
@@ -701,7 +924,15 @@ def simulate():
         "grid_weekend_on_peak_creditable_per_kwh":0.17885,
         "start_datetime": formatted_start,
         "end_datetime": formatted_end,
-        "initial_credits": 0.0  # Default value for initial credits
+        "initial_credits": 0.0,  # Default value for initial credits
+        "sweep_module_counts": f"0, {sys_details.num_modules}, {sys_details.num_modules + 10}",
+        "sweep_batt_usable_energy_kwh": "0, 5, 10, 15",
+        "opt_panel_cost_dollars": 300.0,
+        "opt_batt_cost_per_kwh_dollars": 600.0,
+        "opt_fixed_cost_dollars": 2000.0,
+        "opt_max_module_count": 2*sys_details.num_modules,
+        "opt_max_batt_kwh": 30.0,
+        "opt_batt_kwh_step": 2.5,
     }
 
     return render_template("simulation_form.html", err_msg=None, results=None, **initial_values)
@@ -775,4 +1006,5 @@ if __name__ == '__main__':
     with app.app_context():
         # db.drop_all()
         db.create_all()  # Create database tables
+        upgrade_schema()
     app.run(debug=True, port=5000)
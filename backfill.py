@@ -0,0 +1,247 @@
+"""
+Background backfill of missing data weeks.
+
+Per-week fetch jobs are queued in the database (BackfillJob) and run one at a time by
+BackfillScheduler, within the per-minute and monthly API limits. Several processes may each
+run a scheduler on the same database: a job is claimed with one conditional UPDATE, so only
+one of them runs it. Jobs left running longer than STALE_AFTER (e.g. by a stopped process)
+are queued again, so the queue resumes after a restart.
+"""
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from db_models import db, BackfillJob
+from api_quota import QuotaExceededError
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+MAX_ATTEMPTS = 3
+STALE_AFTER = timedelta(minutes=15) # Far longer than one week's fetch takes
+
+def month_start(time:datetime) -> datetime:
+    return datetime(time.year, time.month, 1)
+
+def next_month_start(time:datetime) -> datetime:
+    return (month_start(time) + timedelta(days=32)).replace(day=1)
+
+def queue_weeks(user_id:int, system_id:int, weeks, now=None) -> int:
+    """
+    Queue a fetch of each week in weeks: [(week start (as in week_coverage), API calls the fetch needs)].
+    Weeks already queued or running keep their place; finished weeks are queued again at the end.
+    Returns the number of weeks queued.
+    """
+    now = now if now is not None else datetime.now()
+    existing = {job.week_start: job for job in BackfillJob.query.filter((BackfillJob.system_id == system_id) &
+                                                                          BackfillJob.week_start.in_([week_start for week_start, _ in weeks]))}
+    queued = 0
+    for week_start, api_calls in weeks:
+        job = existing.get(week_start)
+        if job is None:
+            db.session.add(BackfillJob(user_id=user_id, system_id=system_id, week_start=week_start, status=QUEUED,
+                                       api_calls=api_calls, attempts=0, queued_at=now))
+        elif job.status in (DONE, FAILED):
+            job.status = QUEUED
+            job.user_id = user_id
+            job.api_calls = api_calls
+            job.attempts = 0
+            job.error = None
+            job.queued_at = now
+            job.finished_at = None
+        else:
+            continue
+        queued += 1
+    db.session.commit()
+    return queued
+
+def cancel_queued(system_id:int) -> int:
+    """
+    Remove the system's jobs that have not started. Returns the number removed.
+    """
+    removed = BackfillJob.query.filter((BackfillJob.system_id == system_id) & (BackfillJob.status == QUEUED)).delete()
+    db.session.commit()
+    return removed
+
+def pending_jobs():
+    """
+    Running and queued jobs of all systems, in the order they run
+    """
+    running = BackfillJob.query.filter(BackfillJob.status == RUNNING).order_by(BackfillJob.queued_at, BackfillJob.id).all()
+    queued = BackfillJob.query.filter(BackfillJob.status == QUEUED).order_by(BackfillJob.queued_at, BackfillJob.id).all()
+    return running + queued
+
+def estimate_schedule(jobs, calls_per_minute:float, remaining_this_month:int, monthly_budget:int, now:datetime):
+    """
+    Estimated finish time of each job, run in order at calls_per_minute. Jobs that do not fit in
+    the calls remaining this month wait for the next month, which has monthly_budget calls.
+    """
+    finish_times = []
+    time = now
+    remaining = remaining_this_month
+    for job in jobs:
+        if job.api_calls > remaining:
+            time = max(time, next_month_start(time))
+            remaining = monthly_budget
+        remaining -= job.api_calls
+        time = time + timedelta(minutes=job.api_calls / calls_per_minute)
+        finish_times.append(time)
+    return finish_times
+
+def queue_status(system_id:int, calls_per_minute:float, quota, now=None) -> list:
+    """
+    Pending jobs of the system: [{'week_start', 'status', 'position' (1 is running or next), 'eta', 'error'}],
+    followed by its failed jobs (position and eta None) until they are queued again.
+    quota is the api_quota.QuotaLedger the fetches are counted in.
+    """
+    now = now if now is not None else datetime.now()
+    jobs = pending_jobs()
+    finish_times = estimate_schedule(jobs, calls_per_minute, quota.remaining_background(now), quota.background_budget, now)
+    failed = BackfillJob.query.filter((BackfillJob.system_id == system_id) & (BackfillJob.status == FAILED)).order_by(BackfillJob.week_start)
+    return ([{'week_start': job.week_start, 'status': job.status, 'position': position + 1, 'eta': finish_time, 'error': job.error}
+             for position, (job, finish_time) in enumerate(zip(jobs, finish_times)) if job.system_id == system_id] +
+            [{'week_start': job.week_start, 'status': job.status, 'position': None, 'eta': None, 'error': job.error} for job in failed])
+
+class BackfillScheduler:
+    """
+    Runs queued BackfillJobs one at a time in a background thread. fetch_week(job) fetches and
+    stores the job's week (raising on failure) inside an app context; its API calls are spaced
+    by the caller's rate limiter and counted in quota (an api_quota.QuotaLedger). No job is
+    started unless its calls fit in the month's background quota, and jobs refused with
+    QuotaExceededError wait for more quota. Failed jobs are retried up to MAX_ATTEMPTS times.
+    """
+    def __init__(self, app, fetch_week, calls_per_minute:float, quota, poll_interval_sec=60) -> None:
+        self.app = app
+        self.fetch_week = fetch_week
+        self.calls_per_minute = calls_per_minute
+        self.quota = quota
+        self.poll_interval_sec = poll_interval_sec
+        self.thread = None
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.start_lock = threading.Lock()
+
+    def recover(self, now=None) -> int:
+        """
+        Queue jobs again that have been running for longer than STALE_AFTER, i.e. whose process stopped.
+        Jobs other processes are running are left alone.
+        """
+        now = now if now is not None else datetime.now()
+        recovered = BackfillJob.query.filter((BackfillJob.status == RUNNING) &
+                                             (BackfillJob.started_at.is_(None) | (BackfillJob.started_at < now - STALE_AFTER))
+                                             ).update({BackfillJob.status: QUEUED}, synchronize_session=False)
+        db.session.commit()
+        return recovered
+
+    def next_job(self, now=None):
+        """
+        Next queued job, or None if there is none or it does not fit in this month's quota
+        """
+        job = BackfillJob.query.filter(BackfillJob.status == QUEUED).order_by(BackfillJob.queued_at, BackfillJob.id).first()
+        if job is None or job.api_calls > self.quota.remaining_background(now):
+            return None
+        return job
+
+    def claim(self, job, now=None) -> bool:
+        """
+        Mark a queued job running. False if another scheduler claimed (or someone removed) it first.
+        """
+        now = now if now is not None else datetime.now()
+        claimed = BackfillJob.query.filter((BackfillJob.id == job.id) & (BackfillJob.status == QUEUED)).update(
+                                            {BackfillJob.status: RUNNING, BackfillJob.attempts: BackfillJob.attempts + 1,
+                                             BackfillJob.started_at: now}, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def run_once(self, now=None):
+        """
+        Run the next job. Returns it, or None if nothing could be run.
+        """
+        while True:
+            job = self.next_job(now)
+            if job is None:
+                return None
+            if self.claim(job, now):
+                break
+            db.session.expire_all() #Taken by another scheduler: look again
+        db.session.refresh(job)
+
+        job_id = job.id
+        deferred = False
+        try:
+            self.fetch_week(job)
+            error = None
+        except QuotaExceededError as e:
+            db.session.rollback()
+            deferred = True
+            error = str(e)[:500]
+        except Exception as e:
+            db.session.rollback()
+            traceback.print_exc()
+            error = f"{type(e).__name__}: {e}"[:500]
+
+        job = db.session.get(BackfillJob, job_id)
+        if job is None:
+            return None #Removed while running
+        finished_at = now if now is not None else datetime.now()
+        if deferred:
+            #Not the job's fault: keep its place and attempts until there is quota again
+            job.status = QUEUED
+            job.attempts -= 1
+            job.error = error
+            db.session.commit()
+            return None
+        if error is None:
+            job.status = DONE
+        elif job.attempts >= MAX_ATTEMPTS:
+            job.status = FAILED
+        else:
+            job.status = QUEUED
+            job.queued_at = finished_at #Retry after the rest of the queue
+        job.error = error
+        job.finished_at = finished_at
+        db.session.commit()
+        return job
+
+    def run(self) -> None:
+        with self.app.app_context():
+            while not self.stop_event.is_set():
+                try:
+                    self.recover()
+                    job = self.run_once()
+                except Exception:
+                    traceback.print_exc()
+                    db.session.rollback()
+                    job = None
+                db.session.remove()
+                if job is None:
+                    #Idle or out of budget: wait for new jobs (or check again later, e.g. in a new month)
+                    self.wake_event.wait(self.poll_interval_sec)
+                    self.wake_event.clear()
+
+    def start(self) -> None:
+        """
+        Start the background thread unless it is running (safe to call repeatedly, e.g. on every request)
+        """
+        with self.start_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self.run, name="backfill", daemon=True)
+                self.thread.start()
+
+    def notify(self) -> None:
+        """
+        Call after queueing jobs
+        """
+        self.wake_event.set()
+
+    def stop(self, timeout=None) -> None:
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def queue_status(self, system_id:int, now=None) -> list:
+        return queue_status(system_id, self.calls_per_minute, self.quota, now)
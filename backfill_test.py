@@ -0,0 +1,141 @@
+import unittest
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from db_models import db, BackfillJob
+from db_models_test import make_app
+from api_quota import QuotaLedger, QuotaExceededError
+import backfill
+
+class TestBackfillQueue(unittest.TestCase):
+    def setUp(self):
+        self.app = make_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.now = datetime(2025, 3, 10, 12)
+        self.weeks = [datetime(2025, 1, 1), datetime(2025, 1, 8), datetime(2025, 1, 15)]
+        self.fetched = []
+        self.failing = set()
+        fd, self.quota_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.quota = QuotaLedger(self.quota_path, monthly_limit=25, interactive_reserve=5)
+        self.scheduler = backfill.BackfillScheduler(self.app, self.fetch_week, calls_per_minute=8, quota=self.quota)
+        self.fetch_time = self.now
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        os.remove(self.quota_path)
+
+    def costs(self, weeks, api_calls):
+        return [(week, api_calls) for week in weeks]
+
+    def fetch_week(self, job):
+        self.quota.record("production_meter", job.user_id, calls=job.api_calls, background=True, now=self.fetch_time)
+        if job.week_start in self.failing:
+            raise ValueError("Unable to get production data!")
+        self.fetched.append((job.system_id, job.week_start))
+
+    def test_queue_order_position_and_eta(self):
+        self.assertEqual(backfill.queue_weeks(1, 7, self.costs(self.weeks, 4), now=self.now), 3)
+        self.assertEqual(backfill.queue_weeks(1, 8, [(datetime(2025, 1, 1), 9)], now=self.now + timedelta(seconds=1)), 1)
+        self.assertEqual(backfill.queue_weeks(1, 7, self.costs(self.weeks[:1], 4)), 0) # Already queued
+
+        status = self.scheduler.queue_status(7, now=self.now)
+        self.assertEqual([entry['week_start'] for entry in status], self.weeks)
+        self.assertEqual([entry['position'] for entry in status], [1, 2, 3])
+        self.assertEqual([entry['eta'] for entry in status], [self.now + timedelta(seconds=30*i) for i in (1, 2, 3)])
+
+        #20 calls per month: the fourth job waits for April
+        other = self.scheduler.queue_status(8, now=self.now)
+        self.assertEqual(other[0]['position'], 4)
+        self.assertEqual(other[0]['eta'], datetime(2025, 4, 1) + timedelta(seconds=67.5))
+
+    def test_run_in_order_within_budget(self):
+        backfill.queue_weeks(1, 7, self.costs(self.weeks, 8), now=self.now)
+        self.assertEqual(self.scheduler.run_once(now=self.now).status, backfill.DONE)
+        self.assertEqual(self.scheduler.run_once(now=self.now).status, backfill.DONE)
+        self.assertIsNone(self.scheduler.run_once(now=self.now)) # 16 of 20 background calls used
+        self.assertEqual(self.fetched, [(7, week) for week in self.weeks[:2]])
+        self.assertEqual(self.quota.used(self.now), 16)
+
+        self.fetch_time = datetime(2025, 4, 1)
+        self.assertEqual(self.scheduler.run_once(now=self.fetch_time).week_start, self.weeks[2])
+        self.assertEqual(self.scheduler.queue_status(7, now=self.now), [])
+
+    def test_refused_by_quota_is_deferred(self):
+        backfill.queue_weeks(1, 7, self.costs(self.weeks[:1], 4), now=self.now)
+        self.quota.record("summary", 1, calls=18, now=self.now) # Interactive calls leave 2 background calls
+        self.scheduler.quota = QuotaLedger(self.quota_path, monthly_limit=25, interactive_reserve=0) # Passes the scheduler, refused by the fetch
+        self.assertIsNone(self.scheduler.run_once(now=self.now))
+        job = BackfillJob.query.one()
+        self.assertEqual((job.status, job.attempts), (backfill.QUEUED, 0))
+        self.assertIn("reserved for interactive use", job.error)
+        self.assertRaises(QuotaExceededError, self.quota.check_background, 4, self.now)
+
+    def test_failed_jobs_are_retried_then_given_up(self):
+        self.quota.monthly_limit = 1000
+        self.failing.add(self.weeks[0])
+        backfill.queue_weeks(1, 7, self.costs(self.weeks[:2], 4), now=self.now)
+
+        job = self.scheduler.run_once(now=self.now + timedelta(minutes=1))
+        self.assertEqual((job.week_start, job.status, job.attempts), (self.weeks[0], backfill.QUEUED, 1))
+        self.assertIn("Unable to get production data!", job.error)
+        self.assertEqual(self.scheduler.run_once(now=self.now).week_start, self.weeks[1]) # The retry went to the back
+        for _ in range(backfill.MAX_ATTEMPTS - 1):
+            job = self.scheduler.run_once(now=self.now)
+        self.assertEqual((job.status, job.attempts), (backfill.FAILED, backfill.MAX_ATTEMPTS))
+        self.assertIsNone(self.scheduler.run_once(now=self.now))
+        failed = self.scheduler.queue_status(7, now=self.now)
+        self.assertEqual([(entry['week_start'], entry['status'], entry['position']) for entry in failed],
+                         [(self.weeks[0], backfill.FAILED, None)])
+        self.assertIn("Unable to get production data!", failed[0]['error'])
+
+        self.failing.clear()
+        self.assertEqual(backfill.queue_weeks(1, 7, self.costs(self.weeks, 4), now=self.now), 3) # Failed and done weeks are queued again
+        self.assertEqual(db.session.get(BackfillJob, job.id).attempts, 0)
+
+    def test_resume_after_restart(self):
+        backfill.queue_weeks(1, 7, self.costs(self.weeks, 4), now=self.now)
+        self.assertTrue(self.scheduler.claim(self.scheduler.next_job(), now=self.now)) # Interrupted by a restart
+        self.assertEqual(self.scheduler.recover(now=self.now + timedelta(minutes=1)), 0) # Maybe running in another process
+        self.assertEqual(self.scheduler.next_job().week_start, self.weeks[1])
+        self.assertEqual(self.scheduler.recover(now=self.now + backfill.STALE_AFTER + timedelta(minutes=1)), 1)
+        self.assertEqual(self.scheduler.next_job().week_start, self.weeks[0])
+
+        self.assertEqual(backfill.cancel_queued(7), 3)
+        self.assertEqual(BackfillJob.query.count(), 0)
+
+    def test_job_is_claimed_once(self):
+        self.quota.monthly_limit = 1000
+        backfill.queue_weeks(1, 7, self.costs(self.weeks[:2], 4), now=self.now)
+        other = backfill.BackfillScheduler(self.app, self.fetch_week, calls_per_minute=8, quota=self.quota)
+        job = self.scheduler.next_job(now=self.now)
+        self.assertEqual(other.next_job(now=self.now).id, job.id) # Both schedulers see the same next job
+        self.assertTrue(other.claim(job, now=self.now))
+        self.assertFalse(self.scheduler.claim(job, now=self.now))
+
+        self.assertEqual(self.scheduler.run_once(now=self.now).week_start, self.weeks[1]) # Skips the claimed job
+        self.assertIsNone(self.scheduler.run_once(now=self.now))
+        self.assertEqual(self.fetched, [(7, self.weeks[1])])
+
+    def test_background_thread(self):
+        backfill.queue_weeks(1, 7, self.costs(self.weeks, 4), now=self.now)
+        self.quota.monthly_limit = 1000
+        self.fetch_time = None
+        self.scheduler.poll_interval_sec = 0.05
+        self.scheduler.start()
+        try:
+            for _ in range(100):
+                if len(self.fetched) == len(self.weeks):
+                    break
+                self.scheduler.stop_event.wait(0.05)
+        finally:
+            self.scheduler.stop(timeout=5)
+        self.assertEqual(self.fetched, [(7, week) for week in self.weeks])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,8 @@ from flask_login import UserMixin
 from sqlalchemy.ext.hybrid import hybrid_property
 from datetime import timedelta
 
+import week_coverage
+
 db = SQLAlchemy()
 
 
@@ -18,6 +20,7 @@ class User(db.Model, UserMixin):
 # User-Specific data
 class SystemDetails(db.Model):
     __tablename__ = 'systemdetails'
+    __table_args__ = (db.Index('ix_systemdetails_user_system', 'user_id', 'system_id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign Key
     system_id = db.Column(db.Integer, nullable=False)
@@ -26,11 +29,31 @@ class SystemDetails(db.Model):
     operational_at = db.Column(db.DateTime, nullable=False)
     battery_capacity_wh = db.Column(db.Integer, nullable=False)
     size_watt = db.Column(db.Integer, nullable=False)
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped whenever HistoricalData is ingested
+
+# Bits of HistoricalData.endpoint_mask: the telemetry endpoints a row's values have been stored from.
+# Systems without a battery have no battery endpoint, so their rows always carry BATTERY_DATA.
+PRODUCTION_DATA = 1
+CONSUMPTION_DATA = 2
+IMPORT_DATA = 4
+EXPORT_DATA = 8
+BATTERY_DATA = 16
+ALL_DATA = PRODUCTION_DATA | CONSUMPTION_DATA | IMPORT_DATA | EXPORT_DATA | BATTERY_DATA
+DATA_FIELDS = {PRODUCTION_DATA: ('production_wh',),
+               CONSUMPTION_DATA: ('consumption_wh',),
+               IMPORT_DATA: ('import_wh',),
+               EXPORT_DATA: ('export_wh',),
+               BATTERY_DATA: ('batt_charge_wh', 'batt_discharge_wh')}
 
 # Requires 5 API calls to populate each week (if battery is present)
 # Free API is 10 calls/min or 1000 calls/month
 #  This means: access 2 weeks/minute, access 200 weeks/month
+#
+# Queries filter on system_id (and user_id) and a timestamp_end range, so both indexes end in timestamp_end.
+# There is at most one interval per system and end time.
 class HistoricalData(db.Model):
+    __table_args__ = (db.Index('ux_historicaldata_system_time', 'system_id', 'timestamp_end', unique=True),
+                      db.Index('ix_historicaldata_user_system_time', 'user_id', 'system_id', 'timestamp_end'))
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign Key
     system_id = db.Column(db.Integer, db.ForeignKey('systemdetails.system_id'), nullable=True)
@@ -42,9 +65,115 @@ class HistoricalData(db.Model):
     export_wh = db.Column(db.Integer, nullable=False)
     batt_charge_wh = db.Column(db.Integer, nullable=False)
     batt_discharge_wh = db.Column(db.Integer, nullable=False)
+    endpoint_mask = db.Column(db.Integer, nullable=False, default=ALL_DATA, server_default=str(ALL_DATA))  # Fields filled in (*_DATA bits)
 
     @hybrid_property
     def timestamp_start(self):
         """Calculated field: start time"""
         return self.timestamp_end - timedelta(seconds=self.interval_len_sec)
 
+# Coverage of each data week (see week_coverage.py), kept up to date by update_week_coverage
+# whenever HistoricalData is written, so pages can list populated weeks without scanning intervals.
+# Only intervals holding data from every endpoint (ALL_DATA) count.
+class WeekCoverage(db.Model):
+    __tablename__ = 'week_coverage'
+    __table_args__ = (db.Index('ux_weekcoverage_system_week', 'system_id', 'week_start', unique=True),)
+    id = db.Column(db.Integer, primary_key=True)
+    system_id = db.Column(db.Integer, nullable=False)
+    week_start = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    first_timestamp_end = db.Column(db.DateTime, nullable=False)
+    last_timestamp_end = db.Column(db.DateTime, nullable=False)
+    max_gap_sec = db.Column(db.Float, nullable=False)
+    complete = db.Column(db.Boolean, nullable=False)
+
+# Queued fetch of one data week from the Enphase API, run in the background by backfill.BackfillScheduler.
+# Kept in the database so the queue survives restarts. One row per system and week; finished rows are requeued.
+class BackfillJob(db.Model):
+    __tablename__ = 'backfill_job'
+    __table_args__ = (db.Index('ux_backfilljob_system_week', 'system_id', 'week_start', unique=True),
+                      db.Index('ix_backfilljob_status_queued', 'status', 'queued_at'))
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign Key
+    system_id = db.Column(db.Integer, nullable=False)
+    week_start = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done or failed
+    api_calls = db.Column(db.Integer, nullable=False)  # API calls used by each attempt
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(500), nullable=True)
+    queued_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)  # When the running attempt was claimed
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+def update_week_coverage(system_id, first_time, last_time):
+    """
+    Recompute WeekCoverage for every week holding an interval end time between first_time and last_time
+    after HistoricalData in that range was written or deleted. Commit afterwards, with the data.
+    """
+    week_starts = week_coverage.week_start_days(week_coverage.week_start_of(first_time), week_coverage.week_start_of(last_time))
+    final_stop = week_coverage.next_week_start(week_starts[-1])
+    timestamps = [row[0] for row in db.session.query(HistoricalData.timestamp_end).filter(
+                                                        (HistoricalData.system_id == system_id) &
+                                                        (HistoricalData.endpoint_mask == ALL_DATA) &
+                                                        (HistoricalData.timestamp_end > week_starts[0]) &
+                                                        (HistoricalData.timestamp_end <= final_stop)).order_by(HistoricalData.timestamp_end)]
+    stats = week_coverage.week_stats(week_starts, final_stop, timestamps)
+
+    WeekCoverage.query.filter((WeekCoverage.system_id == system_id) &
+                              (WeekCoverage.week_start >= week_starts[0]) &
+                              (WeekCoverage.week_start <= week_starts[-1])).delete()
+    for i, week_start in enumerate(week_starts):
+        if stats["row_count"][i] > 0:
+            db.session.add(WeekCoverage(system_id=system_id, week_start=week_start,
+                                        row_count=int(stats["row_count"][i]),
+                                        first_timestamp_end=stats["first_timestamp_end"][i].item(),
+                                        last_timestamp_end=stats["last_timestamp_end"][i].item(),
+                                        max_gap_sec=float(stats["max_gap_sec"][i]),
+                                        complete=bool(stats["complete"][i])))
+
+def bump_data_version(system_id):
+    """
+    Mark the system's HistoricalData as changed (invalidates cached history and results). Commit afterwards.
+    """
+    SystemDetails.query.filter_by(system_id=system_id).update({SystemDetails.data_version: SystemDetails.data_version + 1})
+
+def upgrade_schema():
+    """
+    Add columns and indexes introduced since an existing database was created (db.create_all only creates missing tables).
+    Duplicate HistoricalData intervals (same system and end time) are removed first, keeping the most recently inserted.
+    An empty WeekCoverage table is filled from the existing HistoricalData.
+    """
+    inspector = db.inspect(db.engine)
+    table_names = inspector.get_table_names()
+    with db.engine.begin() as conn:
+        if 'systemdetails' in table_names:
+            columns = [column['name'] for column in inspector.get_columns('systemdetails')]
+            if 'data_version' not in columns:
+                conn.execute(db.text("ALTER TABLE systemdetails ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"))
+            for index in SystemDetails.__table__.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+        if 'backfill_job' in table_names:
+            columns = [column['name'] for column in inspector.get_columns('backfill_job')]
+            if 'started_at' not in columns:
+                conn.execute(db.text("ALTER TABLE backfill_job ADD COLUMN started_at DATETIME"))
+
+        if 'historical_data' in table_names:
+            columns = [column['name'] for column in inspector.get_columns('historical_data')]
+            if 'endpoint_mask' not in columns:
+                conn.execute(db.text(f"ALTER TABLE historical_data ADD COLUMN endpoint_mask INTEGER NOT NULL DEFAULT {ALL_DATA}"))
+            index_names = [index['name'] for index in inspector.get_indexes('historical_data')]
+            if 'ux_historicaldata_system_time' not in index_names:
+                conn.execute(db.text("DELETE FROM historical_data WHERE id NOT IN "
+                                     "(SELECT MAX(id) FROM historical_data GROUP BY system_id, timestamp_end)"))
+            for index in HistoricalData.__table__.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+    if 'historical_data' in table_names and 'week_coverage' in table_names and WeekCoverage.query.first() is None:
+        #Coverage table added to a database that already holds data
+        extents = db.session.query(HistoricalData.system_id, db.func.min(HistoricalData.timestamp_end),
+                                   db.func.max(HistoricalData.timestamp_end)).group_by(HistoricalData.system_id).all()
+        for system_id, first_time, last_time in extents:
+            if system_id is not None:
+                update_week_coverage(system_id, first_time, last_time)
+        db.session.commit()
@@ -0,0 +1,161 @@
+import unittest
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from db_models import db, SystemDetails, HistoricalData, WeekCoverage, update_week_coverage, upgrade_schema
+
+def make_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    return app
+
+def query_plan(query) -> str:
+    """
+    SQLite EXPLAIN QUERY PLAN details for a Query or statement, one step per line
+    """
+    statement = getattr(query, 'statement', query)
+    compiled = statement.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = db.session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).all()
+    return "\n".join(row[-1] for row in rows)
+
+class TestHistoricalDataIndexes(unittest.TestCase):
+    def setUp(self):
+        self.app = make_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.start = datetime(2025, 1, 1)
+        self.end = datetime(2025, 1, 8)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def assertIndexed(self, query):
+        plan = query_plan(query)
+        self.assertIn("USING", plan)
+        self.assertNotIn("SCAN historical_data", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_simulation_query(self):
+        self.assertIndexed(db.session.query(HistoricalData).filter((HistoricalData.system_id == 7) &
+                                                                   (HistoricalData.user_id == 1) &
+                                                                   (HistoricalData.timestamp_end > self.start) &
+                                                                   (HistoricalData.timestamp_end <= self.end)).order_by(HistoricalData.timestamp_end))
+
+    def test_history_query(self):
+        self.assertIndexed(db.session.query(HistoricalData.timestamp_end, HistoricalData.production_wh)
+                           .filter((HistoricalData.system_id == 7) & (HistoricalData.user_id == 1)).order_by(HistoricalData.timestamp_end))
+
+    def test_week_coverage_queries(self):
+        self.assertIndexed(HistoricalData.query.filter_by(system_id=7).order_by(HistoricalData.timestamp_end).limit(1))
+        self.assertIndexed(HistoricalData.query.filter((HistoricalData.system_id == 7) &
+                                                       (HistoricalData.timestamp_end > self.start) &
+                                                       (HistoricalData.timestamp_end <= self.end)).order_by(HistoricalData.timestamp_end))
+
+    def test_range_delete(self):
+        delete = db.delete(HistoricalData).where((HistoricalData.system_id == 7) &
+                                                 (HistoricalData.timestamp_end >= self.start) &
+                                                 (HistoricalData.timestamp_end <= self.end))
+        self.assertIndexed(delete)
+
+    def test_system_details_query(self):
+        plan = query_plan(SystemDetails.query.filter((SystemDetails.system_id == 7) & (SystemDetails.user_id == 1)))
+        self.assertNotIn("SCAN systemdetails", plan)
+
+class TestWeekCoverage(unittest.TestCase):
+    def setUp(self):
+        self.app = make_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_intervals(self, first_end, last_end):
+        timestamp_end = first_end
+        while timestamp_end <= last_end:
+            db.session.add(HistoricalData(user_id=1, system_id=7, timestamp_end=timestamp_end, interval_len_sec=900,
+                                          production_wh=0, consumption_wh=0, import_wh=0, export_wh=0,
+                                          batt_charge_wh=0, batt_discharge_wh=0))
+            timestamp_end += timedelta(minutes=15)
+
+    def coverage(self):
+        return [(row.week_start, row.row_count, row.complete)
+                for row in WeekCoverage.query.filter_by(system_id=7).order_by(WeekCoverage.week_start)]
+
+    def test_incremental_update(self):
+        #Jan 1-8 complete, Jan 8-15 missing its last day
+        self.add_intervals(datetime(2025, 1, 1, 0, 15), datetime(2025, 1, 14))
+        update_week_coverage(7, datetime(2025, 1, 1, 0, 15), datetime(2025, 1, 14))
+        db.session.commit()
+        self.assertEqual(self.coverage(), [(datetime(2025, 1, 1), 7*96, True), (datetime(2025, 1, 8), 6*96, False)])
+
+        self.add_intervals(datetime(2025, 1, 14, 0, 15), datetime(2025, 1, 15))
+        update_week_coverage(7, datetime(2025, 1, 14, 0, 15), datetime(2025, 1, 15))
+        db.session.commit()
+        self.assertEqual(self.coverage(), [(datetime(2025, 1, 1), 7*96, True), (datetime(2025, 1, 8), 7*96, True)])
+        row = WeekCoverage.query.filter_by(week_start=datetime(2025, 1, 8)).first()
+        self.assertEqual((row.first_timestamp_end, row.last_timestamp_end, row.max_gap_sec),
+                         (datetime(2025, 1, 8, 0, 15), datetime(2025, 1, 15), 900))
+
+        #Remove an hour from the first week, and everything from the second
+        HistoricalData.query.filter((HistoricalData.timestamp_end > datetime(2025, 1, 3)) &
+                                    (HistoricalData.timestamp_end <= datetime(2025, 1, 3, 1))).delete()
+        HistoricalData.query.filter(HistoricalData.timestamp_end > datetime(2025, 1, 8)).delete()
+        update_week_coverage(7, datetime(2025, 1, 3), datetime(2025, 1, 15))
+        db.session.commit()
+        self.assertEqual(self.coverage(), [(datetime(2025, 1, 1), 7*96 - 4, False)])
+
+    def test_filled_by_upgrade_schema(self):
+        self.add_intervals(datetime(2025, 1, 29, 0, 15), datetime(2025, 2, 8))
+        db.session.commit()
+        upgrade_schema()
+        self.assertEqual(self.coverage(), [(datetime(2025, 1, 29), 3*96, True), (datetime(2025, 2, 1), 7*96, True)])
+
+class TestUpgradeSchema(unittest.TestCase):
+    def setUp(self):
+        self.app = make_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_upgrade_old_database(self):
+        #Schema as created before data_version and the indexes existed
+        with db.engine.begin() as conn:
+            conn.execute(db.text("CREATE TABLE systemdetails (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, system_id INTEGER NOT NULL, "
+                                 "name VARCHAR(500), num_modules INTEGER NOT NULL, operational_at DATETIME NOT NULL, "
+                                 "battery_capacity_wh INTEGER NOT NULL, size_watt INTEGER NOT NULL)"))
+            conn.execute(db.text("CREATE TABLE historical_data (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, system_id INTEGER, "
+                                 "timestamp_end DATETIME NOT NULL, interval_len_sec INTEGER NOT NULL, production_wh INTEGER NOT NULL, "
+                                 "consumption_wh INTEGER NOT NULL, import_wh INTEGER NOT NULL, export_wh INTEGER NOT NULL, "
+                                 "batt_charge_wh INTEGER NOT NULL, batt_discharge_wh INTEGER NOT NULL)"))
+            conn.execute(db.text("INSERT INTO systemdetails VALUES (1, 1, 7, 'home', 10, '2024-01-01 00:00:00', 0, 4000)"))
+            for i, (minutes, production_wh) in enumerate([(15, 1), (30, 2), (15, 3), (45, 4)]):
+                conn.execute(db.text("INSERT INTO historical_data VALUES (:id, 1, 7, :end, 900, :prod, 0, 0, 0, 0, 0)"),
+                             {"id": i+1, "end": datetime(2025, 1, 1) + timedelta(minutes=minutes), "prod": production_wh})
+
+        upgrade_schema()
+        upgrade_schema() #Running again changes nothing
+
+        self.assertEqual(SystemDetails.query.first().data_version, 0)
+        rows = HistoricalData.query.order_by(HistoricalData.timestamp_end).all()
+        self.assertEqual([row.production_wh for row in rows], [3, 2, 4])
+
+        index_names = [index['name'] for index in db.inspect(db.engine).get_indexes('historical_data')]
+        self.assertIn('ux_historicaldata_system_time', index_names)
+        self.assertIn('ix_historicaldata_user_system_time', index_names)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,18 @@
 import webbrowser
 from urllib.parse import urlencode
 import os
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from requests.auth import HTTPBasicAuth
 from datetime import datetime, timedelta
-import time
 from tzlocal import get_localzone
 import pytz
 
+import api_cache
+import api_quota
+import api_session
+import rate_limiter
+
 #Requires a developer account and a registered developer app.
 #
 # Looks for the following environment variables:
@@ -20,33 +25,32 @@ client_id = os.getenv('ENPHASE_CLIENT_ID')
 client_secret = os.getenv('ENPHASE_CLIENT_SECRET')
 
 MAX_API_CALLS_PER_MINUTE = 10 #Free API limit
+# Using over 80% of the API call limit triggers emails. The limiter allows at most
+# burst + rate calls in any minute, and is shared by all processes using the same file.
+# The burst holds a whole week's calls (5 endpoints), so an idle limiter fetches a week at once;
+# back-to-back weeks are limited to the refill rate (3 calls per minute).
+API_BURST_CALLS = 5
+API_CALLS_PER_MINUTE = int(MAX_API_CALLS_PER_MINUTE * 0.8) - API_BURST_CALLS
 
-class APICallFrequencyMonitor():
-    def __init__(self):
-        self.max_calls_per_minute = MAX_API_CALLS_PER_MINUTE
-        self.api_call_history = [] # List to store timestamps of API calls
+api_limiter = rate_limiter.TokenBucketLimiter(os.getenv('ENPHASE_API_RATE_LIMIT_DB', 'api_rate_limit.db'),
+                                              rate_per_minute=API_CALLS_PER_MINUTE, capacity=API_BURST_CALLS, name='enphase_api')
 
-    def record_api_call(self):
-        current_time = datetime.now()
-        # Remove calls older than 1 minute
-        self.api_call_history = [t for t in self.api_call_history if t > current_time - timedelta(minutes=1)]
-        self.api_call_history.append(current_time)
+# Calls made this month, by endpoint and user. Telemetry fetches leave a reserve for interactive calls.
+api_quota_ledger = api_quota.QuotaLedger(os.getenv('ENPHASE_API_QUOTA_DB', 'api_quota.db'))
 
-    def can_make_api_call(self) -> bool:
-        # Using over 80% of the API call limit triggers emails
-        return len(self.api_call_history) < (self.max_calls_per_minute * 0.8)
-    
-    def wait_for_next_api_call_and_record(self):
-        if not self.can_make_api_call():
-            # Calculate how long to wait until we can make the next API call
-            oldest_call_time = self.api_call_history[0]
-            wait_time = (oldest_call_time + timedelta(minutes=1)) - datetime.now()
-            if wait_time.total_seconds() > 0:
-                print(f"Waiting for {wait_time.total_seconds()} seconds until next API call.")
-                time.sleep(wait_time.total_seconds())
-        self.record_api_call()
-
-api_monitor = APICallFrequencyMonitor()
+def wait_for_api_call(endpoint:str, token_dictionary:dict, background=False):
+    """
+    Count the call in the monthly ledger, then wait for a rate limiter slot.
+    Background calls raise api_quota.QuotaExceededError instead once they would use the interactive reserve.
+    """
+    api_quota_ledger.record(endpoint, token_dictionary.get('user_id'), background=background)
+    api_limiter.acquire()
+
+# Raw telemetry responses of completed periods are kept here and never requested again
+response_cache = api_cache.ResponseCache(os.getenv('ENPHASE_API_CACHE_DIR', 'api_cache'))
+
+# One pooled keep-alive session for every call (ENPHASE_API_BASE_URL points it at a stand-in server)
+http_session = api_session.ApiSession()
 
 # Ensure that the environment variables are set
 if not api_key or not client_id or not client_secret:
@@ -68,7 +72,7 @@ def get_initialize_auth_url(redirect_uri: str):
     if redirect_uri is None or len(redirect_uri) == 0:
         raise ValueError(f"redirect_uri input must be populated!")
     
-    base_url = 'https://api.enphaseenergy.com/oauth/authorize'
+    base_url = http_session.url('/oauth/authorize')
     params = {
         'response_type': 'code',
         'client_id': get_env_safe('ENPHASE_CLIENT_ID'),
@@ -85,7 +89,7 @@ def populate_token_dictionary(response_json, token_dictionary: dict):
     return token_dictionary
 
 def authorize(code: str, token_dictionary: dict) -> dict:
-    base_url = "https://api.enphaseenergy.com/oauth/token" #?grant_type=authorization_code&redirect_uri=https://localhost:5000/enphase_token&code=p1a5HY"
+    base_url = http_session.url("/oauth/token") #?grant_type=authorization_code&redirect_uri=https://localhost:5000/enphase_token&code=p1a5HY"
     params = {
         'grant_type': 'authorization_code',
         'redirect_uri': token_dictionary['redirect_uri'],
@@ -94,8 +98,8 @@ def authorize(code: str, token_dictionary: dict) -> dict:
     url = f"{base_url}?{urlencode(params)}"
 
     # Make the POST request with basic authorization
-    api_monitor.wait_for_next_api_call_and_record()
-    response = requests.post(url, auth=HTTPBasicAuth(client_id, client_secret))
+    wait_for_api_call('oauth_token', token_dictionary)
+    response = http_session.post(url, auth=HTTPBasicAuth(client_id, client_secret))
 
     # Check the response status code and content
     if response.status_code == 200:
@@ -108,7 +112,7 @@ def authorize(code: str, token_dictionary: dict) -> dict:
         raise ValueError("Unable to authorize!")
     
 def refresh_token(token_dictionary: dict) -> dict:
-    base_url = "https://api.enphaseenergy.com/oauth/token"
+    base_url = http_session.url("/oauth/token")
     params = {
         'grant_type': 'refresh_token',
         'refresh_token': token_dictionary['refresh_token']
@@ -116,8 +120,8 @@ def refresh_token(token_dictionary: dict) -> dict:
     url = f"{base_url}?{urlencode(params)}"
 
     # Make the POST request with basic authorization
-    api_monitor.wait_for_next_api_call_and_record()
-    response = requests.post(url, auth=HTTPBasicAuth(client_id, client_secret))
+    wait_for_api_call('oauth_token', token_dictionary)
+    response = http_session.post(url, auth=HTTPBasicAuth(client_id, client_secret))
 
     # Check the response status code and content
     if response.status_code == 200:
@@ -127,61 +131,55 @@ def refresh_token(token_dictionary: dict) -> dict:
         print("Response content:", response.text)
         raise ValueError("Unable to refresh access token!")
 
-def refresh_token_if_needed(token_dictionary:dict):
-    if token_dictionary['access_token_expiration'] - timedelta(hours=1) < datetime.now():
-        return refresh_token(token_dictionary=token_dictionary)
-    else:
-        return token_dictionary
+token_refresh_lock = threading.Lock()
 
-def get_system_details(token_dictionary: dict):
+def refresh_token_if_needed(token_dictionary:dict):
+    with token_refresh_lock: # Only one thread uses the refresh token
+        if token_dictionary['access_token_expiration'] - timedelta(hours=1) < datetime.now():
+            return refresh_token(token_dictionary=token_dictionary)
+        else:
+            return token_dictionary
+
+# 429 (too many requests) and 5xx responses are retried, each attempt counted like any other call
+retry_policy = api_session.RetryPolicy()
+
+# Path of each telemetry endpoint (see fetch_planner.ENDPOINTS)
+TELEMETRY_PATHS = {'production_meter': "/api/v4/systems/{system_id}/telemetry/production_meter",
+                   'consumption_meter': "/api/v4/systems/{system_id}/telemetry/consumption_meter",
+                   'battery': "/api/v4/systems/{system_id}/telemetry/battery",
+                   'energy_export_telemetry': "/api/v4/systems/{system_id}/energy_export_telemetry",
+                   'energy_import_telemetry': "/api/v4/systems/{system_id}/energy_import_telemetry"}
+
+def api_get(endpoint:str, path:str, token_dictionary:dict, description:str, params=None, background=False):
+    """
+    GET an API path, counting every attempt with wait_for_api_call and retrying as retry_policy allows.
+    Returns token_dictionary and the successful response, raises ValueError otherwise.
+    """
     token_dictionary = refresh_token_if_needed(token_dictionary)
-    url = "https://api.enphaseenergy.com/api/v4/systems"
+    url = path if params is None else f"{path}?{urlencode(params)}"
 
     headers = {
-        'Authorization': f'Bearer {token_dictionary['access_token']}',
+        'Authorization': "Bearer " + token_dictionary['access_token'],
         'key': api_key
     }
 
-    # Make the POST request with basic authorization
-    api_monitor.wait_for_next_api_call_and_record() # Avoid API rate limit errors
-    response = requests.get(url, headers=headers)
+    response = http_session.request_with_retry('GET', url, retry_policy, headers=headers,
+                                               before_attempt=lambda: wait_for_api_call(endpoint, token_dictionary, background=background))
 
     # Check the response status code and content
     if response.status_code == 200:
-        return token_dictionary, response.json()
-    elif response.status_code == 429: #too many requests
-        print(f"Request failed with status code {response.status_code} due to too many requests.")
-        print("Response content:", response.text)
-        time.sleep(30)
-    else:
-        print(f"Request failed with status code {response.status_code}")
-        print("Response content:", response.text)
-    raise ValueError("Unable to get system details!")
-
-def get_system_summary(system_id: int, token_dictionary: dict):
-    token_dictionary = refresh_token_if_needed(token_dictionary)
-    url = f"https://api.enphaseenergy.com/api/v4/systems/{system_id}/summary"
-
-    headers = {
-        'Authorization': f'Bearer {token_dictionary['access_token']}',
-        'key': api_key
-    }
+        return token_dictionary, response
+    print(f"Request failed with status code {response.status_code}")
+    print("Response content:", response.text)
+    raise ValueError(f"Unable to get {description}!")
 
-    # Make the POST request with basic authorization
-    api_monitor.wait_for_next_api_call_and_record() # Avoid API rate limit errors
-    response = requests.get(url, headers=headers)
+def get_system_details(token_dictionary: dict):
+    token_dictionary, response = api_get('systems', "/api/v4/systems", token_dictionary, "system details")
+    return token_dictionary, response.json()
 
-    # Check the response status code and content
-    if response.status_code == 200:
-        return token_dictionary, response.json()
-    elif response.status_code == 429: #too many requests
-        print(f"Request failed with status code {response.status_code} due to too many requests.")
-        print("Response content:", response.text)
-        time.sleep(30)
-    else:
-        print(f"Request failed with status code {response.status_code}")
-        print("Response content:", response.text)
-    raise ValueError("Unable to get system summary!")
+def get_system_summary(system_id: int, token_dictionary: dict):
+    token_dictionary, response = api_get('summary', f"/api/v4/systems/{system_id}/summary", token_dictionary, "system summary")
+    return token_dictionary, response.json()
 
 def get_all_system_summaries(token_dictionary: dict):
     token_dictionary = refresh_token_if_needed(token_dictionary)
@@ -201,162 +199,23 @@ def get_all_system_summaries(token_dictionary: dict):
 
     return token_dictionary, system_dictionary_list
 
-def get_production_telemetry(token_dictionary: dict, system_id:int, granularity='week', start_at=None, start_date=None):
-    token_dictionary = refresh_token_if_needed(token_dictionary)
-    base_url = f"https://api.enphaseenergy.com/api/v4/systems/{system_id}/telemetry/production_meter"
-    
-    params = {
-        'granularity': granularity
-        }
-    if start_at is not None:
-        params['start_at'] = start_at
-    if start_date is not None:
-        params['start_date'] = start_date
-    
-    if len(params) == 0:
-        url = base_url
-    else:
-        url = f"{base_url}?{urlencode(params)}"
-
-    headers = {
-        'Authorization': f'Bearer {token_dictionary['access_token']}',
-        'key': api_key
-    }
-
-    # Make the POST request with basic authorization
-    api_monitor.wait_for_next_api_call_and_record() # Avoid API rate limit errors
-    response = requests.get(url, headers=headers)
-
-    # Check the response status code and content
-    if response.status_code == 200:
-        return token_dictionary, response.json()
-    elif response.status_code == 429: #too many requests
-        print(f"Request failed with status code {response.status_code} due to too many requests.")
-        print("Response content:", response.text)
-        time.sleep(30)
-    else:
-        print(f"Request failed with status code {response.status_code}")
-        print("Response content:", response.text)
-    raise ValueError("Unable to get production data!")
-    
-def get_consumption_telemetry(token_dictionary: dict, system_id:int, granularity='week', start_at=None, start_date=None):
-    token_dictionary = refresh_token_if_needed(token_dictionary)
-    base_url = f"https://api.enphaseenergy.com/api/v4/systems/{system_id}/telemetry/consumption_meter"
-    
-    params = {
-        'granularity': granularity
-        }
-    if start_at is not None:
-        params['start_at'] = start_at
-    if start_date is not None:
-        params['start_date'] = start_date
-    
-    if len(params) == 0:
-        url = base_url
-    else:
-        url = f"{base_url}?{urlencode(params)}"
-
-    headers = {
-        'Authorization': f'Bearer {token_dictionary['access_token']}',
-        'key': api_key
-    }
-
-    # Make the POST request with basic authorization
-    api_monitor.wait_for_next_api_call_and_record() # Avoid API rate limit errors
-    response = requests.get(url, headers=headers)
-
-    # Check the response status code and content
-    if response.status_code == 200:
-        return token_dictionary, response.json()
-    elif response.status_code == 429: #too many requests
-        print(f"Request failed with status code {response.status_code} due to too many requests.")
-        print("Response content:", response.text)
-        time.sleep(30)
-    else:
-        print(f"Request failed with status code {response.status_code}")
-        print("Response content:", response.text)
-    raise ValueError("Unable to get consumption data!")
-
-def get_battery_telemetry(token_dictionary: dict, system_id:int, granularity='week', start_at=None, start_date=None):
-    token_dictionary = refresh_token_if_needed(token_dictionary)
-    base_url = f"https://api.enphaseenergy.com/api/v4/systems/{system_id}/telemetry/battery"
-    
-    params = {
-        'granularity': granularity
-        }
-    if start_at is not None:
-        params['start_at'] = start_at
-    if start_date is not None:
-        params['start_date'] = start_date
-    
-    if len(params) == 0:
-        url = base_url
-    else:
-        url = f"{base_url}?{urlencode(params)}"
-
-    headers = {
-        'Authorization': f'Bearer {token_dictionary['access_token']}',
-        'key': api_key
-    }
-
-    # Make the POST request with basic authorization
-    api_monitor.wait_for_next_api_call_and_record() # Avoid API rate limit errors
-    response = requests.get(url, headers=headers)
+def telemetry_intervals(response_json:dict) -> list:
+    intervals = response_json['intervals']
+    if len(intervals) > 0 and isinstance(intervals[0], list):
+        #Import and export telemetry: outer list element for each day
+        intervals = [item for sublist in intervals for item in sublist]
+    return intervals
 
-    # Check the response status code and content
-    if response.status_code == 200:
-        return token_dictionary, response.json()
-    elif response.status_code == 429: #too many requests
-        print(f"Request failed with status code {response.status_code} due to too many requests.")
-        print("Response content:", response.text)
-        time.sleep(30)
-    else:
-        print(f"Request failed with status code {response.status_code}")
-        print("Response content:", response.text)
-    raise ValueError("Unable to get battery data!")
-    
-def get_energy_export_telemetry(token_dictionary: dict, system_id:int, granularity='week', start_at=None, start_date=None):
-    token_dictionary = refresh_token_if_needed(token_dictionary)
-    base_url = f"https://api.enphaseenergy.com/api/v4/systems/{system_id}/energy_export_telemetry"
-    
-    params = {
-        'granularity': granularity
-        }
-    if start_at is not None:
-        params['start_at'] = start_at
-    if start_date is not None:
-        params['start_date'] = start_date
-    
-    if len(params) == 0:
-        url = base_url
-    else:
-        url = f"{base_url}?{urlencode(params)}"
-
-    headers = {
-        'Authorization': f'Bearer {token_dictionary['access_token']}',
-        'key': api_key
-    }
-
-    # Make the POST request with basic authorization
-    api_monitor.wait_for_next_api_call_and_record() # Avoid API rate limit errors
-    response = requests.get(url, headers=headers)
-
-    # Check the response status code and content
-    if response.status_code == 200:
-        return token_dictionary, response.json()
-    elif response.status_code == 429: #too many requests
-        print(f"Request failed with status code {response.status_code} due to too many requests.")
-        print("Response content:", response.text)
-        time.sleep(30)
-    else:
-        print(f"Request failed with status code {response.status_code}")
-        print("Response content:", response.text)
-    raise ValueError("Unable to get energy export data!")
+def get_telemetry(token_dictionary: dict, system_id:int, endpoint:str, granularity='week', start_at=None, start_date=None):
+    """
+    Telemetry of one endpoint (a key of TELEMETRY_PATHS), from response_cache when possible.
+    Counted as a background call. Returns token_dictionary and the list of intervals.
+    """
+    cache_key = response_cache.make_key(system_id, endpoint, granularity, start_at, start_date)
+    cached_response = response_cache.get(cache_key)
+    if cached_response is not None:
+        return token_dictionary, telemetry_intervals(cached_response)
 
-def get_energy_import_telemetry(token_dictionary: dict, system_id:int, granularity='week', start_at=None, start_date=None):
-    token_dictionary = refresh_token_if_needed(token_dictionary)
-    base_url = f"https://api.enphaseenergy.com/api/v4/systems/{system_id}/energy_import_telemetry"
-    
     params = {
         'granularity': granularity
         }
@@ -364,32 +223,38 @@ def get_energy_import_telemetry(token_dictionary: dict, system_id:int, granulari
         params['start_at'] = start_at
     if start_date is not None:
         params['start_date'] = start_date
-    
-    if len(params) == 0:
-        url = base_url
-    else:
-        url = f"{base_url}?{urlencode(params)}"
-
-    headers = {
-        'Authorization': f'Bearer {token_dictionary['access_token']}',
-        'key': api_key
-    }
 
-    # Make the POST request with basic authorization
-    api_monitor.wait_for_next_api_call_and_record() # Avoid API rate limit errors
-    response = requests.get(url, headers=headers)
+    token_dictionary, response = api_get(endpoint, TELEMETRY_PATHS[endpoint].format(system_id=system_id), token_dictionary,
+                                         f"{endpoint} data", params=params, background=True)
+    response_cache.put_if_complete(cache_key, response.text, granularity, start_at, start_date)
+    return token_dictionary, telemetry_intervals(response.json())
 
-    # Check the response status code and content
-    if response.status_code == 200:
-        return token_dictionary, response.json()
-    elif response.status_code == 429: #too many requests
-        print(f"Request failed with status code {response.status_code} due to too many requests.")
-        print("Response content:", response.text)
-        time.sleep(30)
-    else:
-        print(f"Request failed with status code {response.status_code}")
-        print("Response content:", response.text)
-    raise ValueError("Unable to get energy import data!")
+def get_telemetry_batch(token_dictionary: dict, system_id:int, calls:list):
+    """
+    Make several telemetry calls together: calls is [(endpoint, granularity, start_at)] (see fetch_planner.ENDPOINTS).
+    Requests are sent concurrently, still spaced by api_limiter.
+    Raises api_quota.QuotaExceededError if the calls not answered by response_cache do not all fit in this month's background quota.
+    Returns token_dictionary and [(endpoint, intervals)] in the order of calls.
+    """
+    if len(calls) == 0:
+        return token_dictionary, []
+    # Refuse the whole batch rather than spend quota on part of it. Cached responses cost nothing.
+    uncached_calls = [call for call in calls if not response_cache.contains(response_cache.make_key(system_id, *call))]
+    api_quota_ledger.check_background(len(uncached_calls))
+
+    # Refresh once up front so the concurrent calls all use the same access token
+    if len(uncached_calls) > 0:
+        token_dictionary = refresh_token_if_needed(token_dictionary)
+
+    with ThreadPoolExecutor(max_workers=min(len(calls), 5)) as executor:
+        futures = [executor.submit(get_telemetry, token_dictionary=token_dictionary, system_id=system_id, endpoint=endpoint,
+                                   granularity=granularity, start_at=start_at)
+                   for endpoint, granularity, start_at in calls]
+        responses = []
+        for (endpoint, _, _), future in zip(calls, futures):
+            token_dictionary, intervals = future.result()
+            responses.append((endpoint, intervals))
+    return token_dictionary, responses
 
 def enphase_epoch_to_datetime_noDST(enphase_ts:int):
     """
@@ -0,0 +1,142 @@
+"""
+Plan the fewest Enphase telemetry calls that fill the holes in stored HistoricalData, and turn
+the intervals they return into rows for ingest.merge_intervals.
+
+Each interval end on the 15 minute grid should hold data from every endpoint (endpoint_mask).
+Only endpoints with missing intervals are requested, and only for the days they are missing,
+so a partly populated week costs part of a week's calls.
+"""
+import time
+from datetime import datetime, timedelta
+
+from db_models import (db, HistoricalData, PRODUCTION_DATA, CONSUMPTION_DATA, IMPORT_DATA, EXPORT_DATA, BATTERY_DATA,
+                       DATA_FIELDS)
+
+INTERVAL = timedelta(minutes=15)
+CALL_SPAN = timedelta(days=7) # Intervals returned by one call with granularity 'week'
+GRANULARITY_SPANS = {'day': timedelta(days=1), 'week': CALL_SPAN}
+
+# Telemetry endpoints and the endpoint_mask bit of the data they return
+ENDPOINTS = {'production_meter': PRODUCTION_DATA,
+             'consumption_meter': CONSUMPTION_DATA,
+             'energy_import_telemetry': IMPORT_DATA,
+             'energy_export_telemetry': EXPORT_DATA,
+             'battery': BATTERY_DATA}
+
+def system_endpoints(batt_present:bool) -> list:
+    return [endpoint for endpoint in ENDPOINTS if batt_present or endpoint != 'battery']
+
+def base_mask(batt_present:bool) -> int:
+    # Without a battery there is no battery data to fetch: zero charge and discharge are complete
+    return 0 if batt_present else BATTERY_DATA
+
+def expected_interval_ends(start:datetime, end:datetime, now=None) -> list:
+    """
+    Interval end times on the grid after start, up to end (and now)
+    """
+    now = now if now is not None else datetime.now()
+    stop = min(end, now)
+    interval_ends = []
+    timestamp_end = start + INTERVAL
+    while timestamp_end <= stop:
+        interval_ends.append(timestamp_end)
+        timestamp_end += INTERVAL
+    return interval_ends
+
+def missing_intervals(system_id:int, start:datetime, end:datetime, batt_present:bool, now=None) -> dict:
+    """
+    Interval end times between start and end lacking each endpoint's data: {endpoint: [timestamp_end]}
+    """
+    stored = dict(db.session.query(HistoricalData.timestamp_end, HistoricalData.endpoint_mask).filter(
+                                    (HistoricalData.system_id == system_id) &
+                                    (HistoricalData.timestamp_end > start) &
+                                    (HistoricalData.timestamp_end <= end)))
+    missing = {}
+    for endpoint in system_endpoints(batt_present):
+        bit = ENDPOINTS[endpoint]
+        timestamps = [timestamp_end for timestamp_end in expected_interval_ends(start, end, now)
+                      if stored.get(timestamp_end, 0) & bit == 0]
+        if len(timestamps) > 0:
+            missing[endpoint] = timestamps
+    return missing
+
+def standard_time_epoch(datetime_noDST:datetime) -> int:
+    """
+    Epoch of a stored (local standard time, see enphase_api.enphase_epoch_to_datetime_noDST) datetime
+    """
+    return int((datetime_noDST - datetime(1970, 1, 1)).total_seconds()) + time.timezone
+
+def standard_time_datetime(epoch:int) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(seconds=epoch - time.timezone)
+
+def plan_calls(missing:dict) -> list:
+    """
+    Fewest calls covering the missing intervals: [(endpoint, granularity, start_at epoch)].
+
+    Every call costs the same, so each one starts at the first day still missing and covers
+    CALL_SPAN; a call covering a single missing day asks for just that day.
+    """
+    calls = []
+    for endpoint, timestamps in missing.items():
+        days = sorted(set(datetime.combine((timestamp_end - INTERVAL).date(), datetime.min.time()) for timestamp_end in timestamps))
+        i = 0
+        while i < len(days):
+            call_start = days[i]
+            j = i
+            while j < len(days) and days[j] < call_start + CALL_SPAN:
+                j += 1
+            calls.append((endpoint, 'day' if j - i == 1 else 'week', standard_time_epoch(call_start)))
+            i = j
+    return calls
+
+def plan_fetch(system_id:int, start:datetime, end:datetime, batt_present:bool, now=None) -> list:
+    return plan_calls(missing_intervals(system_id, start, end, batt_present, now))
+
+def call_spans(calls:list) -> list:
+    """
+    Sorted (start, end) of the interval ends each call returns (after start, up to end), without repeats
+    """
+    return sorted(set((standard_time_datetime(start_at), standard_time_datetime(start_at) + GRANULARITY_SPANS[granularity])
+                      for _, granularity, start_at in calls))
+
+def interval_values(endpoint:str, interval:dict) -> dict:
+    if endpoint == 'production_meter':
+        return {'production_wh': interval['wh_del']}
+    elif endpoint == 'consumption_meter':
+        return {'consumption_wh': interval['enwh']}
+    elif endpoint == 'energy_import_telemetry':
+        return {'import_wh': interval['wh_imported']}
+    elif endpoint == 'energy_export_telemetry':
+        return {'export_wh': interval['wh_exported']}
+    elif endpoint == 'battery':
+        return {'batt_charge_wh': interval['charge']['enwh'], 'batt_discharge_wh': interval['discharge']['enwh']}
+    raise ValueError(f"Unknown telemetry endpoint '{endpoint}'")
+
+def rows_from_telemetry(user_id:int, system_id:int, responses, batt_present:bool, epoch_to_datetime):
+    """
+    HistoricalData rows (for ingest.merge_intervals) from [(endpoint, intervals)], one row per
+    interval end, with the endpoint_mask bits of the endpoints that returned it.
+    Returns (rows sorted by timestamp_end, False if any endpoint's intervals had gaps).
+    """
+    rows = {}
+    consistent_interval_len = True
+    for endpoint, intervals in responses:
+        bit = ENDPOINTS[endpoint]
+        prev_timestamp_end = None
+        for interval in intervals:
+            timestamp_end = epoch_to_datetime(interval['end_at'])
+            if prev_timestamp_end is not None and timestamp_end - prev_timestamp_end > INTERVAL:
+                print(f"Interval length of fetched {endpoint} data is inconsistent! From {prev_timestamp_end} to {timestamp_end} is greater than {INTERVAL}")
+                consistent_interval_len = False
+            prev_timestamp_end = timestamp_end
+
+            row = rows.get(timestamp_end)
+            if row is None:
+                row = {'user_id': user_id, 'system_id': system_id, 'timestamp_end': timestamp_end,
+                       'interval_len_sec': int(INTERVAL.total_seconds()), 'endpoint_mask': base_mask(batt_present)}
+                for fields in DATA_FIELDS.values():
+                    row.update({field: 0 for field in fields})
+                rows[timestamp_end] = row
+            row.update(interval_values(endpoint, interval))
+            row['endpoint_mask'] |= bit
+    return [rows[timestamp_end] for timestamp_end in sorted(rows)], consistent_interval_len
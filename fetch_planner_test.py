@@ -0,0 +1,114 @@
+import unittest
+from datetime import datetime, timedelta
+
+from db_models import (db, HistoricalData, WeekCoverage, ALL_DATA, PRODUCTION_DATA, BATTERY_DATA, update_week_coverage)
+from db_models_test import make_app
+import fetch_planner
+import ingest
+
+WEEK_START = datetime(2025, 1, 1)
+WEEK_END = datetime(2025, 1, 8)
+NOW = datetime(2025, 3, 1)
+
+def epoch_to_datetime(epoch):
+    return datetime(1970, 1, 1) + timedelta(seconds=epoch)
+
+def to_epoch(timestamp_end):
+    return int((timestamp_end - datetime(1970, 1, 1)).total_seconds())
+
+def telemetry(endpoint, timestamps, value):
+    if endpoint == 'production_meter':
+        return [{'end_at': to_epoch(t), 'wh_del': value} for t in timestamps]
+    elif endpoint == 'consumption_meter':
+        return [{'end_at': to_epoch(t), 'enwh': value} for t in timestamps]
+    elif endpoint == 'energy_import_telemetry':
+        return [{'end_at': to_epoch(t), 'wh_imported': value} for t in timestamps]
+    elif endpoint == 'energy_export_telemetry':
+        return [{'end_at': to_epoch(t), 'wh_exported': value} for t in timestamps]
+    return [{'end_at': to_epoch(t), 'charge': {'enwh': value}, 'discharge': {'enwh': value}} for t in timestamps]
+
+class TestFetchPlanner(unittest.TestCase):
+    def setUp(self):
+        self.app = make_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.grid = fetch_planner.expected_interval_ends(WEEK_START, WEEK_END, NOW)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def store(self, timestamps, endpoint_mask=ALL_DATA, value=1):
+        db.session.add_all([HistoricalData(user_id=1, system_id=7, timestamp_end=t, interval_len_sec=900, production_wh=value,
+                                           consumption_wh=value, import_wh=value, export_wh=value, batt_charge_wh=value,
+                                           batt_discharge_wh=value, endpoint_mask=endpoint_mask) for t in timestamps])
+        db.session.commit()
+
+    def plan(self, batt_present=True):
+        return [(endpoint, granularity, epoch_to_datetime(start_at - fetch_planner.time.timezone))
+                for endpoint, granularity, start_at in fetch_planner.plan_fetch(7, WEEK_START, WEEK_END, batt_present, NOW)]
+
+    def test_grid(self):
+        self.assertEqual(len(self.grid), 96*7)
+        self.assertEqual((self.grid[0], self.grid[-1]), (WEEK_START + timedelta(minutes=15), WEEK_END))
+        self.assertEqual(len(fetch_planner.expected_interval_ends(WEEK_START, WEEK_END, now=datetime(2025, 1, 2))), 96)
+
+    def test_empty_week_needs_one_call_per_endpoint(self):
+        self.assertEqual(self.plan(), [(endpoint, 'week', WEEK_START) for endpoint in fetch_planner.ENDPOINTS])
+        self.assertEqual(len(self.plan(batt_present=False)), 4)
+
+    def test_complete_week_needs_nothing(self):
+        self.store(self.grid)
+        self.assertEqual(self.plan(), [])
+
+    def test_only_missing_days_and_endpoints(self):
+        self.store(self.grid[:96*3] + self.grid[96*3 + 4:]) # Jan 4, 00:15 to 01:00 missing
+        self.assertEqual(self.plan(), [(endpoint, 'day', datetime(2025, 1, 4)) for endpoint in fetch_planner.ENDPOINTS])
+
+        HistoricalData.query.filter(HistoricalData.timestamp_end > datetime(2025, 1, 6)).update(
+                                            {HistoricalData.endpoint_mask: ALL_DATA & ~BATTERY_DATA})
+        db.session.commit()
+        plan = self.plan()
+        self.assertIn(('battery', 'week', datetime(2025, 1, 4)), plan) # Jan 4 and Jan 6-7 in one call
+        self.assertIn(('production_meter', 'day', datetime(2025, 1, 4)), plan)
+        self.assertEqual(len(plan), 5)
+        self.assertEqual(len(self.plan(batt_present=False)), 4) # Battery data is not expected
+
+    def test_merge_fills_holes_only(self):
+        self.store(self.grid[:96*3], value=1)
+        self.store(self.grid[96*3:], endpoint_mask=PRODUCTION_DATA | BATTERY_DATA, value=2)
+        update_week_coverage(7, WEEK_START, WEEK_END)
+        self.assertFalse(WeekCoverage.query.filter_by(system_id=7).first().complete) # Only complete intervals count
+
+        plan = fetch_planner.plan_fetch(7, WEEK_START, WEEK_END, False, NOW)
+        self.assertEqual(sorted(endpoint for endpoint, _, _ in plan), ['consumption_meter', 'energy_export_telemetry', 'energy_import_telemetry'])
+        #Responses cover the whole week; stored data must not change
+        responses = [(endpoint, telemetry(endpoint, self.grid, 5)) for endpoint, _, _ in plan]
+        rows, consistent = fetch_planner.rows_from_telemetry(1, 7, responses, False, epoch_to_datetime)
+        self.assertTrue(consistent)
+        self.assertEqual(len(rows), len(self.grid))
+        self.assertEqual(rows[0]['endpoint_mask'], ALL_DATA & ~PRODUCTION_DATA)
+        ingest.merge_intervals(rows)
+        update_week_coverage(7, WEEK_START, WEEK_END)
+        db.session.commit()
+
+        stored = HistoricalData.query.filter_by(system_id=7).order_by(HistoricalData.timestamp_end).all()
+        self.assertEqual(len(stored), len(self.grid))
+        self.assertTrue(all(row.endpoint_mask == ALL_DATA for row in stored))
+        self.assertEqual([(row.production_wh, row.consumption_wh, row.export_wh, row.batt_charge_wh) for row in (stored[0], stored[-1])],
+                         [(1, 1, 1, 1), (2, 5, 5, 2)])
+        self.assertTrue(WeekCoverage.query.filter_by(system_id=7).first().complete)
+        self.assertEqual(fetch_planner.plan_fetch(7, WEEK_START, WEEK_END, False, NOW), [])
+
+    def test_inconsistent_intervals(self):
+        timestamps = self.grid[:10] + self.grid[12:20]
+        rows, consistent = fetch_planner.rows_from_telemetry(1, 7, [('production_meter', telemetry('production_meter', timestamps, 3))],
+                                                             True, epoch_to_datetime)
+        self.assertFalse(consistent)
+        self.assertEqual(len(rows), 18)
+        self.assertEqual((rows[0]['production_wh'], rows[0]['consumption_wh'], rows[0]['endpoint_mask']), (3, 0, PRODUCTION_DATA))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+In-process cache of each system's interval history as NumPy columns.
+"""
+import threading
+from collections import OrderedDict
+
+import solar_sim
+
+class HistoryCache:
+    """
+    Whole interval history of a system (solar_sim.IntervalColumns sorted by timestamp_end),
+    keyed by what the loader selects (app.py: (user_id, system_id)) and the system's data version.
+    Ingesting data bumps the version, so a stale history is never returned; it is dropped on the next lookup.
+    Safe to share between request threads; loading happens outside the lock.
+
+    Least recently used histories are evicted once the cached columns exceed max_bytes.
+    A history larger than max_bytes on its own is returned but not kept.
+    """
+    def __init__(self, max_bytes=256*1024*1024) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (data_version, columns)
+        self._lock = threading.Lock()
+
+    def get(self, key, data_version, loader) -> solar_sim.IntervalColumns:
+        """
+        History of key at data_version, calling loader() to build it if not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == data_version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            self._invalidate(key)
+
+        columns = loader()
+        if columns.nbytes <= self.max_bytes:
+            with self._lock:
+                self._invalidate(key) # Another thread may have loaded it meanwhile
+                self._entries[key] = (data_version, columns)
+                self.nbytes += columns.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+        return columns
+
+    def get_range(self, key, data_version, loader, start, end) -> solar_sim.IntervalColumns:
+        """
+        Intervals of key's history with start < timestamp_end <= end (views into the cached history).
+        """
+        return self.get(key, data_version, loader).between(start, end)
+
+    def _invalidate(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1].nbytes
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._invalidate(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
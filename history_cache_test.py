@@ -0,0 +1,85 @@
+import unittest
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from solar_sim import IntervalColumns
+from solar_sim_test import get_example_timeseries
+from history_cache import HistoryCache
+
+class TestHistoryCache(unittest.TestCase):
+    def setUp(self):
+        self.timeseries = get_example_timeseries(days=2)
+        self.columns = IntervalColumns.from_records(self.timeseries)
+        self.loads = 0
+
+    def loader(self):
+        self.loads += 1
+        return IntervalColumns.from_records(self.timeseries)
+
+    def test_hit_and_version_change(self):
+        cache = HistoryCache()
+        first = cache.get(7, 0, self.loader)
+        self.assertIs(cache.get(7, 0, self.loader), first)
+        self.assertEqual((cache.hits, cache.misses, self.loads), (1, 1, 1))
+
+        cache.get(7, 1, self.loader)
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes, first.nbytes)
+
+    def test_evicts_least_recently_used(self):
+        cache = HistoryCache(max_bytes=2*self.columns.nbytes)
+        cache.get(1, 0, self.loader)
+        cache.get(2, 0, self.loader)
+        cache.get(1, 0, self.loader)
+        cache.get(3, 0, self.loader)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+
+        cache.get(1, 0, self.loader)
+        self.assertEqual(self.loads, 3)
+        cache.get(2, 0, self.loader)
+        self.assertEqual(self.loads, 4)
+
+    def test_oversized_history_not_kept(self):
+        cache = HistoryCache(max_bytes=self.columns.nbytes - 1)
+        self.assertEqual(len(cache.get(1, 0, self.loader)), len(self.columns))
+        self.assertEqual((len(cache), cache.nbytes), (0, 0))
+
+    def test_get_range(self):
+        cache = HistoryCache()
+        start = self.timeseries[10].timestamp_end
+        end = self.timeseries[20].timestamp_end
+        sliced = cache.get_range(7, 0, self.loader, start, end)
+        expected = [step for step in self.timeseries if start < step.timestamp_end <= end]
+        self.assertEqual(len(sliced), len(expected))
+        np.testing.assert_array_equal(sliced.production_wh, [step.production_wh for step in expected])
+        self.assertEqual(len(cache.get_range(7, 0, self.loader, end + timedelta(days=30), end + timedelta(days=31))), 0)
+
+    def test_keyed_per_user_and_thread_safe(self):
+        cache = HistoryCache(max_bytes=3*self.columns.nbytes)
+        self.assertIsNot(cache.get((1, 7), 0, self.loader), cache.get((2, 7), 0, self.loader))
+        threads = [threading.Thread(target=cache.get, args=((user_id % 4, 7), 0, self.loader)) for user_id in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.nbytes, 3*self.columns.nbytes)
+
+class TestIntervalColumnsGaps(unittest.TestCase):
+    def test_first_gap(self):
+        timeseries = get_example_timeseries(days=1)
+        columns = IntervalColumns.from_records(timeseries)
+        start = timeseries[0].timestamp_start
+        self.assertIsNone(columns.first_gap(start))
+        self.assertEqual(columns.first_gap(start - timedelta(hours=1)), 0)
+
+        with_gap = IntervalColumns.from_records(timeseries[:40] + timeseries[44:])
+        self.assertEqual(with_gap.first_gap(start), 40)
+        self.assertIsNone(IntervalColumns.from_records([]).first_gap(datetime(2025, 1, 1)))
+
+if __name__ == "__main__":
+    unittest.main()
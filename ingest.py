@@ -0,0 +1,191 @@
+"""
+Import Enphase energy report CSV files into HistoricalData.
+"""
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db_models import db, HistoricalData, SystemDetails, ALL_DATA, BATTERY_DATA, DATA_FIELDS, bump_data_version, update_week_coverage
+
+REPORT_TIME_COLUMN = "Date/Time" # Interval start, e.g. "2024-11-03 01:15:00 -0400"
+REPORT_ENERGY_COLUMNS = {"Energy Produced (Wh)": "production_wh",
+                         "Energy Consumed (Wh)": "consumption_wh",
+                         "Imported from Grid (Wh)": "import_wh",
+                         "Exported to Grid (Wh)": "export_wh"}
+DELETE_MARGIN = timedelta(minutes=3) # Existing intervals this close to the report's range are replaced
+
+def upsert_intervals(rows:list) -> None:
+    """
+    Write HistoricalData rows (dicts of column values) with one INSERT ... ON CONFLICT
+    statement (executemany), replacing any stored interval with the same system_id and
+    timestamp_end, so writing the same rows again changes nothing. Commit afterwards.
+    """
+    if len(rows) == 0:
+        return
+    table = HistoricalData.__table__
+    statement = sqlite_insert(table)
+    statement = statement.on_conflict_do_update(index_elements=[table.c.system_id, table.c.timestamp_end],
+                                                set_={column.name: statement.excluded[column.name] for column in table.columns
+                                                      if column.name not in ("id", "system_id", "timestamp_end")})
+    db.session.execute(statement, rows)
+
+def merge_intervals(rows:list) -> None:
+    """
+    Write HistoricalData rows that hold data of only some endpoints (endpoint_mask bits).
+    A stored interval only takes the fields of endpoints it has no data for yet, so valid
+    data is never overwritten. Commit afterwards.
+    """
+    if len(rows) == 0:
+        return
+    table = HistoricalData.__table__
+    statement = sqlite_insert(table)
+    excluded = statement.excluded
+    set_ = {'endpoint_mask': table.c.endpoint_mask.op('|')(excluded.endpoint_mask)}
+    for bit, fields in DATA_FIELDS.items():
+        fill = (table.c.endpoint_mask.op('&')(bit) == 0) & (excluded.endpoint_mask.op('&')(bit) != 0)
+        for field in fields:
+            set_[field] = db.case((fill, excluded[field]), else_=table.c[field])
+    statement = statement.on_conflict_do_update(index_elements=[table.c.system_id, table.c.timestamp_end], set_=set_)
+    db.session.execute(statement, rows)
+
+def delete_off_grid_intervals(system_id:int, spans:list, interval:timedelta, chunk_size=500) -> int:
+    """
+    Before writing fetched rows, delete the system's intervals in each (start, end] span of the
+    fetch calls that are off its grid (start plus multiples of interval, interval long),
+    e.g. 5 minute or shifted intervals that would otherwise be counted next to them.
+    Intervals outside the spans are left alone. Returns the number deleted. Commit afterwards.
+    """
+    interval_len_sec = int(interval.total_seconds())
+    stale_ids = []
+    for start, end in spans:
+        stale_ids += [row_id for row_id, timestamp_end, row_len_sec in db.session.query(
+                                    HistoricalData.id, HistoricalData.timestamp_end, HistoricalData.interval_len_sec).filter(
+                                        (HistoricalData.system_id == system_id) &
+                                        (HistoricalData.timestamp_end > start) &
+                                        (HistoricalData.timestamp_end <= end))
+                      if row_len_sec != interval_len_sec or (timestamp_end - start) % interval != timedelta(0)]
+    stale_ids = sorted(set(stale_ids)) # Spans of different endpoints may overlap
+    for i in range(0, len(stale_ids), chunk_size):
+        HistoricalData.query.filter(HistoricalData.id.in_(stale_ids[i:i+chunk_size])).delete(synchronize_session=False)
+    return len(stale_ids)
+
+class IngestStats:
+    """
+    Outcome of ingest_report_csv
+    """
+    def __init__(self, rows:int, skipped:int, batches:int, elapsed_sec:float, first_timestamp_end=None, last_timestamp_end=None) -> None:
+        self.rows = rows # Intervals written
+        self.first_timestamp_end = first_timestamp_end
+        self.last_timestamp_end = last_timestamp_end
+        self.skipped = skipped # Repeated local times (end of DST) that were not written
+        self.batches = batches
+        self.elapsed_sec = elapsed_sec
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapsed_sec if self.elapsed_sec > 0 else float("inf")
+
+class IngestError(ValueError):
+    """
+    A report could not be fully imported. stats describes the batches that were
+    already committed: their intervals replaced the stored ones and stay in place.
+    """
+    def __init__(self, message:str, stats:IngestStats) -> None:
+        super().__init__(message)
+        self.stats = stats
+
+def read_report_batches(path, batch_size=10000):
+    """
+    Stream an energy report CSV as DataFrames of up to batch_size intervals with
+    timestamp_end (local wall time, as stored in the database) and the energy columns.
+    The interval length is taken from the first two rows.
+    """
+    interval_len = None
+    for chunk in pd.read_csv(path, usecols=[REPORT_TIME_COLUMN] + list(REPORT_ENERGY_COLUMNS), chunksize=batch_size):
+        #Drop the UTC offset: the database holds naive local times
+        time_start = pd.to_datetime(chunk[REPORT_TIME_COLUMN].str.slice(0, 19), format="%Y-%m-%d %H:%M:%S")
+        if interval_len is None:
+            if len(time_start) < 2:
+                raise ValueError("The report needs at least two intervals")
+            interval_len = time_start.iloc[1] - time_start.iloc[0]
+            if interval_len <= timedelta(0):
+                raise ValueError("Report intervals are not in order")
+
+        batch = chunk[list(REPORT_ENERGY_COLUMNS)].rename(columns=REPORT_ENERGY_COLUMNS).astype(np.int64)
+        batch.insert(0, "timestamp_end", time_start + interval_len)
+        batch.insert(1, "interval_len_sec", int(interval_len.total_seconds()))
+        yield batch
+
+def report_endpoint_mask(user_id:int, system_id:int) -> int:
+    """
+    endpoint_mask of report intervals: reports hold no battery data, so a system with a
+    battery (or an unknown system) still needs its battery telemetry fetched.
+    """
+    sys_details = SystemDetails.query.filter_by(user_id=user_id, system_id=system_id).first()
+    if sys_details is not None and sys_details.battery_capacity_wh == 0:
+        return ALL_DATA
+    return ALL_DATA & ~BATTERY_DATA
+
+def ingest_report_csv(path, user_id:int, system_id:int, batch_size=10000) -> IngestStats:
+    """
+    Replace the system's intervals over the report's time range with the report's,
+    reading and writing batch_size intervals at a time (one Core executemany and
+    one commit per batch, with the WeekCoverage update and data version bump).
+    Raises IngestError if a batch fails; the batches before it stay committed.
+    """
+    start_time = time.perf_counter()
+    rows = 0
+    skipped = 0
+    batches = 0
+    first_end = None
+    last_end = None # Latest end time written; the report is in time order
+    deleted_to = None
+    endpoint_mask = report_endpoint_mask(user_id, system_id)
+
+    def make_stats():
+        return IngestStats(rows=rows, skipped=skipped, batches=batches, elapsed_sec=time.perf_counter() - start_time,
+                           first_timestamp_end=first_end, last_timestamp_end=last_end.to_pydatetime() if last_end is not None else None)
+
+    try:
+        for batch in read_report_batches(path, batch_size):
+            #Local time repeats when DST ends. Keep the first interval for each end time.
+            times = batch["timestamp_end"].to_numpy()
+            prev_times = np.concatenate(([np.datetime64(last_end, "ns") if last_end is not None else times[0] - 1], times[:-1]))
+            keep = times > np.maximum.accumulate(prev_times)
+            skipped += int((~keep).sum())
+            batch = batch[keep]
+            if len(batch) == 0:
+                continue
+
+            #Existing intervals in the report's range are replaced, a batch at a time
+            delete_query = HistoricalData.query.filter((HistoricalData.system_id == system_id) &
+                                                       (HistoricalData.timestamp_end <= batch["timestamp_end"].iloc[-1] + DELETE_MARGIN))
+            if deleted_to is None:
+                delete_from = batch["timestamp_end"].iloc[0] - DELETE_MARGIN
+                delete_query = delete_query.filter(HistoricalData.timestamp_end >= delete_from)
+            else:
+                delete_from = deleted_to
+                delete_query = delete_query.filter(HistoricalData.timestamp_end > delete_from)
+            delete_query.delete(synchronize_session=False)
+            deleted_to = batch["timestamp_end"].iloc[-1] + DELETE_MARGIN
+
+            #TODO: Detect if battery charge/discharge is in the CSV (I don't know the column name..)
+            records = batch.assign(user_id=user_id, system_id=system_id, batt_charge_wh=0, batt_discharge_wh=0, endpoint_mask=endpoint_mask)
+            db.session.execute(HistoricalData.__table__.insert(), records.to_dict("records"))
+
+            update_week_coverage(system_id, delete_from.to_pydatetime(), deleted_to.to_pydatetime())
+            bump_data_version(system_id)
+            db.session.commit()
+
+            rows += len(batch)
+            batches += 1
+            if first_end is None:
+                first_end = batch["timestamp_end"].iloc[0].to_pydatetime()
+            last_end = batch["timestamp_end"].iloc[-1]
+    except (ValueError, KeyError) as e:
+        db.session.rollback() #Only the failed batch
+        raise IngestError(str(e), make_stats()) from e
+    return make_stats()
@@ -0,0 +1,174 @@
+import unittest
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from db_models import db, HistoricalData, SystemDetails, WeekCoverage, ALL_DATA, BATTERY_DATA, PRODUCTION_DATA, CONSUMPTION_DATA
+from db_models_test import make_app
+import fetch_planner
+from ingest import IngestError, ingest_report_csv, read_report_batches, upsert_intervals, merge_intervals, delete_off_grid_intervals
+
+def write_report(path, starts, offset="-0500", production_wh=10):
+    with open(path, "w") as f:
+        f.write("Date/Time,Energy Produced (Wh),Energy Consumed (Wh),Exported to Grid (Wh),Imported from Grid (Wh)\n")
+        for i, start in enumerate(starts):
+            cur_offset = offset(start, i) if callable(offset) else offset
+            f.write(f"{start.strftime('%Y-%m-%d %H:%M:%S')} {cur_offset},{production_wh},{i},{i % 7},{i % 5}\n")
+
+def end_at(timestamp_end):
+    return int((timestamp_end - datetime(1970, 1, 1)).total_seconds())
+
+class TestIngestReportCsv(unittest.TestCase):
+    def setUp(self):
+        self.app = make_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.session.add(SystemDetails(user_id=1, system_id=7, name="home", num_modules=10, operational_at=datetime(2024, 1, 1),
+                                     battery_capacity_wh=0, size_watt=4000))
+        db.session.commit()
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        os.remove(self.path)
+
+    def stored(self):
+        return HistoricalData.query.filter_by(system_id=7).order_by(HistoricalData.timestamp_end).all()
+
+    def test_batches_match_rows(self):
+        starts = [datetime(2025, 1, 1) + timedelta(minutes=15*i) for i in range(1000)]
+        write_report(self.path, starts)
+        stats = ingest_report_csv(self.path, 1, 7, batch_size=300)
+        self.assertEqual((stats.rows, stats.skipped, stats.batches), (1000, 0, 4))
+        self.assertGreater(stats.rows_per_sec, 0)
+
+        rows = self.stored()
+        self.assertEqual([row.timestamp_end for row in rows], [start + timedelta(minutes=15) for start in starts])
+        self.assertEqual([row.consumption_wh for row in rows], list(range(1000)))
+        self.assertEqual([row.import_wh for row in rows], [i % 5 for i in range(1000)])
+        self.assertEqual([row.export_wh for row in rows], [i % 7 for i in range(1000)])
+        self.assertEqual(set((row.user_id, row.interval_len_sec, row.batt_charge_wh) for row in rows), {(1, 900, 0)})
+        self.assertEqual(SystemDetails.query.first().data_version, 4)
+        self.assertTrue(WeekCoverage.query.filter_by(week_start=datetime(2025, 1, 1)).first().complete)
+
+    def test_reimport_replaces_range(self):
+        starts = [datetime(2025, 1, 1) + timedelta(minutes=15*i) for i in range(200)]
+        write_report(self.path, starts)
+        ingest_report_csv(self.path, 1, 7, batch_size=64)
+        write_report(self.path, starts[50:150], production_wh=99)
+        ingest_report_csv(self.path, 1, 7, batch_size=64)
+
+        rows = self.stored()
+        self.assertEqual(len(rows), 200)
+        self.assertEqual([row.production_wh for row in rows], [10]*50 + [99]*100 + [10]*50)
+
+    def test_failed_batch_keeps_earlier_batches(self):
+        starts = [datetime(2025, 1, 1) + timedelta(minutes=15*i) for i in range(200)]
+        write_report(self.path, starts)
+        ingest_report_csv(self.path, 1, 7)
+        write_report(self.path, starts, production_wh=99)
+        with open(self.path, "a") as f:
+            f.write("2025-01-03 02:00:00 -0500,bad,0,0,0\n")
+        with self.assertRaises(IngestError) as raised:
+            ingest_report_csv(self.path, 1, 7, batch_size=64)
+        self.assertEqual((raised.exception.stats.rows, raised.exception.stats.batches), (192, 3))
+        self.assertEqual(raised.exception.stats.last_timestamp_end, starts[191] + timedelta(minutes=15))
+
+        rows = self.stored()
+        self.assertEqual(len(rows), 200)
+        self.assertEqual([row.production_wh for row in rows], [99]*192 + [10]*8) #The failed batch was rolled back
+
+    def test_end_of_dst_keeps_first_hour(self):
+        #Local time 01:00-02:00 repeats on 2024-11-03
+        starts = [datetime(2024, 11, 3) + timedelta(minutes=15*i) for i in range(8)]
+        starts += [datetime(2024, 11, 3, 1) + timedelta(minutes=15*i) for i in range(8)]
+        write_report(self.path, starts, offset=lambda start, i: "-0400" if i < 8 else "-0500")
+        stats = ingest_report_csv(self.path, 1, 7, batch_size=6)
+        self.assertEqual((stats.rows, stats.skipped), (12, 4))
+        self.assertEqual([row.timestamp_end for row in self.stored()],
+                         [datetime(2024, 11, 3) + timedelta(minutes=15*(i+1)) for i in range(12)])
+
+    def test_upsert_is_idempotent(self):
+        def week_rows(production_wh):
+            return [{"user_id": 1, "system_id": 7, "timestamp_end": datetime(2025, 1, 1) + timedelta(minutes=15*(i+1)),
+                     "interval_len_sec": 900, "production_wh": production_wh, "consumption_wh": i, "import_wh": 0,
+                     "export_wh": 0, "batt_charge_wh": 0, "batt_discharge_wh": 0} for i in range(672)]
+        upsert_intervals(week_rows(5))
+        db.session.commit()
+        first_ids = [row.id for row in self.stored()]
+        upsert_intervals(week_rows(6)[100:200])
+        upsert_intervals([])
+        db.session.commit()
+
+        rows = self.stored()
+        self.assertEqual([row.id for row in rows], first_ids)
+        self.assertEqual([row.production_wh for row in rows], [5]*100 + [6]*100 + [5]*472)
+        self.assertEqual([row.consumption_wh for row in rows], list(range(672)))
+
+    def test_battery_system_still_needs_battery_telemetry(self):
+        SystemDetails.query.first().battery_capacity_wh = 10000
+        db.session.commit()
+        starts = [datetime(2025, 1, 1) + timedelta(minutes=15*i) for i in range(96*7)]
+        write_report(self.path, starts)
+        ingest_report_csv(self.path, 1, 7)
+
+        self.assertEqual(set(row.endpoint_mask for row in self.stored()), {ALL_DATA & ~BATTERY_DATA})
+        self.assertIsNone(WeekCoverage.query.filter_by(week_start=datetime(2025, 1, 1)).first()) # No complete intervals yet
+        plan = fetch_planner.plan_fetch(7, datetime(2025, 1, 1), datetime(2025, 1, 8), True, now=datetime(2025, 2, 1))
+        self.assertEqual([(endpoint, granularity) for endpoint, granularity, _ in plan], [('battery', 'week')])
+
+    def test_fetched_intervals_replace_off_grid_intervals(self):
+        starts = [datetime(2025, 1, 1) + timedelta(minutes=5*i) for i in range(12*24)] # 5 minute report
+        write_report(self.path, starts)
+        ingest_report_csv(self.path, 1, 7)
+        fetched = [{"user_id": 1, "system_id": 7, "timestamp_end": datetime(2025, 1, 1) + timedelta(minutes=15*(i+1)),
+                    "interval_len_sec": 900, "production_wh": 30, "consumption_wh": 0, "import_wh": 0, "export_wh": 0,
+                    "batt_charge_wh": 0, "batt_discharge_wh": 0, "endpoint_mask": ALL_DATA} for i in range(96)]
+
+        deleted = delete_off_grid_intervals(7, [(datetime(2025, 1, 1), datetime(2025, 1, 2))], fetch_planner.INTERVAL, chunk_size=50)
+        merge_intervals(fetched)
+        db.session.commit()
+        self.assertEqual(deleted, 12*24)
+        self.assertEqual([(row.timestamp_end, row.production_wh) for row in self.stored()], [(row["timestamp_end"], 30) for row in fetched])
+
+    def test_day_calls_only_replace_their_days(self):
+        #A stored week, missing production on Jan 1 and consumption on Jan 6, with 5 minute intervals on Jan 1 and Jan 3
+        week = [datetime(2025, 1, 1) + timedelta(minutes=15*(i+1)) for i in range(96*7)]
+        off_grid = [datetime(2025, 1, 1, 1, 5), datetime(2025, 1, 3, 1, 5)]
+        def stored_row(timestamp_end, interval_len_sec=900, endpoint_mask=ALL_DATA):
+            return {"user_id": 1, "system_id": 7, "timestamp_end": timestamp_end, "interval_len_sec": interval_len_sec,
+                    "production_wh": 1, "consumption_wh": 1, "import_wh": 1, "export_wh": 1, "batt_charge_wh": 0,
+                    "batt_discharge_wh": 0, "endpoint_mask": endpoint_mask}
+        upsert_intervals([stored_row(timestamp_end, endpoint_mask=ALL_DATA & ~PRODUCTION_DATA) for timestamp_end in week[:96]] +
+                         [stored_row(timestamp_end) for timestamp_end in week[96:96*5] + week[96*6:]] +
+                         [stored_row(timestamp_end, endpoint_mask=ALL_DATA & ~CONSUMPTION_DATA) for timestamp_end in week[96*5:96*6]] +
+                         [stored_row(timestamp_end, interval_len_sec=300) for timestamp_end in off_grid])
+        db.session.commit()
+
+        calls = fetch_planner.plan_fetch(7, datetime(2025, 1, 1), datetime(2025, 1, 8), False, now=datetime(2025, 2, 1))
+        spans = fetch_planner.call_spans(calls)
+        self.assertEqual(spans, [(datetime(2025, 1, 1), datetime(2025, 1, 2)), (datetime(2025, 1, 6), datetime(2025, 1, 7))])
+        self.assertEqual([(endpoint, granularity) for endpoint, granularity, _ in calls], [('production_meter', 'day'), ('consumption_meter', 'day')])
+        fetched = fetch_planner.rows_from_telemetry(1, 7, [('production_meter', [{'end_at': end_at(t), 'wh_del': 5} for t in week[:96]]),
+                                                           ('consumption_meter', [{'end_at': end_at(t), 'enwh': 5} for t in week[96*5:96*6]])],
+                                                    False, lambda epoch: datetime(1970, 1, 1) + timedelta(seconds=epoch))[0]
+
+        self.assertEqual(delete_off_grid_intervals(7, spans, fetch_planner.INTERVAL), 1) # Only Jan 1 01:05
+        merge_intervals(fetched)
+        db.session.commit()
+        rows = self.stored()
+        self.assertEqual([row.timestamp_end for row in rows], sorted(week + off_grid[1:]))
+        self.assertTrue(all(row.endpoint_mask == ALL_DATA for row in rows))
+        self.assertEqual(sum(row.production_wh for row in rows), 5*96 + 96*6 + 1)
+
+    def test_single_row_report(self):
+        write_report(self.path, [datetime(2025, 1, 1)])
+        with self.assertRaises(ValueError):
+            list(read_report_batches(self.path))
+
+if __name__ == "__main__":
+    unittest.main()
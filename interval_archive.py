@@ -0,0 +1,292 @@
+"""
+Optional columnar archive of HistoricalData: one Arrow IPC file per system and month,
+memory-mapped when read so loading a date range does not go through SQLite rows.
+
+Layout: <root>/system_<system_id>/<YYYY-MM>.arrow, each file holding the month's
+intervals (by timestamp_end) sorted by timestamp_end. A STALE file next to them marks
+a system whose archive missed an update; a full export clears it.
+
+Command line (run next to users.db, or pass --database):
+    python interval_archive.py export ARCHIVE_DIR [--system-id ID]
+    python interval_archive.py import ARCHIVE_DIR [--system-id ID]
+"""
+import argparse
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from flask import Flask
+
+try:
+    import pyarrow as pa
+except ImportError: # Only needed when the archive is used
+    pa = None
+
+import ingest
+import solar_sim
+from db_models import db, HistoricalData, ALL_DATA, bump_data_version, update_week_coverage, upgrade_schema
+
+ARCHIVE_FIELDS = ["user_id", "endpoint_mask"] + solar_sim.INTERVAL_COLUMN_FIELDS
+
+def _archive_schema():
+    return pa.schema([("user_id", pa.int64()), ("endpoint_mask", pa.int64()), ("timestamp_end", pa.timestamp("us")),
+                      ("interval_len_sec", pa.int64())] +
+                     [(field, pa.float64()) for field in solar_sim.INTERVAL_COLUMN_FIELDS[2:]])
+
+def month_start(timestamp) -> datetime:
+    timestamp = np.datetime64(timestamp, "us").item()
+    return datetime(timestamp.year, timestamp.month, 1)
+
+def _next_month(month:datetime) -> datetime:
+    return datetime(month.year + 1, 1, 1) if month.month == 12 else datetime(month.year, month.month + 1, 1)
+
+class IntervalArchive:
+    """
+    Interval data of many systems partitioned by month under root.
+    """
+    def __init__(self, root) -> None:
+        if pa is None:
+            raise ImportError("The interval archive requires pyarrow (pip install pyarrow)")
+        self.root = root
+
+    def partition_path(self, system_id, month:datetime) -> str:
+        return os.path.join(self.root, f"system_{system_id}", f"{month.year:04d}-{month.month:02d}.arrow")
+
+    def months(self, system_id) -> list:
+        """
+        Start of every month archived for system_id, in order
+        """
+        system_dir = os.path.join(self.root, f"system_{system_id}")
+        if not os.path.isdir(system_dir):
+            return []
+        return sorted(datetime.strptime(name[:-len(".arrow")], "%Y-%m") for name in os.listdir(system_dir) if name.endswith(".arrow"))
+
+    def system_ids(self) -> list:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(name[len("system_"):]) for name in os.listdir(self.root) if name.startswith("system_"))
+
+    def read_partition(self, system_id, month:datetime) -> dict:
+        """
+        Columns (ARCHIVE_FIELDS) of one month as NumPy arrays backed by the memory-mapped file
+        """
+        table = pa.ipc.open_file(pa.memory_map(self.partition_path(system_id, month))).read_all()
+        arrays = {}
+        for field in ARCHIVE_FIELDS:
+            if field == "endpoint_mask" and field not in table.schema.names:
+                #Written before endpoint_mask was archived, when stored intervals were complete
+                arrays[field] = np.full(table.num_rows, ALL_DATA, dtype=np.int64)
+                continue
+            column = table.column(field)
+            if column.num_chunks == 1:
+                arrays[field] = column.chunk(0).to_numpy(zero_copy_only=True)
+            else:
+                arrays[field] = column.to_numpy()
+        return arrays
+
+    def read(self, system_id, start=None, end=None, user_id=None) -> solar_sim.IntervalColumns:
+        """
+        Intervals of system_id with start < timestamp_end <= end (either may be None for no limit),
+        only those stored for user_id unless it is None.
+        Only the months overlapping the range are mapped; a single month of one user is returned without copying.
+        """
+        months = self.months(system_id)
+        if start is not None:
+            months = [month for month in months if _next_month(month) > start]
+        if end is not None:
+            months = [month for month in months if month <= end]
+        if len(months) == 0:
+            return solar_sim.IntervalColumns(*[[]]*len(solar_sim.INTERVAL_COLUMN_FIELDS))
+
+        partitions = [self.read_partition(system_id, month) for month in months]
+        if len(partitions) == 1:
+            arrays = partitions[0]
+        else:
+            arrays = {field: np.concatenate([partition[field] for partition in partitions]) for field in ARCHIVE_FIELDS}
+        if user_id is not None:
+            of_user = arrays["user_id"] == user_id
+            if not of_user.all():
+                arrays = {field: arrays[field][of_user] for field in ARCHIVE_FIELDS}
+        columns = solar_sim.IntervalColumns(**{field: arrays[field] for field in solar_sim.INTERVAL_COLUMN_FIELDS})
+        if start is None and end is None:
+            return columns
+        return columns.between(start if start is not None else datetime.min, end if end is not None else datetime.max)
+
+    def write(self, system_id, user_id, columns:solar_sim.IntervalColumns, endpoint_mask=ALL_DATA) -> list:
+        """
+        Merge intervals into the archive, replacing archived intervals with the same timestamp_end.
+        endpoint_mask is HistoricalData.endpoint_mask of every interval, or an array of them.
+        Returns the months written.
+        """
+        if len(columns) == 0:
+            return []
+        new_arrays = {field: getattr(columns, field) for field in solar_sim.INTERVAL_COLUMN_FIELDS}
+        new_arrays["user_id"] = np.broadcast_to(np.asarray(user_id, dtype=np.int64), (len(columns),))
+        new_arrays["endpoint_mask"] = np.broadcast_to(np.asarray(endpoint_mask, dtype=np.int64), (len(columns),))
+        month_keys = columns.timestamp_end.astype("datetime64[M]")
+
+        written = []
+        for month_key in np.unique(month_keys):
+            month = month_start(month_key)
+            in_month = month_keys == month_key
+            arrays = {field: np.asarray(new_arrays[field])[in_month] for field in ARCHIVE_FIELDS}
+
+            path = self.partition_path(system_id, month)
+            if os.path.exists(path):
+                existing = self.read_partition(system_id, month)
+                arrays = {field: np.concatenate([existing[field], arrays[field]]) for field in ARCHIVE_FIELDS}
+                #Sort by time (stable: written intervals after archived ones) and keep the last of each time
+                order = np.argsort(arrays["timestamp_end"], kind="stable")
+                arrays = {field: arrays[field][order] for field in ARCHIVE_FIELDS}
+                times = arrays["timestamp_end"]
+                keep = np.concatenate((times[1:] != times[:-1], [True]))
+                arrays = {field: arrays[field][keep] for field in ARCHIVE_FIELDS}
+                del existing
+
+            self._write_partition(path, arrays)
+            written.append(month)
+        return written
+
+    def remove(self, system_id, month:datetime) -> None:
+        os.remove(self.partition_path(system_id, month))
+
+    def stale_marker_path(self, system_id) -> str:
+        return os.path.join(self.root, f"system_{system_id}", "STALE")
+
+    def mark_stale(self, system_id) -> None:
+        """
+        Record that system_id's archive no longer matches the database (until the next full export)
+        """
+        os.makedirs(os.path.dirname(self.stale_marker_path(system_id)), exist_ok=True)
+        with open(self.stale_marker_path(system_id), "w"):
+            pass
+
+    def is_stale(self, system_id) -> bool:
+        return os.path.exists(self.stale_marker_path(system_id))
+
+    def _write_partition(self, path, arrays:dict) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        schema = _archive_schema()
+        table = pa.table([pa.array(np.ascontiguousarray(arrays[field]), type=schema.field(field).type) for field in ARCHIVE_FIELDS],
+                         schema=schema)
+        #Write next to the partition and swap it in, so readers never see a partial file
+        tmp_path = path + ".tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table, max_chunksize=max(1, len(table)))
+        os.replace(tmp_path, path)
+
+def export_system(archive:IntervalArchive, system_id, first_month:datetime=None, last_month:datetime=None, chunk_size=50000) -> int:
+    """
+    Rewrite the system's archive from its HistoricalData, or only the months from
+    first_month to last_month (inclusive), so intervals deleted from the database
+    leave the archive too. The new partitions are built in a staging directory and
+    then swapped in one at a time, so readers see either the old or the new month.
+    A full export clears the stale marker.
+    Returns the number of intervals. Needs an application context.
+    """
+    query = db.session.query(HistoricalData.user_id, HistoricalData.endpoint_mask, *[getattr(HistoricalData, field) for field in solar_sim.INTERVAL_COLUMN_FIELDS]
+                             ).filter(HistoricalData.system_id == system_id)
+    full_export = first_month is None or last_month is None
+    if not full_export:
+        first_month, last_month = month_start(first_month), month_start(last_month)
+        query = query.filter((HistoricalData.timestamp_end >= first_month) & (HistoricalData.timestamp_end < _next_month(last_month)))
+
+    #Not a system_<id> directory, so never listed as a system
+    staging = IntervalArchive(os.path.join(archive.root, f".staging_{system_id}_{os.getpid()}_{threading.get_ident()}"))
+    try:
+        count = 0
+        rows = []
+        for row in query.order_by(HistoricalData.timestamp_end).yield_per(chunk_size):
+            rows.append(row)
+            if len(rows) == chunk_size:
+                count += _export_rows(staging, system_id, rows)
+                rows = []
+        count += _export_rows(staging, system_id, rows)
+
+        new_months = staging.months(system_id)
+        for month in new_months:
+            path = archive.partition_path(system_id, month)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(staging.partition_path(system_id, month), path)
+        for month in archive.months(system_id):
+            if month not in new_months and (full_export or first_month <= month <= last_month):
+                archive.remove(system_id, month)
+    finally:
+        shutil.rmtree(staging.root, ignore_errors=True)
+    if full_export and archive.is_stale(system_id):
+        os.remove(archive.stale_marker_path(system_id))
+    return count
+
+def _export_rows(archive:IntervalArchive, system_id, rows) -> int:
+    if len(rows) == 0:
+        return 0
+    fields = list(zip(*rows))
+    user_ids = np.asarray(fields[0], dtype=np.int64)
+    endpoint_masks = np.asarray(fields[1], dtype=np.int64)
+    for user_id in np.unique(user_ids):
+        mask = user_ids == user_id
+        columns = solar_sim.IntervalColumns(*[np.asarray(values)[mask] for values in fields[2:]])
+        archive.write(system_id, int(user_id), columns, endpoint_masks[mask])
+    return len(rows)
+
+def import_system(archive:IntervalArchive, system_id) -> int:
+    """
+    Upsert every archived interval of the system into HistoricalData (one transaction per month).
+    Returns the number of intervals. Needs an application context.
+    """
+    count = 0
+    for month in archive.months(system_id):
+        arrays = archive.read_partition(system_id, month)
+        rows = [{"user_id": user_id, "endpoint_mask": endpoint_mask, "system_id": system_id, "timestamp_end": timestamp_end,
+                 "interval_len_sec": interval_len_sec, "production_wh": int(production_wh), "consumption_wh": int(consumption_wh),
+                 "import_wh": int(import_wh), "export_wh": int(export_wh),
+                 "batt_charge_wh": int(batt_charge_wh), "batt_discharge_wh": int(batt_discharge_wh)}
+                for user_id, endpoint_mask, timestamp_end, interval_len_sec, production_wh, consumption_wh, import_wh, export_wh, batt_charge_wh, batt_discharge_wh
+                in zip(*[arrays[field].tolist() for field in ARCHIVE_FIELDS])]
+        del arrays
+        if len(rows) == 0:
+            continue
+        ingest.upsert_intervals(rows)
+        update_week_coverage(system_id, rows[0]["timestamp_end"], rows[-1]["timestamp_end"])
+        bump_data_version(system_id)
+        db.session.commit()
+        count += len(rows)
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy interval data between the SQLite database and a monthly Arrow archive")
+    parser.add_argument("direction", choices=["export", "import"], help="export: database -> archive, import: archive -> database")
+    parser.add_argument("archive_dir")
+    parser.add_argument("--system-id", type=int, action="append", help="System to copy (repeatable, default: all)")
+    parser.add_argument("--database", default="sqlite:///users.db", help="SQLAlchemy database URI (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    flask_app = Flask(__name__)
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+    db.init_app(flask_app)
+    archive = IntervalArchive(args.archive_dir)
+    with flask_app.app_context():
+        db.create_all()
+        upgrade_schema()
+        system_ids = args.system_id
+        if system_ids is None:
+            if args.direction == "export":
+                system_ids = [row[0] for row in db.session.query(HistoricalData.system_id).distinct() if row[0] is not None]
+            else:
+                system_ids = archive.system_ids()
+
+        for system_id in system_ids:
+            start_time = time.perf_counter()
+            if args.direction == "export":
+                count = export_system(archive, system_id)
+            else:
+                count = import_system(archive, system_id)
+            elapsed = time.perf_counter() - start_time
+            print(f"{args.direction}ed {count} intervals of system {system_id} in {elapsed:.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import unittest
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from db_models import db, HistoricalData, WeekCoverage, ALL_DATA, BATTERY_DATA
+from db_models_test import make_app
+from solar_sim import IntervalColumns, INTERVAL_COLUMN_FIELDS
+import interval_archive
+
+def make_columns(first_end, count, production_wh=1.0):
+    timestamp_end = [first_end + timedelta(minutes=15*i) for i in range(count)]
+    return IntervalColumns(timestamp_end=timestamp_end, interval_len_sec=[900]*count, production_wh=[production_wh]*count,
+                           consumption_wh=np.arange(count), import_wh=[2]*count, export_wh=[3]*count,
+                           batt_charge_wh=[4]*count, batt_discharge_wh=[5]*count)
+
+@unittest.skipIf(interval_archive.pa is None, "pyarrow is not installed")
+class TestIntervalArchive(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.archive = interval_archive.IntervalArchive(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_write_and_read_range(self):
+        columns = make_columns(datetime(2025, 1, 30), 96*5) # Jan 30 - Feb 4
+        self.assertEqual(self.archive.write(7, 1, columns), [datetime(2025, 1, 1), datetime(2025, 2, 1)])
+        self.assertEqual(self.archive.months(7), [datetime(2025, 1, 1), datetime(2025, 2, 1)])
+        self.assertEqual(self.archive.system_ids(), [7])
+
+        whole = self.archive.read(7)
+        for field in INTERVAL_COLUMN_FIELDS:
+            np.testing.assert_array_equal(getattr(whole, field), getattr(columns, field), err_msg=field)
+
+        start, end = datetime(2025, 2, 1), datetime(2025, 2, 2)
+        expected = columns.between(start, end)
+        sliced = self.archive.read(7, start, end)
+        np.testing.assert_array_equal(sliced.timestamp_end, expected.timestamp_end)
+        np.testing.assert_array_equal(sliced.consumption_wh, expected.consumption_wh)
+        self.assertEqual(len(self.archive.read(7, datetime(2025, 3, 1), datetime(2025, 4, 1))), 0)
+        self.assertEqual(len(self.archive.read(8)), 0)
+
+    def test_single_month_is_memory_mapped(self):
+        self.archive.write(7, 1, make_columns(datetime(2025, 1, 1, 0, 15), 96))
+        columns = self.archive.read(7, datetime(2025, 1, 1), datetime(2025, 2, 1))
+        self.assertEqual(len(columns), 96)
+        self.assertFalse(columns.production_wh.flags.owndata)
+        self.assertFalse(self.archive.read(7, user_id=1).production_wh.flags.owndata)
+
+    def test_read_one_user(self):
+        self.archive.write(7, 1, make_columns(datetime(2025, 1, 1, 0, 15), 96, production_wh=1.0))
+        self.archive.write(7, 2, make_columns(datetime(2025, 1, 2, 0, 15), 96, production_wh=2.0))
+        self.assertEqual(len(self.archive.read(7)), 192)
+        np.testing.assert_array_equal(self.archive.read(7, user_id=2).production_wh, [2.0]*96)
+        self.assertEqual(len(self.archive.read(7, datetime(2025, 1, 1), datetime(2025, 1, 2), user_id=2)), 0)
+
+    def test_write_replaces_matching_intervals(self):
+        self.archive.write(7, 1, make_columns(datetime(2025, 1, 1, 0, 15), 96, production_wh=1.0))
+        self.archive.write(7, 1, make_columns(datetime(2025, 1, 1, 12, 15), 96, production_wh=2.0))
+        columns = self.archive.read(7)
+        self.assertEqual(len(columns), 96 + 48)
+        self.assertTrue((np.diff(columns.timestamp_end) > np.timedelta64(0)).all())
+        np.testing.assert_array_equal(columns.production_wh, [1.0]*48 + [2.0]*96)
+
+@unittest.skipIf(interval_archive.pa is None, "pyarrow is not installed")
+class TestArchiveDatabaseCopy(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.archive = interval_archive.IntervalArchive(self.root)
+        self.app = make_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        shutil.rmtree(self.root)
+
+    def stored(self):
+        return [(row.user_id, row.timestamp_end, row.production_wh, row.consumption_wh, row.endpoint_mask)
+                for row in HistoricalData.query.filter_by(system_id=7).order_by(HistoricalData.timestamp_end)]
+
+    def test_export_import_round_trip(self):
+        columns = make_columns(datetime(2025, 1, 29, 0, 15), 96*7)
+        for i in range(len(columns)):
+            db.session.add(HistoricalData(user_id=3, system_id=7, timestamp_end=columns.timestamp_end[i].item(), interval_len_sec=900,
+                                          production_wh=1, consumption_wh=i, import_wh=2, export_wh=3, batt_charge_wh=4, batt_discharge_wh=5,
+                                          endpoint_mask=ALL_DATA if i > 0 else ALL_DATA & ~BATTERY_DATA))
+        db.session.commit()
+        expected = self.stored()
+
+        self.assertEqual(interval_archive.export_system(self.archive, 7, chunk_size=100), len(columns))
+        np.testing.assert_array_equal(self.archive.read(7).timestamp_end, columns.timestamp_end)
+
+        HistoricalData.query.delete()
+        db.session.commit()
+        self.assertEqual(interval_archive.import_system(self.archive, 7), len(columns))
+        self.assertEqual(self.stored(), expected)
+        self.assertEqual(self.stored()[0][-1], ALL_DATA & ~BATTERY_DATA) # Partial intervals stay partial
+        self.assertEqual(WeekCoverage.query.filter_by(system_id=7, week_start=datetime(2025, 1, 29)).first().row_count, 96*3 - 1) # Jan 29 - 31
+
+    def test_export_months_drops_deleted_intervals(self):
+        for i in range(96*3):
+            db.session.add(HistoricalData(user_id=3, system_id=7, timestamp_end=datetime(2025, 1, 1) + timedelta(minutes=15*(i+1)),
+                                          interval_len_sec=900, production_wh=1, consumption_wh=i, import_wh=0, export_wh=0,
+                                          batt_charge_wh=0, batt_discharge_wh=0))
+        db.session.commit()
+        interval_archive.export_system(self.archive, 7)
+        HistoricalData.query.filter(HistoricalData.timestamp_end > datetime(2025, 1, 3)).delete()
+        db.session.commit()
+
+        interval_archive.export_system(self.archive, 7, datetime(2025, 1, 3), datetime(2025, 1, 4))
+        self.assertEqual(len(self.archive.read(7)), 96*2)
+
+    def test_export_swaps_months_and_clears_stale_marker(self):
+        for i in range(96*3):
+            db.session.add(HistoricalData(user_id=3, system_id=7, timestamp_end=datetime(2025, 1, 30) + timedelta(minutes=15*(i+1)),
+                                          interval_len_sec=900, production_wh=1, consumption_wh=i, import_wh=0, export_wh=0,
+                                          batt_charge_wh=0, batt_discharge_wh=0))
+        db.session.commit()
+        interval_archive.export_system(self.archive, 7)
+        self.archive.mark_stale(7)
+        HistoricalData.query.filter(HistoricalData.timestamp_end > datetime(2025, 2, 1)).update({HistoricalData.production_wh: 5})
+        db.session.commit()
+
+        interval_archive.export_system(self.archive, 7, datetime(2025, 2, 1), datetime(2025, 2, 1))
+        columns = self.archive.read(7)
+        np.testing.assert_array_equal(columns.production_wh, [1.0]*(96*2) + [5.0]*96)
+        self.assertTrue(self.archive.is_stale(7)) # Only a full export resynchronizes
+        self.assertEqual(os.listdir(self.root), ["system_7"]) # Staging directory removed
+
+        HistoricalData.query.filter(HistoricalData.timestamp_end >= datetime(2025, 2, 1)).delete()
+        db.session.commit()
+        interval_archive.export_system(self.archive, 7)
+        self.assertFalse(self.archive.is_stale(7))
+        self.assertEqual(self.archive.months(7), [datetime(2025, 1, 1)])
+
+    def test_command_line(self):
+        db_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        db_file.close()
+        interval_archive.main(["import", self.root, "--database", f"sqlite:///{db_file.name}"])
+        self.archive.write(7, 1, make_columns(datetime(2025, 1, 1, 0, 15), 10))
+        interval_archive.main(["import", self.root, "--database", f"sqlite:///{db_file.name}"])
+        shutil.rmtree(self.root)
+        interval_archive.main(["export", self.root, "--system-id", "7", "--database", f"sqlite:///{db_file.name}"])
+        self.assertEqual(len(self.archive.read(7)), 10)
+        os.remove(db_file.name)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Token-bucket rate limiter kept in SQLite, shared by every thread and process using the same file.
+"""
+import sqlite3
+import threading
+import time
+
+class TokenBucketLimiter:
+    """
+    Allows bursts of up to capacity calls, refilled at rate_per_minute, so at most
+    capacity + rate_per_minute calls are made in any one minute.
+
+    The bucket (tokens and last update time) is one row in the SQLite file at path, updated in a
+    write transaction, so each call is O(1) and all processes see the same budget. Callers take
+    their tokens in order and may run the bucket negative: a negative balance is the callers
+    already waiting for a slot, so a new caller's wait is known immediately and waits are spaced
+    evenly.
+    """
+    def __init__(self, path, rate_per_minute:float, capacity:float, name='default') -> None:
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.path = path
+        self.name = name
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity
+        #Waits of this process, for monitoring
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.total_wait_sec = 0.0
+        self.max_wait_sec = 0.0
+        self.last_wait_sec = 0.0
+
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS token_bucket (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        #A connection per call: safe to share the limiter between threads and forked processes
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def _tokens_at(self, tokens:float, updated_at:float, now:float) -> float:
+        return min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate_per_minute / 60)
+
+    def _wait_sec(self, tokens:float) -> float:
+        # Time until the balance is back to zero
+        return max(0.0, -tokens) * 60 / self.rate_per_minute
+
+    def _update(self, tokens_needed:float, now, take:bool, only_if_available:bool):
+        """
+        Refill the bucket to now and (optionally) take tokens_needed. Returns (balance after, taken).
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE") # Lock out other writers while reading and updating
+            row = conn.execute("SELECT tokens, updated_at FROM token_bucket WHERE name = ?", (self.name,)).fetchone()
+            now = now if now is not None else time.time()
+            if row is None:
+                tokens = self.capacity
+            else:
+                tokens = self._tokens_at(row[0], row[1], now)
+            taken = take and (not only_if_available or tokens >= tokens_needed)
+            if taken:
+                tokens -= tokens_needed
+                conn.execute("INSERT OR REPLACE INTO token_bucket (name, tokens, updated_at) VALUES (?, ?, ?)", (self.name, tokens, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return tokens, taken
+
+    def available_tokens(self, now=None) -> float:
+        """
+        Current balance; negative while callers are waiting for slots
+        """
+        return self._update(0, now, take=False, only_if_available=False)[0]
+
+    def earliest_slot(self, tokens=1, now=None) -> float:
+        """
+        Seconds until tokens would be available, without taking them
+        """
+        return self._wait_sec(self.available_tokens(now) - tokens)
+
+    def try_acquire(self, tokens=1, now=None) -> bool:
+        """
+        Take tokens if they are available now, without waiting
+        """
+        return self._update(tokens, now, take=True, only_if_available=True)[1]
+
+    def reserve(self, tokens=1, now=None) -> float:
+        """
+        Take tokens now and return the seconds to wait before using them
+        """
+        balance, _ = self._update(tokens, now, take=True, only_if_available=False)
+        return self._wait_sec(balance)
+
+    def acquire(self, tokens=1) -> float:
+        """
+        Take tokens, sleeping until their slot. Returns the seconds waited.
+        """
+        wait_sec = self.reserve(tokens)
+        if wait_sec > 0:
+            print(f"Waiting for {wait_sec:.1f} seconds until next API call.")
+            time.sleep(wait_sec)
+        with self.lock:
+            self.acquired += 1
+            self.total_wait_sec += wait_sec
+            self.max_wait_sec = max(self.max_wait_sec, wait_sec)
+            self.last_wait_sec = wait_sec
+        return wait_sec
+
+    def status(self) -> dict:
+        with self.lock:
+            acquired = self.acquired
+            stats = {"acquired": acquired, "total_wait_sec": self.total_wait_sec, "max_wait_sec": self.max_wait_sec,
+                     "last_wait_sec": self.last_wait_sec, "mean_wait_sec": self.total_wait_sec / acquired if acquired > 0 else 0.0}
+        tokens = self.available_tokens()
+        return {"tokens": tokens, "capacity": self.capacity, "rate_per_minute": self.rate_per_minute,
+                "next_slot_sec": self._wait_sec(tokens - 1), **stats}
@@ -0,0 +1,72 @@
+import unittest
+import multiprocessing
+import os
+import tempfile
+import threading
+
+from rate_limiter import TokenBucketLimiter
+
+NOW = 1700000000.0
+
+def reserve_in_process(path, count):
+    limiter = TokenBucketLimiter(path, rate_per_minute=60, capacity=2)
+    return [limiter.reserve(now=NOW) for _ in range(count)]
+
+class TestTokenBucketLimiter(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.limiter = TokenBucketLimiter(self.path, rate_per_minute=60, capacity=2)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_burst_then_refill(self):
+        self.assertEqual(self.limiter.available_tokens(now=NOW), 2)
+        self.assertEqual(self.limiter.reserve(now=NOW), 0)
+        self.assertEqual(self.limiter.reserve(now=NOW), 0)
+        self.assertEqual(self.limiter.earliest_slot(now=NOW), 1)
+        self.assertFalse(self.limiter.try_acquire(now=NOW))
+        self.assertEqual(self.limiter.reserve(now=NOW), 1) # Waiting callers are spaced by 1 / rate
+        self.assertEqual(self.limiter.reserve(now=NOW), 2)
+        self.assertEqual(self.limiter.available_tokens(now=NOW), -2)
+
+        self.assertEqual(self.limiter.earliest_slot(now=NOW + 2.5), 0.5)
+        self.assertTrue(self.limiter.try_acquire(now=NOW + 3))
+        self.assertEqual(self.limiter.available_tokens(now=NOW + 100), 2) # Never more than capacity
+
+    def test_shared_by_limiters_on_the_same_file(self):
+        other = TokenBucketLimiter(self.path, rate_per_minute=60, capacity=2)
+        self.limiter.reserve(now=NOW)
+        self.assertEqual(other.reserve(now=NOW), 0)
+        self.assertEqual(other.reserve(now=NOW), 1)
+        self.assertEqual(TokenBucketLimiter(self.path, rate_per_minute=60, capacity=2, name="other").reserve(now=NOW), 0)
+
+    def test_threads_and_processes(self):
+        waits = []
+        threads = [threading.Thread(target=lambda: waits.append(self.limiter.reserve(now=NOW))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(waits), [0, 0, 1, 2])
+
+        with multiprocessing.get_context("spawn").Pool(2) as pool:
+            process_waits = pool.starmap(reserve_in_process, [(self.path, 3), (self.path, 3)])
+        self.assertEqual(sorted(process_waits[0] + process_waits[1]), [3, 4, 5, 6, 7, 8])
+
+    def test_acquire_status(self):
+        limiter = TokenBucketLimiter(self.path, rate_per_minute=600, capacity=1)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertGreater(limiter.acquire(), 0)
+        status = limiter.status()
+        self.assertEqual(status["acquired"], 2)
+        self.assertEqual(status["capacity"], 1)
+        self.assertGreater(status["max_wait_sec"], 0.05)
+        self.assertLessEqual(status["tokens"], 1)
+
+        with self.assertRaises(ValueError):
+            TokenBucketLimiter(self.path, rate_per_minute=0, capacity=1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+Run independent simulation scenarios in parallel worker processes.
+
+The interval data is written once to a memory-mapped file that every worker
+maps read-only, so only the small scenario parameters are sent per task.
+"""
+import copy
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import solar_sim
+
+INTERVAL_FIELDS = solar_sim.INTERVAL_COLUMN_FIELDS
+
+# Set in each worker process by _init_worker
+_worker_state = {}
+
+def write_interval_file(columns:solar_sim.IntervalColumns, path) -> None:
+    """
+    Write every IntervalColumns field (8 bytes per value) back to back into path.
+    """
+    with open(path, "wb") as f:
+        for field in INTERVAL_FIELDS:
+            getattr(columns, field).tofile(f)
+
+def map_interval_file(path, length:int) -> solar_sim.IntervalColumns:
+    """
+    Map a file written by write_interval_file as read-only IntervalColumns (no copy).
+    """
+    dtypes = {"timestamp_end": "datetime64[us]", "interval_len_sec": np.int64}
+    arrays = {}
+    for i, field in enumerate(INTERVAL_FIELDS):
+        arrays[field] = np.memmap(path, dtype=dtypes.get(field, np.float64), mode="r", offset=i*length*8, shape=(length,))
+    return solar_sim.IntervalColumns(**arrays)
+
+def _init_worker(path, length, grid, timeseries_panel_num, solar_consumption_bias):
+    _worker_state["columns"] = map_interval_file(path, length)
+    _worker_state["grid"] = grid
+    _worker_state["timeseries_panel_num"] = timeseries_panel_num
+    _worker_state["solar_consumption_bias"] = solar_consumption_bias
+
+def _run_scenario(scenario:dict) -> pd.DataFrame:
+    panels = solar_sim.SolarArray(panel_num=scenario["module_count"])
+    battery = solar_sim.SolarBattery(usable_energy_kwh=scenario["batt_usable_energy_kwh"],
+                                     charge_eff=scenario["batt_charge_eff"],
+                                     discharge_eff=scenario["batt_discharge_eff"],
+                                     max_c_rate=scenario["batt_max_c_rate"])
+    controller = solar_sim.SimController(panels=panels, battery=battery, grid=copy.deepcopy(_worker_state["grid"]))
+    return controller.simulate(_worker_state["columns"], _worker_state["timeseries_panel_num"],
+                               solar_consumption_bias=_worker_state["solar_consumption_bias"], engine=solar_sim.ENGINE_ARRAY)
+
+class SimBatch:
+    """
+    Scenarios submitted together to a ParallelSimExecutor.
+    """
+    def __init__(self, futures) -> None:
+        self._futures = futures
+
+    def __len__(self):
+        return len(self._futures)
+
+    def cancel(self) -> int:
+        """
+        Cancel every scenario that has not started yet. Returns how many were cancelled.
+        """
+        return sum(future.cancel() for future in self._futures)
+
+    def done(self) -> bool:
+        return all(future.done() for future in self._futures)
+
+    def results(self, timeout=None) -> list:
+        """
+        Result DataFrames in the order the scenarios were submitted.
+        Raises concurrent.futures.CancelledError if any scenario was cancelled.
+        """
+        return [future.result(timeout=timeout) for future in self._futures]
+
+class ParallelSimExecutor:
+    """
+    Simulate scenarios (rows of solar_sim.SWEEP_PARAMETERS, see solar_sim.sweep_scenarios)
+    over the same interval data and grid on a pool of max_workers processes
+    (default: one per CPU). Each scenario starts from fresh devices and a copy of grid.
+
+    Use as a context manager, or call close() to stop the workers and remove the data file.
+    """
+    def __init__(self, columns:solar_sim.IntervalColumns, grid:solar_sim.Grid, timeseries_panel_num,
+                 solar_consumption_bias=0.0, max_workers=None) -> None:
+        if max_workers is not None and max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if len(columns) == 0:
+            raise ValueError("No intervals to simulate") # np.memmap cannot map the empty data file
+
+        fd, self._path = tempfile.mkstemp(prefix="sim_intervals_", suffix=".bin")
+        os.close(fd)
+        write_interval_file(columns, self._path)
+        self._pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                         initargs=(self._path, len(columns), grid, timeseries_panel_num, solar_consumption_bias))
+
+    def submit(self, scenarios:pd.DataFrame) -> SimBatch:
+        scenarios = pd.DataFrame(scenarios, columns=solar_sim.SWEEP_PARAMETERS)
+        return SimBatch([self._pool.submit(_run_scenario, scenario) for scenario in scenarios.to_dict("records")])
+
+    def map(self, scenarios:pd.DataFrame) -> list:
+        return self.submit(scenarios).results()
+
+    def close(self, cancel_pending=False) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=cancel_pending)
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel_pending=exc_type is not None)
@@ -0,0 +1,55 @@
+import unittest
+import os
+from concurrent.futures import CancelledError
+
+import numpy as np
+
+from solar_sim import Grid, IntervalColumns, RESULT_COLUMNS, ENGINE_ARRAY, sweep_scenarios
+from solar_sim_test import get_example_timeseries, run_example_simulation
+from sim_executor import ParallelSimExecutor, map_interval_file
+
+class TestParallelSimExecutor(unittest.TestCase):
+    def setUp(self):
+        self.timeseries = get_example_timeseries(days=2)
+        self.columns = IntervalColumns.from_records(self.timeseries)
+
+    def test_interval_file_round_trip(self):
+        with ParallelSimExecutor(self.columns, Grid(initial_credits=0), 10, max_workers=1) as executor:
+            path = executor._path
+            mapped = map_interval_file(path, len(self.columns))
+            self.assertTrue((mapped.timestamp_end == self.columns.timestamp_end).all())
+            np.testing.assert_array_equal(mapped.batt_discharge_wh, self.columns.batt_discharge_wh)
+            del mapped
+        self.assertFalse(os.path.exists(path))
+
+    def test_results_in_submitted_order(self):
+        scenarios = sweep_scenarios([20, 0, 12], [2.5, 0], batt_charge_eff=[0.9], batt_discharge_eff=[0.9], batt_max_c_rate=[3])
+        with ParallelSimExecutor(self.columns, Grid(initial_credits=1.0), 10, solar_consumption_bias=0.2, max_workers=2) as executor:
+            results = executor.map(scenarios)
+
+        self.assertEqual(len(results), len(scenarios))
+        for result, (_, scenario) in zip(results, scenarios.iterrows()):
+            expected = run_example_simulation(ENGINE_ARRAY, self.timeseries, usable_energy_kwh=scenario["batt_usable_energy_kwh"],
+                                              panel_num=scenario["module_count"])[0]
+            for col in RESULT_COLUMNS[1:]:
+                np.testing.assert_allclose(result[col].values, expected[col].values, rtol=0, atol=1e-9, err_msg=col)
+
+    def test_cancel(self):
+        scenarios = sweep_scenarios(range(20), [0, 5])
+        with ParallelSimExecutor(self.columns, Grid(initial_credits=0), 10, max_workers=1) as executor:
+            batch = executor.submit(scenarios)
+            self.assertGreater(batch.cancel(), 0)
+            with self.assertRaises(CancelledError):
+                batch.results()
+            self.assertTrue(batch.done())
+
+    def test_invalid_worker_count(self):
+        with self.assertRaises(ValueError):
+            ParallelSimExecutor(self.columns, Grid(initial_credits=0), 10, max_workers=0)
+
+    def test_no_intervals(self):
+        with self.assertRaises(ValueError):
+            ParallelSimExecutor(IntervalColumns.from_records([]), Grid(initial_credits=0), 10, max_workers=1)
+
+if __name__ == "__main__":
+    unittest.main()
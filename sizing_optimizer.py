@@ -0,0 +1,169 @@
+"""
+Search panel count and battery size for the shortest payback period.
+"""
+import copy
+import time
+
+import pandas as pd
+
+import solar_sim
+
+class SizingResult:
+    """
+    Outcome of optimize_sizing. evaluations holds one row per configuration considered.
+    """
+    def __init__(self, module_count, batt_usable_energy_kwh, payback_years, annual_savings_dollars, hardware_cost_dollars,
+                 evaluations:pd.DataFrame, simulations:int, elapsed_sec:float) -> None:
+        self.module_count = module_count
+        self.batt_usable_energy_kwh = batt_usable_energy_kwh
+        self.payback_years = payback_years
+        self.annual_savings_dollars = annual_savings_dollars
+        self.hardware_cost_dollars = hardware_cost_dollars
+        self.evaluations = evaluations
+        self.simulations = simulations # Kernel runs (stopped early or not); the rest were cached
+        self.elapsed_sec = elapsed_sec
+
+    @property
+    def stopped_early(self) -> int:
+        return int(self.evaluations["stopped_early"].sum())
+
+    def to_dict(self) -> dict:
+        return {"module_count": self.module_count,
+                "batt_usable_energy_kwh": self.batt_usable_energy_kwh,
+                "payback_years": self.payback_years,
+                "annual_savings_dollars": self.annual_savings_dollars,
+                "hardware_cost_dollars": self.hardware_cost_dollars,
+                "evaluation_count": len(self.evaluations),
+                "simulations": self.simulations,
+                "stopped_early": self.stopped_early,
+                "elapsed_sec": self.elapsed_sec}
+
+class SizingObjective:
+    """
+    Payback period (years) of a configuration: hardware cost / annualized savings
+    against the grid-only baseline. Evaluations are cached by configuration.
+
+    Once a best payback is known, each simulation is given the import cost above which
+    it could no longer beat it and stops there (ArraySimKernel cost_limit); import cost
+    never decreases, so this cannot discard a better configuration.
+    """
+    def __init__(self, columns:solar_sim.IntervalColumns, grid:solar_sim.Grid, timeseries_panel_num,
+                 panel_cost_dollars, batt_cost_per_kwh_dollars, fixed_cost_dollars=0.0, solar_consumption_bias=0.0,
+                 batt_charge_eff=0.9, batt_discharge_eff=0.9, batt_max_c_rate=3.0, baseline:pd.DataFrame=None) -> None:
+        if len(columns) == 0:
+            raise ValueError("No interval data to simulate")
+        self.columns = columns
+        self.grid = grid
+        self.timeseries_panel_num = timeseries_panel_num
+        self.panel_cost_dollars = panel_cost_dollars
+        self.batt_cost_per_kwh_dollars = batt_cost_per_kwh_dollars
+        self.fixed_cost_dollars = fixed_cost_dollars
+        self.solar_consumption_bias = solar_consumption_bias
+        self.batt_charge_eff = batt_charge_eff
+        self.batt_discharge_eff = batt_discharge_eff
+        self.batt_max_c_rate = batt_max_c_rate
+
+        if baseline is None:
+            baseline = solar_sim.simulate_baseline(columns, grid, solar_consumption_bias)
+        self.baseline_cost = baseline["import_cost"].sum()
+        self.years = columns.interval_len_sec.sum() / (365*24*3600)
+
+        self.best_payback_years = float("inf")
+        self.simulations = 0
+        self._cache = {}
+
+    def hardware_cost(self, module_count, batt_usable_energy_kwh) -> float:
+        return self.fixed_cost_dollars + module_count*self.panel_cost_dollars + batt_usable_energy_kwh*self.batt_cost_per_kwh_dollars
+
+    def __call__(self, module_count, batt_usable_energy_kwh) -> float:
+        key = (module_count, batt_usable_energy_kwh)
+        if key not in self._cache:
+            self._cache[key] = self._evaluate(module_count, batt_usable_energy_kwh)
+            if self._cache[key]["payback_years"] < self.best_payback_years:
+                self.best_payback_years = self._cache[key]["payback_years"]
+        return self._cache[key]["payback_years"]
+
+    def _evaluate(self, module_count, batt_usable_energy_kwh) -> dict:
+        hardware_cost = self.hardware_cost(module_count, batt_usable_energy_kwh)
+        evaluation = {"module_count": module_count, "batt_usable_energy_kwh": batt_usable_energy_kwh,
+                      "hardware_cost_dollars": hardware_cost, "annual_savings_dollars": float("nan"),
+                      "payback_years": float("inf"), "stopped_early": False}
+        if module_count == 0 and batt_usable_energy_kwh == 0:
+            #Nothing installed, nothing to pay back
+            return evaluation
+
+        cost_limit = None
+        if self.best_payback_years < float("inf"):
+            cost_limit = self.baseline_cost - hardware_cost * self.years / self.best_payback_years
+
+        kernel = solar_sim.ArraySimKernel(solar_sim.SolarArray(panel_num=module_count),
+                                          solar_sim.SolarBattery(usable_energy_kwh=batt_usable_energy_kwh,
+                                                                 charge_eff=self.batt_charge_eff,
+                                                                 discharge_eff=self.batt_discharge_eff,
+                                                                 max_c_rate=self.batt_max_c_rate),
+                                          copy.deepcopy(self.grid), self.timeseries_panel_num, self.solar_consumption_bias)
+        results = kernel.run(self.columns, cost_limit=cost_limit)
+        self.simulations += 1
+        if kernel.stopped_early:
+            evaluation["stopped_early"] = True
+            return evaluation
+
+        annual_savings = (self.baseline_cost - results["import_cost"].sum()) / self.years
+        evaluation["annual_savings_dollars"] = annual_savings
+        if annual_savings > 0:
+            evaluation["payback_years"] = hardware_cost / annual_savings
+        return evaluation
+
+    def evaluations(self) -> pd.DataFrame:
+        return pd.DataFrame(list(self._cache.values()),
+                            columns=["module_count", "batt_usable_energy_kwh", "hardware_cost_dollars",
+                                     "annual_savings_dollars", "payback_years", "stopped_early"])
+
+def optimize_sizing(objective:SizingObjective, max_module_count:int, max_batt_kwh:float, batt_kwh_step=2.5,
+                    min_module_count=0) -> SizingResult:
+    """
+    Pattern search over panel counts min_module_count..max_module_count and battery sizes
+    0..max_batt_kwh (multiples of batt_kwh_step) for the shortest payback.
+
+    Starts in the middle of the range, moves to the best neighbour one step away along
+    either axis and halves the step when no neighbour improves, until the step is one
+    panel / one battery increment. Like any local search it can miss a distant optimum.
+    """
+    if max_module_count < min_module_count or max_batt_kwh < 0 or batt_kwh_step <= 0:
+        raise ValueError("Invalid sizing search range")
+    start_time = time.perf_counter()
+    max_batt_idx = int(max_batt_kwh // batt_kwh_step)
+
+    def payback(point):
+        return objective(point[0], point[1]*batt_kwh_step)
+
+    point = ((min_module_count + max_module_count)//2, max_batt_idx//2)
+    step = [max(1, (max_module_count - min_module_count)//4), max(1, max_batt_idx//4)]
+    best = payback(point)
+    while True:
+        neighbours = []
+        for axis, limits in ((0, (min_module_count, max_module_count)), (1, (0, max_batt_idx))):
+            for direction in (-1, 1):
+                candidate = list(point)
+                candidate[axis] = min(limits[1], max(limits[0], point[axis] + direction*step[axis]))
+                if tuple(candidate) != point:
+                    neighbours.append(tuple(candidate))
+
+        improved = False
+        for candidate in neighbours:
+            value = payback(candidate)
+            if value < best:
+                best, point, improved = value, candidate, True
+        if not improved:
+            if step == [1, 1]:
+                break
+            step = [max(1, step[0]//2), max(1, step[1]//2)]
+
+    evaluations = objective.evaluations()
+    best_row = evaluations[(evaluations["module_count"] == point[0]) &
+                           (evaluations["batt_usable_energy_kwh"] == point[1]*batt_kwh_step)].iloc[0]
+    return SizingResult(module_count=point[0], batt_usable_energy_kwh=point[1]*batt_kwh_step, payback_years=best,
+                        annual_savings_dollars=best_row["annual_savings_dollars"],
+                        hardware_cost_dollars=best_row["hardware_cost_dollars"],
+                        evaluations=evaluations, simulations=objective.simulations,
+                        elapsed_sec=time.perf_counter() - start_time)
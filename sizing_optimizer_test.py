@@ -0,0 +1,48 @@
+import unittest
+
+from solar_sim import Grid, IntervalColumns
+from solar_sim_test import get_example_timeseries
+from sizing_optimizer import SizingObjective, optimize_sizing
+
+def get_example_objective(days=14):
+    columns = IntervalColumns.from_records(get_example_timeseries(days=days))
+    return SizingObjective(columns, Grid(initial_credits=0), 10, panel_cost_dollars=300, batt_cost_per_kwh_dollars=600,
+                           fixed_cost_dollars=2000, solar_consumption_bias=0.2)
+
+class TestSizingOptimizer(unittest.TestCase):
+    def test_matches_exhaustive_search(self):
+        result = optimize_sizing(get_example_objective(), max_module_count=30, max_batt_kwh=10, batt_kwh_step=2.5)
+
+        objective = get_example_objective()
+        exhaustive = min((objective(m, b*2.5), m, b*2.5) for m in range(31) for b in range(5))
+        self.assertAlmostEqual(result.payback_years, exhaustive[0])
+        self.assertEqual((result.module_count, result.batt_usable_energy_kwh), exhaustive[1:])
+        self.assertAlmostEqual(result.hardware_cost_dollars, 2000 + 300*result.module_count + 600*result.batt_usable_energy_kwh)
+        self.assertLess(result.simulations, 31*5)
+        self.assertEqual(result.to_dict()["evaluation_count"], len(result.evaluations))
+
+    def test_cached_evaluations(self):
+        objective = get_example_objective(days=3)
+        first = objective(10, 5.0)
+        self.assertEqual(objective(10, 5.0), first)
+        self.assertEqual(objective.simulations, 1)
+        # No hardware, no payback (and nothing to simulate)
+        self.assertEqual(objective(0, 0.0), float("inf"))
+        self.assertEqual(objective.simulations, 1)
+
+    def test_early_termination(self):
+        objective = get_example_objective()
+        best = objective(30, 0.0)
+        self.assertEqual(objective(2, 10.0), float("inf"))
+        evaluations = objective.evaluations().set_index(["module_count", "batt_usable_energy_kwh"])
+        self.assertTrue(evaluations.loc[(2, 10.0), "stopped_early"])
+
+        # The full simulation agrees that it could not have been better
+        self.assertGreater(get_example_objective()(2, 10.0), best)
+
+    def test_invalid_range(self):
+        with self.assertRaises(ValueError):
+            optimize_sizing(get_example_objective(days=1), max_module_count=-1, max_batt_kwh=10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,23 @@
 from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import OrderedDict
+import threading
 from datetime import time, datetime, timedelta
-from math import floor
+from math import ceil, floor
+import hashlib
 
+import numpy as np
 import pandas as pd
-from scipy.optimize import minimize
+
+ENGINE_OBJECT = "object" # Step through SolarArray/SolarBattery/Grid objects
+ENGINE_ARRAY = "array" # ArraySimKernel over IntervalColumns
+
+# Columns produced by SimController.simulate, in order
+RESULT_COLUMNS = ["timestamp", 
+                  "produced_wh", "consumed_wh", "stored_wh", "charge_wh", "discharge_wh", "exported_wh", "imported_wh", 
+                  "soc", "batt_throughput_kwh", 
+                  "import_cost", "credits_earned", "credits_available", "lifetime_import_cost", 
+                  "is_peak", "is_weekend"]
 
 class SimTime:
     def __init__(self) -> None:
@@ -147,6 +161,10 @@ def is_not_strictly_increasing(lst):
     return False  # The list is strictly increasing
 
 class Table1D():
+    """
+    Piecewise linear lookup table. Breakpoints are validated once and stored as
+    arrays; lookups find their segment with a binary search.
+    """
     def __init__(self, x_ary:float, y_ary:float):
         if len(x_ary) != len(y_ary):
             raise ValueError("x and y must have the same length")
@@ -154,18 +172,203 @@ class Table1D():
             raise ValueError("x and y arrays must not be empty")
         elif is_not_strictly_increasing(x_ary):
             raise ValueError("x array must be strictly increasing")
-        self.x_ary = x_ary
-        self.y_ary = y_ary
+        self.x_ary = np.array(x_ary, dtype=np.float64)
+        self.y_ary = np.array(y_ary, dtype=np.float64)
+        # Plain lists are faster than NumPy scalars for single lookups
+        self._x_list = self.x_ary.tolist()
+        self._y_list = self.y_ary.tolist()
+
     def getValue(self, xVal):
-        for i in range(len(self.x_ary) - 1):
-            # Check if x lies between self.x_ary[i] and self.x_ary[i + 1]
-            if self.x_ary[i] <= xVal <= self.x_ary[i + 1]:
-                # Perform linear interpolation
-                y = self.y_ary[i] + (xVal - self.x_ary[i]) * (self.y_ary[i + 1] - self.y_ary[i]) / (self.x_ary[i + 1] - self.x_ary[i])
-                return y
-        raise ValueError(f"x ({xVal}) is out of range of the given x_ary ({self.x_ary})")
+        x_list = self._x_list
+        if not (len(x_list) > 1 and x_list[0] <= xVal <= x_list[-1]):
+            raise ValueError(f"x ({xVal}) is out of range of the given x_ary ({self.x_ary})")
+        # A value on a breakpoint uses the segment to its left
+        i = max(bisect_left(x_list, xVal) - 1, 0)
+        y_list = self._y_list
+        # Perform linear interpolation
+        return y_list[i] + (xVal - x_list[i]) * (y_list[i + 1] - y_list[i]) / (x_list[i + 1] - x_list[i])
+
+    def get_values(self, x_values) -> np.ndarray:
+        """
+        Vectorized getValue: interpolate every element of x_values in one call.
+        """
+        x_values = np.asarray(x_values, dtype=np.float64)
+        x_ary = self.x_ary
+        y_ary = self.y_ary
+        if len(x_ary) < 2 or not ((x_values >= x_ary[0]) & (x_values <= x_ary[-1])).all():
+            raise ValueError(f"x values are out of range of the given x_ary ({self.x_ary})")
+        i = np.maximum(np.searchsorted(x_ary, x_values, side="left") - 1, 0)
+        return y_ary[i] + (x_values - x_ary[i]) * (y_ary[i + 1] - y_ary[i]) / (x_ary[i + 1] - x_ary[i])
         
 
+def soc_at_energy(stored_energy_wh, usable_energy_kwh):
+    """
+    State of charge (0-1) of a battery with usable_energy_kwh holding stored_energy_wh.
+    A battery without capacity is reported as full.
+    """
+    if usable_energy_kwh == 0:
+        return 1.0
+    elif stored_energy_wh > usable_energy_kwh*1000:
+        raise ValueError("Requested energy is more than the maximum usable.")
+    return min(stored_energy_wh/(usable_energy_kwh*1000), 1.0)
+
+def discharge_rate_within_limits(wh_des, stored_energy_wh, usable_energy_kwh, max_c_rate, soc_derate:Table1D, dt_sec, batt_v):
+    """
+    Check if discharging wh_des over dt_sec is within the battery's derated C-rate.
+    """
+    one_c_amps = (usable_energy_kwh*1000) / batt_v
+    c_avail_start = max_c_rate * soc_derate.getValue(soc_at_energy(stored_energy_wh, usable_energy_kwh))
+
+    soc_end = soc_at_energy(max(0,stored_energy_wh - wh_des), usable_energy_kwh)
+    c_avail_end = max_c_rate * soc_derate.getValue(soc_end)
+
+    max_amps = one_c_amps * ((c_avail_start + c_avail_end) /2.0)
+    cur_amps = wh_des/dt_sec / batt_v
+
+    return cur_amps <= max_amps
+
+def charge_rate_within_limits(wh_des, stored_energy_wh, usable_energy_kwh, max_c_rate, soc_derate:Table1D, dt_sec, batt_v):
+    """
+    Check if charging wh_des over dt_sec is within the battery's derated C-rate.
+    """
+    one_c_amps = (usable_energy_kwh*1000) / batt_v
+    c_avail_start = max_c_rate * soc_derate.getValue(soc_at_energy(stored_energy_wh, usable_energy_kwh))
+
+    soc_end = soc_at_energy(min(stored_energy_wh,stored_energy_wh + wh_des), usable_energy_kwh)
+    c_avail_end = max_c_rate * soc_derate.getValue(soc_end)
+
+    max_amps = one_c_amps * ((c_avail_start + c_avail_end) /2.0)
+    cur_amps = wh_des/dt_sec / batt_v
+
+    return cur_amps <= max_amps
+
+def _first_rate_limited_wh(rate_margin, w_first, w_last, knots):
+    """
+    Return the first whole Wh in [w_first, w_last] where rate_margin(wh) > 0, or None.
+
+    rate_margin must be linear in wh between consecutive knots (the points where the
+    SoC derating curve changes slope), so each segment is solved directly and the
+    result is confirmed against rate_margin itself.
+    """
+    bounds = sorted(set([w_first, w_last] + [k for k in knots if w_first < k < w_last]))
+    for seg_start, seg_end in zip(bounds[:-1], bounds[1:]):
+        a = max(w_first, ceil(seg_start))
+        b = min(w_last, floor(seg_end))
+        if a > b:
+            continue
+        margin_a = rate_margin(a)
+        if margin_a > 0:
+            return a
+        margin_b = rate_margin(b)
+        if margin_b <= 0:
+            continue
+        # Linear within the segment: solve for the zero crossing
+        root = a + (0 - margin_a) * (b - a) / (margin_b - margin_a)
+        wh = min(b, max(a + 1, floor(root) + 1))
+        while wh > a + 1 and rate_margin(wh - 1) > 0:
+            wh -= 1
+        while wh < b and rate_margin(wh) <= 0:
+            wh += 1
+        return wh
+    return None
+
+def max_discharge_rate_wh(stored_energy_wh, usable_energy_kwh, max_c_rate, soc_derate:Table1D, dt_sec, batt_v):
+    """
+    Largest energy (whole Wh) that can be discharged over dt_sec within the derated C-rate.
+
+    Equivalent to stepping one Wh at a time (see _max_discharge_rate_wh_stepwise), but solved
+    per linear segment of the SoC derating curve.
+    """
+    if stored_energy_wh == 0:
+        return 0
+
+    usable_wh = usable_energy_kwh*1000
+    one_c_amps = usable_wh / batt_v
+    c_avail_start = max_c_rate * soc_derate.getValue(soc_at_energy(stored_energy_wh, usable_energy_kwh))
+
+    def rate_margin(wh):
+        tmp_soc = soc_at_energy(max(0,stored_energy_wh - wh), usable_energy_kwh)
+        cur_c_avail = max_c_rate * soc_derate.getValue(tmp_soc)
+        max_amps = one_c_amps * ((c_avail_start + cur_c_avail) /2.0)
+        cur_amps = wh/dt_sec / batt_v
+        return cur_amps - max_amps
+
+    knots = [stored_energy_wh - x*usable_wh for x in soc_derate.x_ary.tolist()] + [stored_energy_wh]
+    wh_limit = _first_rate_limited_wh(rate_margin, 1, floor(stored_energy_wh) + 1, knots)
+    if wh_limit is None:
+        wh_limit = floor(stored_energy_wh) + 1
+    return min(stored_energy_wh, wh_limit-1)
+
+def max_charge_rate_wh(stored_energy_wh, usable_energy_kwh, charge_eff, max_c_rate, soc_derate:Table1D, dt_sec, batt_v):
+    """
+    Largest energy (whole Wh) that can be charged over dt_sec within the derated C-rate.
+    Caution: This may return a larger energy than available to provide to the battery
+
+    Equivalent to stepping one Wh at a time (see _max_charge_rate_wh_stepwise), but solved
+    per linear segment of the SoC derating curve.
+    """
+    usable_wh = usable_energy_kwh*1000
+    if stored_energy_wh >= usable_wh:
+        return 0.0
+
+    one_c_amps = usable_wh / batt_v
+    c_avail_start = max_c_rate * soc_derate.getValue(soc_at_energy(stored_energy_wh, usable_energy_kwh))
+
+    def rate_margin(wh):
+        tmp_soc = soc_at_energy(min(usable_wh,stored_energy_wh + wh), usable_energy_kwh)
+        cur_c_avail = max_c_rate * soc_derate.getValue(tmp_soc)
+        max_amps = one_c_amps * ((c_avail_start + cur_c_avail) /2.0)
+        cur_amps = wh/dt_sec / batt_v
+        return cur_amps - max_amps
+
+    wh_last = floor((usable_wh - stored_energy_wh)/charge_eff) + 1
+    knots = [x*usable_wh - stored_energy_wh for x in soc_derate.x_ary.tolist()] + [usable_wh - stored_energy_wh]
+    wh_limit = _first_rate_limited_wh(rate_margin, 1, wh_last, knots)
+    if wh_limit is None:
+        wh_limit = wh_last
+    return wh_limit-1
+
+def _max_discharge_rate_wh_stepwise(stored_energy_wh, usable_energy_kwh, max_c_rate, soc_derate:Table1D, dt_sec, batt_v):
+    # Reference implementation of max_discharge_rate_wh, one Wh at a time (used by tests and solar_sim_bench.py)
+    if stored_energy_wh == 0:
+        return 0
+
+    one_c_amps = (usable_energy_kwh*1000) / batt_v
+    c_avail_start = max_c_rate * soc_derate.getValue(soc_at_energy(stored_energy_wh, usable_energy_kwh))
+    for wh in range(1,floor(stored_energy_wh) +2):
+        tmp_soc = soc_at_energy(max(0,stored_energy_wh - wh), usable_energy_kwh)
+        cur_c_avail = max_c_rate * soc_derate.getValue(tmp_soc)
+
+        max_amps = one_c_amps * ((c_avail_start + cur_c_avail) /2.0)
+
+        cur_amps = wh/dt_sec / batt_v
+
+        if cur_amps > max_amps:
+            break
+
+    return min(stored_energy_wh,wh-1)
+
+def _max_charge_rate_wh_stepwise(stored_energy_wh, usable_energy_kwh, charge_eff, max_c_rate, soc_derate:Table1D, dt_sec, batt_v):
+    # Reference implementation of max_charge_rate_wh, one Wh at a time (used by tests and solar_sim_bench.py)
+    usable_wh = usable_energy_kwh*1000
+    if stored_energy_wh >= usable_wh:
+        return 0.0
+
+    one_c_amps = usable_wh / batt_v
+    c_avail_start = max_c_rate * soc_derate.getValue(soc_at_energy(stored_energy_wh, usable_energy_kwh))
+    for wh in range(1, floor((usable_wh - stored_energy_wh)/charge_eff) +2):
+        tmp_soc = soc_at_energy(min(usable_wh,stored_energy_wh + wh), usable_energy_kwh)
+        cur_c_avail = max_c_rate * soc_derate.getValue(tmp_soc)
+
+        max_amps = one_c_amps * ((c_avail_start + cur_c_avail) /2.0)
+
+        cur_amps = wh/dt_sec / batt_v
+
+        if cur_amps > max_amps:
+            break
+
+    return wh-1
+
 class SolarBattery(PowerDevice):
     def __init__(self, usable_energy_kwh:float, charge_eff=0.93, discharge_eff=0.9, max_c_rate=5) -> None:
         super().__init__()
@@ -230,85 +433,43 @@ class SolarBattery(PowerDevice):
             self._cur_ts = self.time_obj.sim_time
 
     def get_soc_at_energy(self, stored_energy_wh):
-        if self.usable_energy_kwh == 0:
-            return 1.0
-        elif stored_energy_wh > self.usable_energy_wh:
-            raise ValueError("Requested energy is more than the maximum usable.")
-        return min(stored_energy_wh/(self.usable_energy_kwh*1000), 1.0)
+        return soc_at_energy(stored_energy_wh, self.usable_energy_kwh)
     
     def c_rate_to_current(self, c_rate):
         one_c_amps = (self.usable_energy_kwh*1000) / self.BATT_V
         return one_c_amps * c_rate
 
     def get_max_discharge_rate_wh(self):
-        if self._stored_energy_wh == 0:
-            return 0
-        
-        c_avail_start = self.max_c_rate * self.discharge_soc_degradation.getValue(self.soc)
-        for wh in range(1,floor(self._stored_energy_wh) +2):
-            tmp_soc = self.get_soc_at_energy(max(0,self._stored_energy_wh - wh))
-            cur_c_avail = self.max_c_rate * self.discharge_soc_degradation.getValue(tmp_soc)
-
-            max_amps = self.c_rate_to_current((c_avail_start + cur_c_avail) /2.0)
-
-            cur_amps = wh/self.time_obj.get_dt().total_seconds() / self.BATT_V
-
-            if cur_amps > max_amps:
-                break
-
-        return min(self._stored_energy_wh,wh-1)
+        return max_discharge_rate_wh(self._stored_energy_wh, self.usable_energy_kwh, self.max_c_rate,
+                                     self.discharge_soc_degradation, self.time_obj.get_dt().total_seconds(), self.BATT_V)
     
     def is_discharge_rate_within_limits(self, wh_des):
         """
         Check if the requested discharge rate is within the limits of the battery.
         Returns True if within limits, False otherwise.
         """
-        
-        c_avail_start = self.max_c_rate * self.discharge_soc_degradation.getValue(self.soc)
-
-        soc_end = self.get_soc_at_energy(max(0,self._stored_energy_wh - wh_des))
-        c_avail_end = self.max_c_rate * self.discharge_soc_degradation.getValue(soc_end)
-
-        max_amps = self.c_rate_to_current((c_avail_start + c_avail_end) /2.0)
-        cur_amps = wh_des/self.time_obj.get_dt().total_seconds() / self.BATT_V
-
-        return cur_amps <= max_amps
+        return discharge_rate_within_limits(wh_des, self._stored_energy_wh, self.usable_energy_kwh, self.max_c_rate,
+                                            self.discharge_soc_degradation, self.time_obj.get_dt().total_seconds(), self.BATT_V)
 
     def get_max_charge_rate_wh(self):
         #Caution: This may return a larger energy than available to provide to the battery
-        usable_wh = self.usable_energy_kwh*1000
-        if self._stored_energy_wh >= usable_wh:
-            return 0.0
-        
-        c_avail_start = self.max_c_rate * self.discharge_soc_degradation.getValue(self.soc)
-        for wh in range(1, floor((usable_wh - self._stored_energy_wh)/self.charge_eff) +2):
-            tmp_soc = self.get_soc_at_energy(min(self.usable_energy_wh,self._stored_energy_wh + wh))
-            cur_c_avail = self.max_c_rate * self.discharge_soc_degradation.getValue(tmp_soc)
-
-            max_amps = self.c_rate_to_current((c_avail_start + cur_c_avail) /2.0)
-
-            cur_amps = wh/self.time_obj.get_dt().total_seconds() / self.BATT_V
-
-            if cur_amps > max_amps:
-                break
-
-        return wh-1
+        return max_charge_rate_wh(self._stored_energy_wh, self.usable_energy_kwh, self.charge_eff, self.max_c_rate,
+                                  self.discharge_soc_degradation, self.time_obj.get_dt().total_seconds(), self.BATT_V)
     
     def is_charge_rate_within_limits(self, wh_des):
         """
         Check if the requested charge rate is within the limits of the battery.
         Returns True if within limits, False otherwise.
         """
-        
-        c_avail_start = self.max_c_rate * self.discharge_soc_degradation.getValue(self.soc)
-
-        soc_end = self.get_soc_at_energy(min(self._stored_energy_wh,self._stored_energy_wh + wh_des))
-        c_avail_end = self.max_c_rate * self.discharge_soc_degradation.getValue(soc_end)
+        return charge_rate_within_limits(wh_des, self._stored_energy_wh, self.usable_energy_kwh, self.max_c_rate,
+                                         self.discharge_soc_degradation, self.time_obj.get_dt().total_seconds(), self.BATT_V)
 
-        max_amps = self.c_rate_to_current((c_avail_start + c_avail_end) /2.0)
-        cur_amps = wh_des/self.time_obj.get_dt().total_seconds() / self.BATT_V
-
-        return cur_amps <= max_amps
+    def set_state(self, stored_energy_wh, throughput_wh):
+        """
+        Overwrite the stored energy and lifetime throughput (used to sync after an array simulation).
+        """
+        self.__stored_energy_wh = stored_energy_wh
+        self._throughput_wh = throughput_wh
     
     def __discharge_battery_wh(self, wh_des):
         #Discharge the battery, returning the energy (wh) provided
@@ -391,6 +552,23 @@ class SolarBattery(PowerDevice):
         """
         return self.__discharge_battery_wh(des_energy_wh)
     
+def _time_of_day_us(tod:time) -> int:
+    return ((tod.hour*60 + tod.minute)*60 + tod.second)*1000000 + tod.microsecond
+
+class TariffTimeline:
+    """
+    Per-step tariff arrays for a simulation timeline, compiled once by Grid.compile_tariff.
+    """
+    def __init__(self, is_peak, is_weekend, cost_per_kwh, creditable_per_kwh, gen_pay_per_kwh) -> None:
+        self.is_peak = is_peak
+        self.is_weekend = is_weekend
+        self.cost_per_kwh = cost_per_kwh
+        self.creditable_per_kwh = creditable_per_kwh # Already limited to cost_per_kwh
+        self.gen_pay_per_kwh = gen_pay_per_kwh
+
+    def __len__(self):
+        return len(self.is_peak)
+
 class Grid(PowerDevice):
     def __init__(self, initial_credits,
                  weekday_on_peak_start:time = time(15,0,0), #3:00PM
@@ -440,6 +618,28 @@ class Grid(PowerDevice):
         self._cur_credit = 0
         self._cur_ts = None
 
+        self._tariff = None
+        self.tariff_step = 0
+
+    def set_state(self, available_credits_dollars, money_spent_dollars):
+        """
+        Overwrite the credit balance and money spent (used to sync after an array simulation).
+        """
+        self._available_credits_dollars = available_credits_dollars
+        self._money_spent_dollars = money_spent_dollars
+
+    def tariff_key(self) -> tuple:
+        """
+        Hashable summary of the tariff schedule (peak windows and rates), for caching results.
+        """
+        return (self.weekday_on_peak_start, self.weekday_on_peak_end, self.weekend_on_peak_start, self.weekend_on_peak_end,
+                self.weekday_off_peak_cost_per_kwh, self.weekday_on_peak_cost_per_kwh,
+                self.weekend_off_peak_cost_per_kwh, self.weekend_on_peak_cost_per_kwh,
+                self.weekday_off_peak_gen_pay_per_kwh, self.weekday_on_peak_gen_pay_per_kwh,
+                self.weekend_off_peak_gen_pay_per_kwh, self.weekend_on_peak_gen_pay_per_kwh,
+                self.weekday_off_peak_creditable_per_kwh, self.weekday_on_peak_creditable_per_kwh,
+                self.weekend_off_peak_creditable_per_kwh, self.weekend_on_peak_creditable_per_kwh)
+
     def reset_memory(self) -> float:
         """
         Reset any internal remembered values (like lifetime throughput)
@@ -551,7 +751,50 @@ class Grid(PowerDevice):
         self._cur_ts_import_wh += des_energy_wh
         return des_energy_wh
 
+    def compile_tariff(self, timestamps) -> TariffTimeline:
+        """
+        Evaluate the time-of-use schedule for every timestamp at once.
+        """
+        timestamps = np.asarray(timestamps, dtype="datetime64[us]")
+        days = timestamps.astype("datetime64[D]")
+        tod_us = (timestamps - days).astype(np.int64)
+        is_weekend = ((days.astype(np.int64) + 3) % 7) >= 5 #1970-01-01 was a Thursday (3). sat=5, sun=6
+
+        weekday_peak = (tod_us >= _time_of_day_us(self.weekday_on_peak_start)) & (tod_us < _time_of_day_us(self.weekday_on_peak_end))
+        weekend_peak = (tod_us >= _time_of_day_us(self.weekend_on_peak_start)) & (tod_us < _time_of_day_us(self.weekend_on_peak_end))
+        is_peak = np.where(is_weekend, weekend_peak, weekday_peak)
+
+        def select(weekday_off_peak, weekday_on_peak, weekend_off_peak, weekend_on_peak):
+            return np.where(is_weekend,
+                            np.where(is_peak, weekend_on_peak, weekend_off_peak),
+                            np.where(is_peak, weekday_on_peak, weekday_off_peak)).astype(np.float64)
+
+        cost_per_kwh = select(self.weekday_off_peak_cost_per_kwh, self.weekday_on_peak_cost_per_kwh,
+                              self.weekend_off_peak_cost_per_kwh, self.weekend_on_peak_cost_per_kwh)
+        #Credit should not be more than the current cost
+        creditable_per_kwh = np.minimum(select(self.weekday_off_peak_creditable_per_kwh, self.weekday_on_peak_creditable_per_kwh,
+                                               self.weekend_off_peak_creditable_per_kwh, self.weekend_on_peak_creditable_per_kwh),
+                                        cost_per_kwh)
+        gen_pay_per_kwh = select(self.weekday_off_peak_gen_pay_per_kwh, self.weekday_on_peak_gen_pay_per_kwh,
+                                 self.weekend_off_peak_gen_pay_per_kwh, self.weekend_on_peak_gen_pay_per_kwh)
+        return TariffTimeline(is_peak, is_weekend, cost_per_kwh, creditable_per_kwh, gen_pay_per_kwh)
+
+    def set_tariff_timeline(self, tariff:TariffTimeline=None) -> None:
+        """
+        Read prices from a compiled TariffTimeline at index tariff_step instead of
+        evaluating the schedule at sim_time. Pass None to go back to the schedule.
+        """
+        if tariff is None:
+            self._tariff = None
+        else:
+            # Plain lists are faster than NumPy scalars for single lookups
+            self._tariff = (tariff.is_peak.tolist(), tariff.is_weekend.tolist(), tariff.cost_per_kwh.tolist(),
+                            tariff.creditable_per_kwh.tolist(), tariff.gen_pay_per_kwh.tolist())
+        self.tariff_step = 0
+
     def is_peak(self):
+        if self._tariff is not None:
+            return self._tariff[0][self.tariff_step]
         cur_tod = self.time_obj.sim_time.time()
 
         if self.is_weekend():
@@ -560,9 +803,13 @@ class Grid(PowerDevice):
             return (cur_tod >= self.weekday_on_peak_start) & (cur_tod < self.weekday_on_peak_end)
 
     def is_weekend(self):
+        if self._tariff is not None:
+            return self._tariff[1][self.tariff_step]
         return self.time_obj.sim_time.weekday() >= 5 #sat=5, sun=6
     
     def cur_energy_cost_per_kwh(self):
+        if self._tariff is not None:
+            return self._tariff[2][self.tariff_step]
         if self.is_weekend():
             if self.is_peak():
                 energy_cost_per_kwh = self.weekend_on_peak_cost_per_kwh
@@ -579,6 +826,8 @@ class Grid(PowerDevice):
         """
         Return how much per kwh credits can be used to offset energy cost at the current point in time.
         """
+        if self._tariff is not None:
+            return self._tariff[3][self.tariff_step]
         if self.is_weekend():
             if self.is_peak():
                 energy_cost_credit_coverable_per_kwh = self.weekend_on_peak_creditable_per_kwh
@@ -598,6 +847,8 @@ class Grid(PowerDevice):
         """
         Return how much credits are provided per kwh at the current time.
         """
+        if self._tariff is not None:
+            return self._tariff[4][self.tariff_step]
         if self.is_weekend():
             if self.is_peak():
                 credit_pay = self.weekend_on_peak_gen_pay_per_kwh
@@ -636,6 +887,866 @@ def solar_consumption_corr_objective(eff, consumption, solar):
 
 
 
+class SimResults:
+    """
+    Typed result columns for one simulation run, allocated once up front.
+
+    Holds 13 float64 columns, a datetime64[us] timestamp and two bool flags:
+    114 bytes per interval. A simulated year of 15-minute intervals (35,040 rows)
+    takes ~4.0 MB (3.8 MiB); to_dataframe() wraps the same arrays without copying.
+    """
+    BOOL_COLUMNS = ["is_peak", "is_weekend"]
+    FLOAT_COLUMNS = [col for col in RESULT_COLUMNS if col not in ("timestamp", "is_peak", "is_weekend")]
+    BYTES_PER_INTERVAL = 8 + 8*len(FLOAT_COLUMNS) + len(BOOL_COLUMNS)
+
+    def __init__(self, length:int) -> None:
+        self.columns = {}
+        for col in RESULT_COLUMNS:
+            if col == "timestamp":
+                self.columns[col] = np.empty(length, dtype="datetime64[us]")
+            elif col in self.BOOL_COLUMNS:
+                self.columns[col] = np.empty(length, dtype=bool)
+            else:
+                self.columns[col] = np.empty(length, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.columns["timestamp"])
+
+    def __getitem__(self, col):
+        return self.columns[col]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(ary.nbytes for ary in self.columns.values())
+
+    def truncate(self, length:int) -> None:
+        """
+        Keep only the first length intervals (views of the same buffers).
+        """
+        self.columns = {col: ary[:length] for col, ary in self.columns.items()}
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns, columns=RESULT_COLUMNS, copy=False)
+
+INTERVAL_COLUMN_FIELDS = ["timestamp_end", "interval_len_sec", "production_wh", "consumption_wh",
+                          "import_wh", "export_wh", "batt_charge_wh", "batt_discharge_wh"]
+
+class IntervalColumns:
+    """
+    Interval data (one entry per HistoricalData row) stored as NumPy column arrays.
+    """
+    def __init__(self, timestamp_end, interval_len_sec, production_wh, consumption_wh,
+                 import_wh, export_wh, batt_charge_wh, batt_discharge_wh) -> None:
+        self.timestamp_end = np.asarray(timestamp_end, dtype="datetime64[us]")
+        self.interval_len_sec = np.asarray(interval_len_sec, dtype=np.int64)
+        self.production_wh = np.asarray(production_wh, dtype=np.float64)
+        self.consumption_wh = np.asarray(consumption_wh, dtype=np.float64)
+        self.import_wh = np.asarray(import_wh, dtype=np.float64)
+        self.export_wh = np.asarray(export_wh, dtype=np.float64)
+        self.batt_charge_wh = np.asarray(batt_charge_wh, dtype=np.float64)
+        self.batt_discharge_wh = np.asarray(batt_discharge_wh, dtype=np.float64)
+
+    @classmethod
+    def from_records(cls, energy_timeseries):
+        """
+        Build columns from a sequence of HistoricalData-like objects.
+        """
+        return cls(timestamp_end=[step.timestamp_end for step in energy_timeseries],
+                   interval_len_sec=[step.interval_len_sec for step in energy_timeseries],
+                   production_wh=[step.production_wh for step in energy_timeseries],
+                   consumption_wh=[step.consumption_wh for step in energy_timeseries],
+                   import_wh=[step.import_wh for step in energy_timeseries],
+                   export_wh=[step.export_wh for step in energy_timeseries],
+                   batt_charge_wh=[step.batt_charge_wh for step in energy_timeseries],
+                   batt_discharge_wh=[step.batt_discharge_wh for step in energy_timeseries])
+
+    @property
+    def timestamp_start(self):
+        return self.timestamp_end - self.interval_len_sec.astype("timedelta64[s]")
+
+    def content_hash(self) -> str:
+        """
+        Digest of every column, to identify the data a cached result was computed from.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for field in INTERVAL_COLUMN_FIELDS:
+            digest.update(np.ascontiguousarray(getattr(self, field)).tobytes())
+        return digest.hexdigest()
+
+    def between(self, start, end):
+        """
+        Intervals with start < timestamp_end <= end (timestamps must be sorted), as views of these columns.
+        """
+        lo = np.searchsorted(self.timestamp_end, np.datetime64(start, "us"), side="right")
+        hi = np.searchsorted(self.timestamp_end, np.datetime64(end, "us"), side="right")
+        return IntervalColumns(**{field: getattr(self, field)[lo:hi] for field in INTERVAL_COLUMN_FIELDS})
+
+    def first_gap(self, prev_end, tolerance_sec=30):
+        """
+        Index of the first interval that does not follow on from the one before it
+        (prev_end for the first) within tolerance_sec, or None if there are no gaps.
+        """
+        times = np.concatenate(([np.datetime64(prev_end, "us")], self.timestamp_end))
+        gap_sec = np.diff(times).astype(np.int64) / 1e6
+        gaps = np.flatnonzero(gap_sec > self.interval_len_sec + tolerance_sec)
+        return int(gaps[0]) if len(gaps) > 0 else None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, field).nbytes for field in INTERVAL_COLUMN_FIELDS)
+
+    def __len__(self):
+        return len(self.timestamp_end)
+
+def iter_interval_columns(energy_timeseries, chunk_size=4096):
+    """
+    Group an iterable of HistoricalData-like records (e.g. a server-side cursor) into
+    IntervalColumns of up to chunk_size intervals, without holding more than one chunk.
+    """
+    chunk = []
+    for step in energy_timeseries:
+        chunk.append(step)
+        if len(chunk) == chunk_size:
+            yield IntervalColumns.from_records(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        yield IntervalColumns.from_records(chunk)
+
+def _timestep_dt_sec(timestamps, prev_time, prev_dt_sec):
+    """
+    Seconds between each timestamp and the one before it (prev_time for the first),
+    as SimTime.get_dt would report them. Returns (dt list, last dt).
+    """
+    times = np.concatenate(([np.datetime64(prev_time, "us")], timestamps))
+    dt_us = np.diff(times).astype(np.int64)
+    if (dt_us < 0).any():
+        raise ValueError("New time is before current time!")
+    dt_sec = (dt_us / 1e6).tolist()
+    #Repeated timestamps keep the previous dt (see SimTime.sim_time)
+    for i, dt in enumerate(dt_sec):
+        if dt == 0:
+            dt_sec[i] = prev_dt_sec
+        prev_dt_sec = dt_sec[i]
+    return dt_sec, prev_dt_sec
+
+def _battery_discharge_wh(wh_des, stored_energy_wh, usable_energy_kwh, discharge_eff, max_c_rate, soc_derate, dt_sec, batt_v):
+    """
+    Stateless equivalent of SolarBattery.get_energy.
+    Returns (wh_exported, new_stored_energy_wh).
+    """
+    if wh_des == 0:
+        return 0, stored_energy_wh
+
+    avail_export_wh = stored_energy_wh * discharge_eff
+    if discharge_rate_within_limits(avail_export_wh, stored_energy_wh, usable_energy_kwh, max_c_rate, soc_derate, dt_sec, batt_v):
+        avail_export_arb_wh = avail_export_wh
+    else:
+        avail_export_arb_wh = min(avail_export_wh,
+                                  max_discharge_rate_wh(stored_energy_wh, usable_energy_kwh, max_c_rate, soc_derate, dt_sec, batt_v))
+
+    wh_exported = min(avail_export_arb_wh, wh_des)
+    wh_reduced = wh_exported / discharge_eff
+    if wh_reduced > stored_energy_wh:
+        #Something went wrong numerically.. adjust
+        wh_reduced = stored_energy_wh
+        wh_exported = wh_reduced * discharge_eff
+
+    return wh_exported, stored_energy_wh - wh_reduced
+
+def _battery_charge_wh(wh_des, stored_energy_wh, usable_energy_kwh, charge_eff, max_c_rate, soc_derate, dt_sec, batt_v):
+    """
+    Stateless equivalent of SolarBattery.store_energy.
+    Returns (wh_imported, new_stored_energy_wh, throughput_increase_wh).
+    """
+    if wh_des == 0:
+        return 0.0, stored_energy_wh, 0
+
+    avail_sync_wh = usable_energy_kwh*1000 - stored_energy_wh
+    avail_import_wh = avail_sync_wh / charge_eff
+    if charge_rate_within_limits(avail_import_wh, stored_energy_wh, usable_energy_kwh, max_c_rate, soc_derate, dt_sec, batt_v):
+        avail_import_arb_wh = avail_import_wh
+    else:
+        avail_import_arb_wh = min(avail_import_wh,
+                                  max_charge_rate_wh(stored_energy_wh, usable_energy_kwh, charge_eff, max_c_rate, soc_derate, dt_sec, batt_v))
+
+    wh_imported = min(avail_import_arb_wh, wh_des)
+
+    new_stored_wh = stored_energy_wh + wh_imported * charge_eff
+    throughput_increase_wh = new_stored_wh - stored_energy_wh if new_stored_wh > stored_energy_wh else 0
+    if new_stored_wh > (usable_energy_kwh*1000):
+        #Something went wrong numerically.. but reset
+        new_stored_wh = usable_energy_kwh*1000
+
+    return wh_imported, new_stored_wh, throughput_increase_wh
+
+class ArraySimKernel:
+    """
+    Array-backed simulation engine (SimController.simulate(..., engine=ENGINE_ARRAY)).
+
+    Runs the same solar -> battery -> grid dispatch as the object engine, but reads
+    IntervalColumns, keeps all device state in plain floats and writes typed result
+    columns. Floating point operations happen in the same order as in the object
+    engine, so every result column agrees with it to within 1e-6 (Wh, $ or SoC).
+
+    Device parameters and starting state are read from the objects passed in;
+    call sync_devices() to write the final state back to them.
+    """
+    def __init__(self, panels:SolarArray, battery:SolarBattery, grid:Grid, timeseries_panel_num, solar_consumption_bias=0.0):
+        self.panels = panels
+        self.battery = battery
+        self.grid = grid
+        self.timeseries_panel_num = timeseries_panel_num
+        self.solar_consumption_bias = solar_consumption_bias
+
+        self.solar_lifetime_wh = panels.lifetime_energy_wh
+        self.stored_energy_wh = battery._stored_energy_wh
+        self.throughput_wh = battery.throughput_wh
+        self.credits_available = grid.available_credits_dollars
+        self.money_spent = grid.money_spent_dollars
+        #Like the object engine, the first step is measured from the shared SimTime,
+        #so it is effectively never rate limited
+        self.prev_time = np.datetime64(battery.time_obj.sim_time, "us")
+        self.prev_dt_sec = battery.time_obj.get_dt().total_seconds()
+        self.stopped_early = False
+
+    def run(self, columns:IntervalColumns, cost_limit=None) -> SimResults:
+        """
+        Simulate every interval in columns.
+
+        With cost_limit, stop as soon as the import cost of this run exceeds it: the results
+        end at that interval and stopped_early is set (the kernel state is then partial).
+        """
+        n = len(columns)
+        results = SimResults(n)
+        self.stopped_early = False
+        if n == 0:
+            return results
+
+        timestamps = columns.timestamp_start
+        dt_list, self.prev_dt_sec = _timestep_dt_sec(timestamps, self.prev_time, self.prev_dt_sec)
+        tariff = self.grid.compile_tariff(timestamps)
+
+        results["timestamp"][:] = timestamps
+        results["is_peak"][:] = tariff.is_peak
+        results["is_weekend"][:] = tariff.is_weekend
+
+        produced_out = results["produced_wh"]
+        consumed_out = results["consumed_wh"]
+        stored_out = results["stored_wh"]
+        charge_out = results["charge_wh"]
+        discharge_out = results["discharge_wh"]
+        exported_out = results["exported_wh"]
+        imported_out = results["imported_wh"]
+        soc_out = results["soc"]
+        throughput_out = results["batt_throughput_kwh"]
+        import_cost_out = results["import_cost"]
+        credits_earned_out = results["credits_earned"]
+        credits_available_out = results["credits_available"]
+        lifetime_cost_out = results["lifetime_import_cost"]
+
+        panel_num = self.panels.panel_num
+        timeseries_panel_num = self.timeseries_panel_num
+        bias = self.solar_consumption_bias
+        usable_kwh = self.battery.usable_energy_kwh
+        charge_eff = self.battery.charge_eff
+        discharge_eff = self.battery.discharge_eff
+        max_c_rate = self.battery.max_c_rate
+        soc_derate = self.battery.discharge_soc_degradation
+        batt_v = self.battery.BATT_V
+
+        solar_lifetime_wh = self.solar_lifetime_wh
+        stored_wh = self.stored_energy_wh
+        throughput_wh = self.throughput_wh
+        credits_available = self.credits_available
+        money_spent = self.money_spent
+        money_limit = money_spent + cost_limit if cost_limit is not None else float("inf")
+
+        rows = zip(dt_list, columns.production_wh.tolist(), columns.consumption_wh.tolist(),
+                   columns.import_wh.tolist(), columns.export_wh.tolist(),
+                   columns.batt_charge_wh.tolist(), columns.batt_discharge_wh.tolist(),
+                   tariff.cost_per_kwh.tolist(), tariff.creditable_per_kwh.tolist(), tariff.gen_pay_per_kwh.tolist())
+        for i, (dt_sec, production_wh, consumption_wh, import_wh, export_wh, batt_charge_wh, batt_discharge_wh,
+                energy_cost_per_kwh, creditable_kwh, credit_pay_per_kwh) in enumerate(rows):
+            charge_wh = 0
+            discharge_wh = 0
+            step_import_wh = 0
+            step_export_wh = 0
+            step_cost = 0
+            step_credit = 0
+
+            transient_grid_wh = min(import_wh, export_wh)
+            transient_batt_wh = min(batt_charge_wh, batt_discharge_wh)
+            cur_transient_wh = transient_grid_wh + transient_batt_wh
+
+            solar_consumption_bleed = production_wh * bias
+            consumption_normalized = max(0, consumption_wh - solar_consumption_bleed)
+            generated_wh = ((production_wh - solar_consumption_bleed) / timeseries_panel_num) * panel_num
+            produced_wh = generated_wh
+
+            #Draw the load: solar, then battery, then grid
+            remaining_load_wh = consumption_normalized + batt_discharge_wh - batt_charge_wh
+            solar_wh = min(remaining_load_wh, generated_wh)
+            generated_wh -= solar_wh
+            solar_lifetime_wh += solar_wh
+            remaining_load_wh -= solar_wh
+            if remaining_load_wh != 0:
+                batt_wh, stored_wh = _battery_discharge_wh(remaining_load_wh, stored_wh, usable_kwh, discharge_eff,
+                                                           max_c_rate, soc_derate, dt_sec, batt_v)
+                discharge_wh += batt_wh
+                remaining_load_wh -= batt_wh
+                if remaining_load_wh != 0:
+                    energy_cost = remaining_load_wh * (energy_cost_per_kwh/1000.0)
+                    creditable_cost = remaining_load_wh * (creditable_kwh/1000.0)
+                    credits_used = min(creditable_cost, credits_available)
+                    credits_available -= credits_used
+                    net_cost = energy_cost - credits_used
+                    step_cost += net_cost
+                    money_spent += net_cost
+                    step_import_wh += remaining_load_wh
+
+            #Store the excess solar: battery, then grid
+            extra_energy_wh = generated_wh
+            solar_lifetime_wh += generated_wh
+            batt_wh, stored_wh, throughput_inc = _battery_charge_wh(extra_energy_wh, stored_wh, usable_kwh, charge_eff,
+                                                                    max_c_rate, soc_derate, dt_sec, batt_v)
+            charge_wh += batt_wh
+            throughput_wh += throughput_inc
+            extra_energy_wh -= batt_wh
+            if extra_energy_wh < 0:
+                raise ValueError("des_energy_wh must be non-negative!")
+            credit_earned = credit_pay_per_kwh * (extra_energy_wh/1000.0)
+            step_export_wh += extra_energy_wh
+            step_credit += credit_earned
+            credits_available += credit_earned
+
+            #Transient energy passes through the battery, then the grid
+            batt_wh, stored_wh, throughput_inc = _battery_charge_wh(cur_transient_wh, stored_wh, usable_kwh, charge_eff,
+                                                                    max_c_rate, soc_derate, dt_sec, batt_v)
+            charge_wh += batt_wh
+            throughput_wh += throughput_inc
+            if batt_wh > 0:
+                out_wh, stored_wh = _battery_discharge_wh(batt_wh, stored_wh, usable_kwh, discharge_eff,
+                                                          max_c_rate, soc_derate, dt_sec, batt_v)
+                discharge_wh += out_wh
+            cur_transient_wh -= batt_wh
+            if cur_transient_wh < 0:
+                raise ValueError("des_energy_wh must be non-negative!")
+            credit_earned = credit_pay_per_kwh * (cur_transient_wh/1000.0)
+            step_export_wh += cur_transient_wh
+            step_credit += credit_earned
+            credits_available += credit_earned
+            if cur_transient_wh > 0:
+                energy_cost = cur_transient_wh * (energy_cost_per_kwh/1000.0)
+                creditable_cost = cur_transient_wh * (creditable_kwh/1000.0)
+                credits_used = min(creditable_cost, credits_available)
+                credits_available -= credits_used
+                net_cost = energy_cost - credits_used
+                step_cost += net_cost
+                money_spent += net_cost
+                step_import_wh += cur_transient_wh
+
+            produced_out[i] = produced_wh
+            consumed_out[i] = consumption_normalized
+            stored_out[i] = charge_wh - discharge_wh
+            charge_out[i] = charge_wh
+            discharge_out[i] = discharge_wh
+            exported_out[i] = step_export_wh
+            imported_out[i] = step_import_wh
+            soc_out[i] = soc_at_energy(stored_wh, usable_kwh)
+            throughput_out[i] = throughput_wh
+            import_cost_out[i] = step_cost
+            credits_earned_out[i] = step_credit
+            credits_available_out[i] = credits_available
+            lifetime_cost_out[i] = money_spent
+
+            if money_spent > money_limit:
+                self.stopped_early = True
+                results.truncate(i+1)
+                timestamps = timestamps[:i+1]
+                break
+
+        self.solar_lifetime_wh = solar_lifetime_wh
+        self.stored_energy_wh = stored_wh
+        self.throughput_wh = throughput_wh
+        self.credits_available = credits_available
+        self.money_spent = money_spent
+        self.prev_time = timestamps[-1]
+        return results
+
+    def sync_devices(self) -> None:
+        """
+        Write the kernel's final state back to the panel, battery and grid objects.
+        """
+        self.panels.lifetime_energy_wh = self.solar_lifetime_wh
+        self.battery.set_state(self.stored_energy_wh, self.throughput_wh)
+        self.grid.set_state(self.credits_available, self.money_spent)
+
+SWEEP_PARAMETERS = ["module_count", "batt_usable_energy_kwh", "batt_charge_eff", "batt_discharge_eff", "batt_max_c_rate"]
+
+def sweep_scenarios(module_counts, batt_usable_energy_kwh, batt_charge_eff=(0.93,), batt_discharge_eff=(0.9,), batt_max_c_rate=(5,)) -> pd.DataFrame:
+    """
+    Every combination of the given hardware parameters, one row per scenario (SWEEP_PARAMETERS columns).
+    """
+    index = pd.MultiIndex.from_product([module_counts, batt_usable_energy_kwh, batt_charge_eff, batt_discharge_eff, batt_max_c_rate],
+                                       names=SWEEP_PARAMETERS)
+    return index.to_frame(index=False)
+
+def _sweep_soc(stored_energy_wh, usable_energy_wh):
+    # Vectorized soc_at_energy (a battery without capacity is reported as full)
+    soc = np.ones_like(stored_energy_wh)
+    np.divide(stored_energy_wh, usable_energy_wh, out=soc, where=usable_energy_wh != 0)
+    return np.minimum(soc, 1.0)
+
+def _sweep_below_rate_limit(charging, wh_des, max_wh, stored_energy_wh, usable_energy_wh, c_avail_start, max_c_rate, soc_derate:Table1D, dt_sec, batt_v):
+    # True where no whole Wh from 1 to wh_des (+1) breaks the derated C-rate and wh_des <= max_wh - 1,
+    # i.e. where max_charge_rate_wh/max_discharge_rate_wh could not change the result. The rate
+    # margin is linear between the derating knots, so the knots in range and the end point suffice.
+    one_c_amps = usable_energy_wh / batt_v
+    if charging:
+        knots_wh = [x*usable_energy_wh - stored_energy_wh for x in soc_derate.x_ary] + [usable_energy_wh - stored_energy_wh]
+    else:
+        knots_wh = [stored_energy_wh - x*usable_energy_wh for x in soc_derate.x_ary] + [stored_energy_wh]
+    w_top = np.floor(wh_des) + 1
+    below = wh_des <= max_wh - 1
+    for w in [w_top] + [np.clip(knot, 1, w_top) for knot in knots_wh]:
+        if charging:
+            soc = _sweep_soc(np.minimum(usable_energy_wh, stored_energy_wh + w), usable_energy_wh)
+        else:
+            soc = _sweep_soc(np.maximum(0, stored_energy_wh - w), usable_energy_wh)
+        max_amps = one_c_amps * ((c_avail_start + max_c_rate * soc_derate.get_values(soc)) /2.0)
+        below &= w/dt_sec / batt_v - max_amps < -1e-6
+    return below
+
+def _sweep_discharge_wh(wh_des, stored_energy_wh, usable_energy_kwh, usable_energy_wh, discharge_eff, max_c_rate, soc_derate:Table1D, dt_sec, batt_v):
+    """
+    _battery_discharge_wh for an array of batteries. Returns (wh_exported, new_stored_energy_wh).
+    """
+    active = wh_des != 0
+    avail_export_wh = stored_energy_wh * discharge_eff
+
+    one_c_amps = usable_energy_wh / batt_v
+    c_avail_start = max_c_rate * soc_derate.get_values(_sweep_soc(stored_energy_wh, usable_energy_wh))
+    c_avail_end = max_c_rate * soc_derate.get_values(_sweep_soc(np.maximum(0, stored_energy_wh - avail_export_wh), usable_energy_wh))
+    max_amps = one_c_amps * ((c_avail_start + c_avail_end) /2.0)
+    cur_amps = avail_export_wh/dt_sec / batt_v
+
+    avail_export_arb_wh = avail_export_wh.copy()
+    limited = np.flatnonzero(active & ~(cur_amps <= max_amps))
+    if limited.size:
+        limited = limited[~_sweep_below_rate_limit(False, wh_des[limited], stored_energy_wh[limited], stored_energy_wh[limited],
+                                                   usable_energy_wh[limited], c_avail_start[limited], max_c_rate[limited],
+                                                   soc_derate, dt_sec, batt_v)]
+    for i in limited:
+        avail_export_arb_wh[i] = min(avail_export_wh[i],
+                                     max_discharge_rate_wh(float(stored_energy_wh[i]), float(usable_energy_kwh[i]), float(max_c_rate[i]),
+                                                           soc_derate, dt_sec, batt_v))
+
+    wh_exported = np.minimum(avail_export_arb_wh, wh_des)
+    wh_reduced = wh_exported / discharge_eff
+    #Something went wrong numerically.. adjust
+    overdrawn = wh_reduced > stored_energy_wh
+    wh_reduced = np.where(overdrawn, stored_energy_wh, wh_reduced)
+    wh_exported = np.where(overdrawn, wh_reduced * discharge_eff, wh_exported)
+
+    return np.where(active, wh_exported, 0.0), np.where(active, stored_energy_wh - wh_reduced, stored_energy_wh)
+
+def _sweep_charge_wh(wh_des, stored_energy_wh, usable_energy_kwh, usable_energy_wh, charge_eff, max_c_rate, soc_derate:Table1D, dt_sec, batt_v):
+    """
+    _battery_charge_wh for an array of batteries. Returns (wh_imported, new_stored_energy_wh, throughput_increase_wh).
+    """
+    active = wh_des != 0
+    avail_import_wh = (usable_energy_wh - stored_energy_wh) / charge_eff
+
+    one_c_amps = usable_energy_wh / batt_v
+    c_avail_start = max_c_rate * soc_derate.get_values(_sweep_soc(stored_energy_wh, usable_energy_wh))
+    c_avail_end = max_c_rate * soc_derate.get_values(_sweep_soc(np.minimum(stored_energy_wh, stored_energy_wh + avail_import_wh), usable_energy_wh))
+    max_amps = one_c_amps * ((c_avail_start + c_avail_end) /2.0)
+    cur_amps = avail_import_wh/dt_sec / batt_v
+
+    avail_import_arb_wh = avail_import_wh.copy()
+    limited = np.flatnonzero(active & ~(cur_amps <= max_amps))
+    if limited.size:
+        limited = limited[~_sweep_below_rate_limit(True, wh_des[limited], avail_import_wh[limited], stored_energy_wh[limited],
+                                                   usable_energy_wh[limited], c_avail_start[limited], max_c_rate[limited],
+                                                   soc_derate, dt_sec, batt_v)]
+    for i in limited:
+        avail_import_arb_wh[i] = min(avail_import_wh[i],
+                                     max_charge_rate_wh(float(stored_energy_wh[i]), float(usable_energy_kwh[i]), float(charge_eff[i]),
+                                                        float(max_c_rate[i]), soc_derate, dt_sec, batt_v))
+
+    wh_imported = np.where(active, np.minimum(avail_import_arb_wh, wh_des), 0.0)
+    new_stored_wh = stored_energy_wh + wh_imported * charge_eff
+    throughput_increase_wh = np.where(new_stored_wh > stored_energy_wh, new_stored_wh - stored_energy_wh, 0.0)
+    #Something went wrong numerically.. but reset
+    new_stored_wh = np.where(new_stored_wh > usable_energy_wh, usable_energy_wh, new_stored_wh)
+
+    return wh_imported, np.where(active, new_stored_wh, stored_energy_wh), throughput_increase_wh
+
+class SweepResults:
+    """
+    Output of simulate_sweep: one summary row per scenario and, when requested, the full series.
+    """
+    def __init__(self, summary:pd.DataFrame, series:SimResults=None) -> None:
+        self.summary = summary
+        self._series = series
+
+    def series(self, scenario:int) -> pd.DataFrame:
+        """
+        Full result series (RESULT_COLUMNS) of one scenario (row of summary).
+        """
+        if self._series is None:
+            raise ValueError("The sweep was run without keep_series=True")
+        columns = {}
+        for col in RESULT_COLUMNS:
+            ary = self._series[col]
+            columns[col] = ary[:, scenario] if ary.ndim == 2 else ary
+        return pd.DataFrame(columns, columns=RESULT_COLUMNS, copy=False)
+
+    def savings_matrix(self, value="solar_savings_dollars") -> pd.DataFrame:
+        """
+        Table of value with battery size rows and panel count columns (best over any other swept parameters).
+        """
+        return self.summary.pivot_table(index="batt_usable_energy_kwh", columns="module_count", values=value, aggfunc="max")
+
+def simulate_sweep(columns:IntervalColumns, scenarios:pd.DataFrame, grid:Grid, timeseries_panel_num,
+                   solar_consumption_bias=0.0, keep_series=False) -> SweepResults:
+    """
+    Simulate many hardware configurations (rows of SWEEP_PARAMETERS, see sweep_scenarios)
+    together, advancing every scenario one interval at a time. Input preprocessing and
+    the compiled tariff are shared, and a grid-only baseline rides along to report savings.
+    Each scenario starts from a fresh SolarArray/SolarBattery and the grid's current credits,
+    and matches a separate ArraySimKernel run to within 1e-6.
+    """
+    scenarios = pd.DataFrame(scenarios, columns=SWEEP_PARAMETERS).reset_index(drop=True)
+    n = len(columns)
+    if n == 0:
+        raise ValueError("No interval data to simulate")
+
+    # Scenario parameters, with the grid-only baseline appended as the last entry
+    panel_num = np.append(scenarios["module_count"].to_numpy(dtype=np.float64), 0.0)
+    usable_kwh = np.append(scenarios["batt_usable_energy_kwh"].to_numpy(dtype=np.float64), 0.0)
+    charge_eff = np.append(scenarios["batt_charge_eff"].to_numpy(dtype=np.float64), 1.0)
+    discharge_eff = np.append(scenarios["batt_discharge_eff"].to_numpy(dtype=np.float64), 1.0)
+    max_c_rate = np.append(scenarios["batt_max_c_rate"].to_numpy(dtype=np.float64), 0.0)
+    usable_wh = usable_kwh*1000
+    template_battery = SolarBattery(usable_energy_kwh=0)
+    soc_derate = template_battery.discharge_soc_degradation
+    batt_v = template_battery.BATT_V
+    n_scenarios = len(panel_num)
+
+    timestamps = columns.timestamp_start
+    dt_list, _ = _timestep_dt_sec(timestamps, SimTime().sim_time, SimTime().get_dt().total_seconds())
+    tariff = grid.compile_tariff(timestamps)
+
+    if keep_series:
+        series = SimResults(0)
+        for col in RESULT_COLUMNS:
+            if col == "timestamp":
+                series.columns[col] = np.array(timestamps)
+            elif col in SimResults.BOOL_COLUMNS:
+                series.columns[col] = np.array(getattr(tariff, col))
+            else:
+                series.columns[col] = np.empty((n, n_scenarios), dtype=np.float64)
+    else:
+        series = None
+
+    solar_lifetime_wh = np.zeros(n_scenarios)
+    stored_wh = usable_wh/2.0
+    throughput_wh = np.zeros(n_scenarios)
+    credits_available = np.full(n_scenarios, float(grid.available_credits_dollars))
+    money_spent = np.full(n_scenarios, float(grid.money_spent_dollars))
+    import_cost_total = np.zeros(n_scenarios)
+    credits_earned_total = np.zeros(n_scenarios)
+    import_wh_total = np.zeros(n_scenarios)
+    export_wh_total = np.zeros(n_scenarios)
+    count_imported = np.zeros(n_scenarios, dtype=np.int64)
+    count_consumed = np.zeros(n_scenarios, dtype=np.int64)
+    count_depleted = np.zeros(n_scenarios, dtype=np.int64)
+    count_saturated = np.zeros(n_scenarios, dtype=np.int64)
+
+    rows = zip(dt_list, columns.production_wh.tolist(), columns.consumption_wh.tolist(),
+               columns.import_wh.tolist(), columns.export_wh.tolist(),
+               columns.batt_charge_wh.tolist(), columns.batt_discharge_wh.tolist(),
+               tariff.cost_per_kwh.tolist(), tariff.creditable_per_kwh.tolist(), tariff.gen_pay_per_kwh.tolist())
+    for i, (dt_sec, production_wh, consumption_wh, import_wh, export_wh, batt_charge_wh, batt_discharge_wh,
+            energy_cost_per_kwh, creditable_kwh, credit_pay_per_kwh) in enumerate(rows):
+        cur_transient_wh = min(import_wh, export_wh) + min(batt_charge_wh, batt_discharge_wh)
+
+        solar_consumption_bleed = production_wh * solar_consumption_bias
+        consumption_normalized = max(0, consumption_wh - solar_consumption_bleed)
+        generated_wh = ((production_wh - solar_consumption_bleed) / timeseries_panel_num) * panel_num
+        produced_wh = generated_wh
+
+        #Draw the load: solar, then battery, then grid
+        remaining_load_wh = np.full(n_scenarios, consumption_normalized + batt_discharge_wh - batt_charge_wh)
+        solar_wh = np.minimum(remaining_load_wh, generated_wh)
+        generated_wh = generated_wh - solar_wh
+        solar_lifetime_wh += solar_wh
+        remaining_load_wh -= solar_wh
+        discharge_wh, stored_wh = _sweep_discharge_wh(remaining_load_wh, stored_wh, usable_kwh, usable_wh, discharge_eff,
+                                                      max_c_rate, soc_derate, dt_sec, batt_v)
+        remaining_load_wh -= discharge_wh
+        credits_used = np.minimum(remaining_load_wh * (creditable_kwh/1000.0), credits_available)
+        credits_available -= credits_used
+        step_cost = remaining_load_wh * (energy_cost_per_kwh/1000.0) - credits_used
+        money_spent += step_cost
+        step_import_wh = remaining_load_wh
+
+        #Store the excess solar: battery, then grid
+        solar_lifetime_wh += generated_wh
+        charge_wh, stored_wh, throughput_inc = _sweep_charge_wh(generated_wh, stored_wh, usable_kwh, usable_wh, charge_eff,
+                                                                max_c_rate, soc_derate, dt_sec, batt_v)
+        throughput_wh += throughput_inc
+        extra_energy_wh = generated_wh - charge_wh
+        if (extra_energy_wh < 0).any():
+            raise ValueError("des_energy_wh must be non-negative!")
+        step_credit = credit_pay_per_kwh * (extra_energy_wh/1000.0)
+        credits_available += step_credit
+        step_export_wh = extra_energy_wh
+
+        #Transient energy passes through the battery, then the grid
+        if cur_transient_wh != 0:
+            transient_wh = np.full(n_scenarios, float(cur_transient_wh))
+            batt_wh, stored_wh, throughput_inc = _sweep_charge_wh(transient_wh, stored_wh, usable_kwh, usable_wh, charge_eff,
+                                                                  max_c_rate, soc_derate, dt_sec, batt_v)
+            throughput_wh += throughput_inc
+            charge_wh = charge_wh + batt_wh
+            out_wh, stored_wh = _sweep_discharge_wh(np.maximum(batt_wh, 0.0), stored_wh, usable_kwh, usable_wh, discharge_eff,
+                                                    max_c_rate, soc_derate, dt_sec, batt_v)
+            discharge_wh = discharge_wh + out_wh
+            transient_wh -= batt_wh
+            if (transient_wh < 0).any():
+                raise ValueError("des_energy_wh must be non-negative!")
+            credit_earned = credit_pay_per_kwh * (transient_wh/1000.0)
+            step_credit = step_credit + credit_earned
+            credits_available += credit_earned
+            step_export_wh = step_export_wh + transient_wh
+            credits_used = np.minimum(transient_wh * (creditable_kwh/1000.0), credits_available)
+            credits_available -= credits_used
+            net_cost = transient_wh * (energy_cost_per_kwh/1000.0) - credits_used
+            step_cost = step_cost + net_cost
+            money_spent += net_cost
+            step_import_wh = step_import_wh + transient_wh
+
+        soc = _sweep_soc(stored_wh, usable_wh)
+        import_cost_total += step_cost
+        credits_earned_total += step_credit
+        import_wh_total += step_import_wh
+        export_wh_total += step_export_wh
+        imported = step_import_wh > 0
+        count_imported += imported
+        count_consumed += imported | (consumption_normalized > 0)
+        count_depleted += soc == 0
+        count_saturated += soc == 1
+
+        if series is not None:
+            series["produced_wh"][i] = produced_wh
+            series["consumed_wh"][i] = consumption_normalized
+            series["stored_wh"][i] = charge_wh - discharge_wh
+            series["charge_wh"][i] = charge_wh
+            series["discharge_wh"][i] = discharge_wh
+            series["exported_wh"][i] = step_export_wh
+            series["imported_wh"][i] = step_import_wh
+            series["soc"][i] = soc
+            series["batt_throughput_kwh"][i] = throughput_wh
+            series["import_cost"][i] = step_cost
+            series["credits_earned"][i] = step_credit
+            series["credits_available"][i] = credits_available
+            series["lifetime_import_cost"][i] = money_spent
+
+    baseline_cost = import_cost_total[-1]
+    solar_savings_dollars = baseline_cost - import_cost_total
+    summary = scenarios.copy()
+    summary["sum_import_kwh"] = import_wh_total[:-1]/1000
+    summary["sum_export_kwh"] = export_wh_total[:-1]/1000
+    summary["sum_import_cost"] = import_cost_total[:-1]
+    summary["sum_export_credits"] = credits_earned_total[:-1]
+    summary["credits_remaining"] = credits_available[:-1]
+    summary["batt_throughput_kwh"] = throughput_wh[:-1]/1000
+    summary["sum_generated_energy_kwh"] = solar_lifetime_wh[:-1]/1000
+    summary["grid_dependence"] = np.where(count_consumed > 0, 100*count_imported/np.maximum(count_consumed, 1), 0)[:-1]
+    summary["batt_depleted_percentage"] = np.where(usable_wh > 0, 100*count_depleted/n, 100)[:-1]
+    summary["batt_saturated_percentage"] = (100*count_saturated/n)[:-1]
+    summary["solar_savings_dollars"] = solar_savings_dollars[:-1]
+    summary["percent_solar_savings"] = (100*solar_savings_dollars/baseline_cost)[:-1] if baseline_cost != 0 else np.nan
+
+    if series is not None:
+        for col in SimResults.FLOAT_COLUMNS:
+            series.columns[col] = series[col][:, :-1]
+    return SweepResults(summary, series)
+
+def simulate_baseline(columns:IntervalColumns, grid:Grid, solar_consumption_bias=0.0) -> pd.DataFrame:
+    """
+    Result of simulating columns with no solar panels and no battery (the grid-only
+    comparison for savings), matching the array engine to within 1e-6. grid is not modified.
+
+    Without storage every interval is independent apart from the grid credit balance,
+    which is a Lindley recursion (credits = max(credits - used, 0) + earned) and is solved
+    with a cumulative sum and running minimum instead of stepping through the intervals.
+    """
+    n = len(columns)
+    results = SimResults(n)
+    if n == 0:
+        return results.to_dataframe()
+
+    timestamps = columns.timestamp_start
+    tariff = grid.compile_tariff(timestamps)
+
+    solar_consumption_bleed = columns.production_wh * solar_consumption_bias
+    consumption_normalized = np.maximum(0, columns.consumption_wh - solar_consumption_bleed)
+    #A negative load is handed back as excess generation (exported)
+    load_wh = consumption_normalized + columns.batt_discharge_wh - columns.batt_charge_wh
+    import_wh = np.maximum(load_wh, 0)
+    export_wh = np.maximum(-load_wh, 0)
+    #Transient energy is exported, then imported
+    transient_wh = np.minimum(columns.import_wh, columns.export_wh) + np.minimum(columns.batt_charge_wh, columns.batt_discharge_wh)
+
+    if (transient_wh < 0).any() or (tariff.gen_pay_per_kwh < 0).any():
+        #Earned credits must be non-negative for the closed form
+        kernel = ArraySimKernel(SolarArray(panel_num=0), SolarBattery(usable_energy_kwh=0), grid, 1, solar_consumption_bias)
+        return kernel.run(columns).to_dataframe()
+
+    #Credit events in the order the engines apply them: use for import, earn for export,
+    #earn for transient export, use for transient import
+    import_creditable = import_wh * (tariff.creditable_per_kwh/1000.0)
+    export_credit = tariff.gen_pay_per_kwh * (export_wh/1000.0)
+    transient_credit = tariff.gen_pay_per_kwh * (transient_wh/1000.0)
+    transient_creditable = transient_wh * (tariff.creditable_per_kwh/1000.0)
+    credit_change = np.column_stack((-import_creditable, export_credit, transient_credit, -transient_creditable)).ravel()
+
+    initial_credits = float(grid.available_credits_dollars)
+    cum_change = np.cumsum(credit_change)
+    credits = cum_change - np.minimum(np.minimum.accumulate(cum_change), -initial_credits)
+    credits_before = np.concatenate(([initial_credits], credits[:-1])).reshape(n, 4)
+
+    import_cost = import_wh * (tariff.cost_per_kwh/1000.0) - np.minimum(import_creditable, credits_before[:, 0])
+    transient_cost = transient_wh * (tariff.cost_per_kwh/1000.0) - np.minimum(transient_creditable, credits_before[:, 3])
+    lifetime_cost = np.cumsum(np.concatenate(([float(grid.money_spent_dollars)], np.column_stack((import_cost, transient_cost)).ravel())))
+
+    results["timestamp"][:] = timestamps
+    results["is_peak"][:] = tariff.is_peak
+    results["is_weekend"][:] = tariff.is_weekend
+    results["produced_wh"][:] = 0
+    results["consumed_wh"][:] = consumption_normalized
+    results["stored_wh"][:] = 0
+    results["charge_wh"][:] = 0
+    results["discharge_wh"][:] = 0
+    results["exported_wh"][:] = export_wh + transient_wh
+    results["imported_wh"][:] = import_wh + transient_wh
+    results["soc"][:] = 1.0
+    results["batt_throughput_kwh"][:] = 0
+    results["import_cost"][:] = import_cost + transient_cost
+    results["credits_earned"][:] = export_credit + transient_credit
+    results["credits_available"][:] = credits[3::4]
+    results["lifetime_import_cost"][:] = lifetime_cost[2::2]
+    return results.to_dataframe()
+
+class BaselineCache:
+    """
+    Least recently used cache of simulate_baseline results. Cached DataFrames are shared, don't modify them.
+    Safe to share between request threads; baselines are simulated outside the lock.
+    """
+    def __init__(self, max_entries=32) -> None:
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(user_id, system_id, start_datetime, end_datetime, data_version, grid:Grid, solar_consumption_bias) -> tuple:
+        """
+        Everything a baseline depends on: the interval data (user, system, date range and data version),
+        the tariff, the grid's starting credits and the bias.
+        """
+        return (user_id, system_id, start_datetime, end_datetime, data_version, grid.tariff_key(),
+                grid.available_credits_dollars, grid.money_spent_dollars, solar_consumption_bias)
+
+    def get(self, key, columns:IntervalColumns, grid:Grid, solar_consumption_bias=0.0) -> pd.DataFrame:
+        """
+        Cached baseline for key, simulating (and caching) it on a miss.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        result = simulate_baseline(columns, grid, solar_consumption_bias)
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+class RunningAggregates:
+    """
+    Totals of a simulation's result columns, split by peak/off-peak, and the counts behind
+    grid dependence and battery depletion/saturation. Updated one result chunk at a time,
+    so a summary never needs the full series.
+    """
+    SUM_COLUMNS = ["produced_wh", "consumed_wh", "charge_wh", "discharge_wh", "exported_wh", "imported_wh",
+                   "import_cost", "credits_earned"]
+
+    def __init__(self) -> None:
+        self.peak = dict.fromkeys(self.SUM_COLUMNS, 0.0)
+        self.offpeak = dict.fromkeys(self.SUM_COLUMNS, 0.0)
+        self.count_total = 0
+        self.count_imported = 0
+        self.count_consumed = 0
+        self.count_depleted = 0
+        self.count_saturated = 0
+        self.credits_available = None
+        self.lifetime_import_cost = None
+
+    def update(self, results) -> None:
+        """
+        Add a chunk of results (DataFrame or SimResults of RESULT_COLUMNS).
+        """
+        n = len(results)
+        if n == 0:
+            return
+        is_peak = np.asarray(results["is_peak"], dtype=bool)
+        for col in self.SUM_COLUMNS:
+            values = np.asarray(results[col], dtype=np.float64)
+            self.peak[col] += values[is_peak].sum()
+            self.offpeak[col] += values[~is_peak].sum()
+
+        imported = np.asarray(results["imported_wh"]) > 0
+        soc = np.asarray(results["soc"])
+        self.count_total += n
+        self.count_imported += int(imported.sum())
+        self.count_consumed += int((imported | (np.asarray(results["consumed_wh"]) > 0)).sum())
+        self.count_depleted += int((soc == 0).sum())
+        self.count_saturated += int((soc == 1).sum())
+        self.credits_available = float(np.asarray(results["credits_available"])[-1])
+        self.lifetime_import_cost = float(np.asarray(results["lifetime_import_cost"])[-1])
+
+    def total(self, col) -> float:
+        return self.peak[col] + self.offpeak[col]
+
+    @property
+    def grid_dependence(self) -> float:
+        """
+        Percentage of intervals with consumption that imported from the grid.
+        """
+        return (self.count_imported / self.count_consumed) * 100 if self.count_consumed > 0 else 0
+
+    def batt_depleted_percentage(self, usable_energy_wh) -> float:
+        return (self.count_depleted / self.count_total) * 100 if usable_energy_wh > 0 else 100
+
+    @property
+    def batt_saturated_percentage(self) -> float:
+        return (self.count_saturated / self.count_total) * 100 if self.count_total > 0 else 0
+
 class SimController:
     def __init__(self, panels:SolarArray, battery:SolarBattery, grid:Grid):
         self.solar = panels
@@ -648,38 +1759,52 @@ class SimController:
         self.battery.time_obj = self.time
         self.grid.time_obj = self.time
 
-    def simulate(self, energy_timeseries, timeseries_panel_num, solar_consumption_bias=0.0):
+    def simulate(self, energy_timeseries, timeseries_panel_num, solar_consumption_bias=0.0, engine=ENGINE_OBJECT):
+        """
+        Simulate the system over energy_timeseries (HistoricalData-like records, or
+        IntervalColumns for the array engine), returning a DataFrame of RESULT_COLUMNS.
+
+        engine selects ENGINE_OBJECT (step the device objects) or ENGINE_ARRAY (ArraySimKernel).
+        """
+        if engine == ENGINE_ARRAY:
+            return self._simulate_array(energy_timeseries, timeseries_panel_num, solar_consumption_bias)
+        elif engine != ENGINE_OBJECT:
+            raise ValueError(f"Unknown simulation engine '{engine}'")
         
-        # OLD LOGIC: Tried this, but ended up under-estimating efficiency and therefore over-reducing consumption
-        # Determine the efficiency of the solar panels
-        # This is done by minimizing the correlation between the corrected consumption and solar production
-        # The efficiency is the value that minimizes the correlation
-        # This is a simple optimization problem that can be solved using scipy's minimize function
-        # consumption_raw = pd.Series([step.consumption_wh for step in energy_timeseries])
-        # solar_raw = pd.Series([step.production_wh for step in energy_timeseries])
-        # #Only use data where solar is greater than 0.1W
-        # mask = solar_raw > 0.1
-        # solar_eff_result = minimize(solar_consumption_corr_objective, x0=0.9, args=(consumption_raw[mask], solar_raw[mask]), bounds=[(0.5, 1)])
-        # solar_eff = solar_eff_result.x[0]
-        # print(f"Solar efficiency: {solar_eff}")
-
-        # Define column names
-        columns = ["timestamp", 
-                   "produced_wh", "consumed_wh", "stored_wh", "charge_wh", "discharge_wh", "exported_wh", "imported_wh", 
-                   "soc", "batt_throughput_kwh", 
-                   "import_cost", "credits_earned", "credits_available", "lifetime_import_cost", 
-                   "is_peak", "is_weekend"]
-
-        # Create an empty DataFrame
-        results_df = pd.DataFrame(columns=columns)
+        # Allocate all result columns once
+        results = SimResults(len(energy_timeseries))
+        timestamp_out = results["timestamp"]
+        produced_out = results["produced_wh"]
+        consumed_out = results["consumed_wh"]
+        stored_out = results["stored_wh"]
+        charge_out = results["charge_wh"]
+        discharge_out = results["discharge_wh"]
+        exported_out = results["exported_wh"]
+        imported_out = results["imported_wh"]
+        soc_out = results["soc"]
+        throughput_out = results["batt_throughput_kwh"]
+        import_cost_out = results["import_cost"]
+        credits_earned_out = results["credits_earned"]
+        credits_available_out = results["credits_available"]
+        lifetime_cost_out = results["lifetime_import_cost"]
+        is_peak_out = results["is_peak"]
+        is_weekend_out = results["is_weekend"]
 
         load_obj = EnergyLoad()
         energy_device_list = [self.solar, self.battery, self.grid] #order matters! Preference of energy usage
 
+        #Compile the tariff for every step up front
+        timestamp_out[:] = [step_data.timestamp_start for step_data in energy_timeseries]
+        tariff = self.grid.compile_tariff(timestamp_out)
+        is_peak_out[:] = tariff.is_peak
+        is_weekend_out[:] = tariff.is_weekend
+        self.grid.set_tariff_timeline(tariff)
+
         #Initialize sim time with a valid delta
         self.time.sim_time = energy_timeseries[0].timestamp_end - (energy_timeseries[0].timestamp_end - energy_timeseries[0].timestamp_start)
         for step, step_data in enumerate(energy_timeseries):
             cur_time = step_data.timestamp_start
+            self.grid.tariff_step = step
 
             transient_grid_wh = min(step_data.import_wh, step_data.export_wh)
             transient_batt_wh = min(step_data.batt_charge_wh, step_data.batt_discharge_wh)
@@ -702,29 +1827,56 @@ class SimController:
             for dev in energy_device_list:
                 cur_transient_wh -= dev.store_energy_transient(cur_transient_wh)
 
-            step_data = {
-                "timestamp": cur_time,
-                "produced_wh": cur_produced_wh,
-                "consumed_wh": consumption_normalized,
-                "stored_wh": self.battery.cur_ts_charge_wh - self.battery.cur_ts_discharge_wh,
-                "charge_wh": self.battery.cur_ts_charge_wh,
-                "discharge_wh": self.battery.cur_ts_discharge_wh,
-                "exported_wh": self.grid.cur_ts_export_wh,
-                "imported_wh": self.grid.cur_ts_import_wh,
-                "soc": self.battery.soc,
-                "batt_throughput_kwh": self.battery.throughput_wh,
-                "import_cost": self.grid.cur_cost,
-                "credits_earned": self.grid.cur_credit,
-                "credits_available": self.grid.available_credits_dollars,
-                "lifetime_import_cost": self.grid.money_spent_dollars,
-                "is_peak": self.grid.is_peak(),
-                "is_weekend": self.grid.is_weekend()
-                }
-            
-            new_row = []
-            for col in columns:
-                new_row.append(step_data[col])
+            produced_out[step] = cur_produced_wh
+            consumed_out[step] = consumption_normalized
+            stored_out[step] = self.battery.cur_ts_charge_wh - self.battery.cur_ts_discharge_wh
+            charge_out[step] = self.battery.cur_ts_charge_wh
+            discharge_out[step] = self.battery.cur_ts_discharge_wh
+            exported_out[step] = self.grid.cur_ts_export_wh
+            imported_out[step] = self.grid.cur_ts_import_wh
+            soc_out[step] = self.battery.soc
+            throughput_out[step] = self.battery.throughput_wh
+            import_cost_out[step] = self.grid.cur_cost
+            credits_earned_out[step] = self.grid.cur_credit
+            credits_available_out[step] = self.grid.available_credits_dollars
+            lifetime_cost_out[step] = self.grid.money_spent_dollars
+
+        self.grid.set_tariff_timeline(None)
+        return results.to_dataframe()
+
+    def simulate_stream(self, interval_chunks, timeseries_panel_num, solar_consumption_bias=0.0, baseline_grid:Grid=None):
+        """
+        Streaming array engine: simulate IntervalColumns chunks (see iter_interval_columns)
+        in order, yielding a DataFrame of RESULT_COLUMNS per chunk. Device state carries
+        over between chunks and is synced to the devices after each one.
+
+        With baseline_grid, yields (results, baseline) pairs instead, where baseline is the
+        grid-only run (simulate_baseline) continuing from baseline_grid's credits, which are kept in sync.
+        """
+        kernel = ArraySimKernel(self.solar, self.battery, self.grid, timeseries_panel_num, solar_consumption_bias)
+        for columns in interval_chunks:
+            if len(columns) == 0:
+                continue
+            results = kernel.run(columns)
+            kernel.sync_devices()
+            self.time.sim_time = pd.Timestamp(results["timestamp"][-1]).to_pydatetime()
+            if baseline_grid is None:
+                yield results.to_dataframe()
+            else:
+                baseline = simulate_baseline(columns, baseline_grid, solar_consumption_bias)
+                baseline_grid.set_state(baseline["credits_available"].iloc[-1], baseline["lifetime_import_cost"].iloc[-1])
+                yield results.to_dataframe(), baseline
+
+    def _simulate_array(self, energy_timeseries, timeseries_panel_num, solar_consumption_bias):
+        if isinstance(energy_timeseries, IntervalColumns):
+            columns = energy_timeseries
+        else:
+            columns = IntervalColumns.from_records(energy_timeseries)
 
-            results_df.loc[len(results_df)] = new_row
+        kernel = ArraySimKernel(self.solar, self.battery, self.grid, timeseries_panel_num, solar_consumption_bias)
+        results = kernel.run(columns)
+        kernel.sync_devices()
+        if len(columns) > 0:
+            self.time.sim_time = pd.Timestamp(results["timestamp"][-1]).to_pydatetime()
 
-        return results_df
\ No newline at end of file
+        return results.to_dataframe()
@@ -0,0 +1,76 @@
+"""
+Micro-benchmarks for the simulation hot paths.
+
+Run with:
+    python solar_sim_bench.py
+"""
+import math
+import timeit
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from solar_sim import SolarArray, SolarBattery, Grid, ArraySimKernel, IntervalColumns, Table1D, max_charge_rate_wh, max_discharge_rate_wh
+from solar_sim import simulate_sweep, sweep_scenarios
+from solar_sim import _max_charge_rate_wh_stepwise, _max_discharge_rate_wh_stepwise
+
+def bench(label, func, number):
+    sec = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"{label:<55} {sec*1e6:>12.1f} us/call")
+    return sec
+
+def bench_battery_rate_limits():
+    # Worst case for the stepwise search: an empty 13.5 kWh battery charging over a
+    # 15 minute step, where the derated C-rate never binds and every Wh is visited
+    battery = SolarBattery(usable_energy_kwh=13.5, charge_eff=0.9, max_c_rate=3)
+    table = battery.discharge_soc_degradation
+    dt_sec = 15*60
+    cases = [
+        ("max_charge_rate_wh (empty battery)",
+         lambda: max_charge_rate_wh(0.0, 13.5, 0.9, 3, table, dt_sec, battery.BATT_V),
+         lambda: _max_charge_rate_wh_stepwise(0.0, 13.5, 0.9, 3, table, dt_sec, battery.BATT_V)),
+        ("max_discharge_rate_wh (full battery)",
+         lambda: max_discharge_rate_wh(13500.0, 13.5, 3, table, dt_sec, battery.BATT_V),
+         lambda: _max_discharge_rate_wh_stepwise(13500.0, 13.5, 3, table, dt_sec, battery.BATT_V)),
+    ]
+    for label, closed_form, stepwise in cases:
+        assert abs(closed_form() - stepwise()) <= 1
+        fast = bench(f"{label} closed form", closed_form, number=2000)
+        slow = bench(f"{label} stepwise", stepwise, number=5)
+        print(f"{'':<55} {slow/fast:>12.0f}x faster")
+
+def bench_table_lookup():
+    # Derating a year of 15 minute SoC values
+    table = Table1D(x_ary=[0,0.2,1],y_ary=[0,0.6,1])
+    soc = np.random.default_rng(0).random(35040)
+    soc_list = soc.tolist()
+    per_value = bench("Table1D.getValue x35040", lambda: [table.getValue(x) for x in soc_list], number=3)
+    batch = bench("Table1D.get_values(35040)", lambda: table.get_values(soc), number=50)
+    print(f"{'':<55} {per_value/batch:>12.0f}x faster")
+
+def bench_sweep():
+    # 30 days of synthetic 15 minute data, 10 panel counts x 5 battery sizes
+    start = datetime(2025, 1, 1)
+    steps = 30*96
+    hours = np.array([(i % 96 + 1)/4.0 for i in range(steps)])
+    columns = IntervalColumns(timestamp_end=[start + timedelta(minutes=15*(i+1)) for i in range(steps)],
+                              interval_len_sec=np.full(steps, 900),
+                              production_wh=np.where((hours > 6) & (hours < 18), 400*np.sin(math.pi*(hours-6)/12), 0),
+                              consumption_wh=150 + 350*((hours >= 16) & (hours <= 21)),
+                              import_wh=np.zeros(steps), export_wh=np.zeros(steps),
+                              batt_charge_wh=np.zeros(steps), batt_discharge_wh=np.zeros(steps))
+    scenarios = sweep_scenarios(range(0, 30, 3), [0, 5, 10, 15, 20])
+
+    def run_each():
+        for _, scenario in scenarios.iterrows():
+            battery = SolarBattery(usable_energy_kwh=scenario["batt_usable_energy_kwh"])
+            ArraySimKernel(SolarArray(panel_num=scenario["module_count"]), battery, Grid(initial_credits=0), 10).run(columns)
+
+    each = bench(f"ArraySimKernel x{len(scenarios)} scenarios", run_each, number=1)
+    sweep = bench(f"simulate_sweep({len(scenarios)} scenarios)", lambda: simulate_sweep(columns, scenarios, Grid(initial_credits=0), 10), number=1)
+    print(f"{'':<55} {each/sweep:>12.0f}x faster")
+
+if __name__ == "__main__":
+    bench_battery_rate_limits()
+    bench_table_lookup()
+    bench_sweep()
@@ -1,6 +1,16 @@
 import unittest
+import math
 from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
 from solar_sim import PowerDevice, SimTime, SolarArray, SolarBattery, Grid, EnergyLoad
+from solar_sim import SimController, ArraySimKernel, IntervalColumns, SimResults, RESULT_COLUMNS, ENGINE_OBJECT, ENGINE_ARRAY
+from solar_sim import simulate_sweep, sweep_scenarios, simulate_baseline, BaselineCache
+from solar_sim import iter_interval_columns, RunningAggregates
+from solar_sim import Table1D, max_charge_rate_wh, max_discharge_rate_wh
+from solar_sim import _max_charge_rate_wh_stepwise, _max_discharge_rate_wh_stepwise
 
 def get_example_sim_time(time_diff_sec=60*15) -> SimTime:
     st = SimTime()
@@ -8,6 +18,36 @@ def get_example_sim_time(time_diff_sec=60*15) -> SimTime:
     st.sim_time = st.sim_time + timedelta(seconds=time_diff_sec)
     return st
 
+def get_example_timeseries(days=3, interval_min=15):
+    # Synthetic HistoricalData-like rows: a solar bell curve, an evening load peak,
+    # some recorded battery activity and grid round trips
+    rows = []
+    start = datetime(2025, 1, 3) #Friday, so the series spans a weekend
+    steps = days*24*60 // interval_min
+    for i in range(steps):
+        timestamp_end = start + timedelta(minutes=interval_min*(i+1))
+        hour = (timestamp_end.hour + timestamp_end.minute/60.0)
+        production_wh = max(0.0, 400*math.sin(math.pi*(hour-6)/12)) if 6 <= hour <= 18 else 0
+        consumption_wh = 150 + (350 if 16 <= hour <= 21 else 0) + (i % 7)*10
+        rows.append(SimpleNamespace(timestamp_end=timestamp_end,
+                                    timestamp_start=timestamp_end - timedelta(minutes=interval_min),
+                                    interval_len_sec=interval_min*60,
+                                    production_wh=int(production_wh),
+                                    consumption_wh=consumption_wh,
+                                    import_wh=(i % 5)*20,
+                                    export_wh=(i % 3)*15,
+                                    batt_charge_wh=200 if i % 11 == 0 else (i % 4)*5,
+                                    batt_discharge_wh=(i % 6)*5))
+    return rows
+
+def run_example_simulation(engine, timeseries, usable_energy_kwh=2.5, panel_num=12):
+    panels = SolarArray(panel_num=panel_num)
+    battery = SolarBattery(usable_energy_kwh=usable_energy_kwh, charge_eff=0.9, discharge_eff=0.9, max_c_rate=3)
+    grid = Grid(initial_credits=1.0)
+    controller = SimController(panels=panels, battery=battery, grid=grid)
+    results = controller.simulate(timeseries, 10, solar_consumption_bias=0.2, engine=engine)
+    return results, panels, battery, grid
+
 class TestSimTime(unittest.TestCase):
     def test_initialization(self):
         sim_time = SimTime()
@@ -124,6 +164,58 @@ class TestSolarBattery(unittest.TestCase):
         self.assertAlmostEqual(self.battery.soc, 0.5, places=2)
         self.assertEqual(self.battery.throughput_wh, 0)
     
+class TestTable1D(unittest.TestCase):
+    def setUp(self):
+        self.table = Table1D(x_ary=[0,0.2,1],y_ary=[0,0.6,1])
+
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            Table1D(x_ary=[0,1],y_ary=[0])
+        with self.assertRaises(ValueError):
+            Table1D(x_ary=[],y_ary=[])
+        with self.assertRaises(ValueError):
+            Table1D(x_ary=[0,0.5,0.5],y_ary=[0,1,2])
+
+    def test_get_value(self):
+        self.assertEqual(self.table.getValue(0), 0)
+        self.assertAlmostEqual(self.table.getValue(0.1), 0.3)
+        self.assertAlmostEqual(self.table.getValue(0.2), 0.6)
+        self.assertAlmostEqual(self.table.getValue(0.6), 0.8)
+        self.assertEqual(self.table.getValue(1), 1)
+        with self.assertRaises(ValueError):
+            self.table.getValue(1.01)
+        with self.assertRaises(ValueError):
+            self.table.getValue(-0.01)
+
+    def test_get_values_matches_get_value(self):
+        x_values = np.linspace(0, 1, 101)
+        y_values = self.table.get_values(x_values)
+        self.assertEqual(y_values.shape, x_values.shape)
+        for x, y in zip(x_values, y_values):
+            self.assertEqual(y, self.table.getValue(float(x)))
+        with self.assertRaises(ValueError):
+            self.table.get_values([0.5, 1.5])
+
+class TestBatteryRateLimits(unittest.TestCase):
+    def test_matches_stepwise_search(self):
+        tables = [Table1D(x_ary=[0,0.2,1],y_ary=[0,0.6,1]), Table1D(x_ary=[0,0.5,0.9,1],y_ary=[0.2,1,0.8,0.1])]
+        for table in tables:
+            for usable_kwh in (0.5, 2.5):
+                for stored_frac in (0, 0.001, 0.15, 0.2, 0.5, 0.97, 1):
+                    stored_wh = usable_kwh*1000*stored_frac
+                    for max_c_rate in (0.01, 3):
+                        for dt_sec in (0.01, 1, 900):
+                            args = (stored_wh, usable_kwh, max_c_rate, table, dt_sec, 125)
+                            self.assertLessEqual(abs(max_discharge_rate_wh(*args) - _max_discharge_rate_wh_stepwise(*args)), 1, args)
+                            args = (stored_wh, usable_kwh, 0.9, max_c_rate, table, dt_sec, 125)
+                            self.assertLessEqual(abs(max_charge_rate_wh(*args) - _max_charge_rate_wh_stepwise(*args)), 1, args)
+
+    def test_empty_battery_charge_limit(self):
+        table = Table1D(x_ary=[0,0.2,1],y_ary=[0,0.6,1])
+        # Rate limit does not bind: everything up to full is accepted
+        self.assertEqual(max_charge_rate_wh(0.0, 13.5, 0.9, 3, table, 900, 125), 15000)
+        self.assertEqual(max_discharge_rate_wh(0, 13.5, 3, table, 900, 125), 0)
+
 class TestGrid(unittest.TestCase):
     def setUp(self):
         self.grid = Grid(initial_credits=50)
@@ -165,6 +257,33 @@ class TestGrid(unittest.TestCase):
         self.assertEqual(self.grid._cur_ts_export_wh, 0)
         self.assertEqual(self.grid.cur_ts_import_wh, 0)
     
+    def test_compile_tariff_matches_schedule(self):
+        grid = Grid(initial_credits=0, weekend_on_peak_start=datetime(2025,1,1,8,30).time(),
+                    weekend_on_peak_cost_per_kwh=0.3, weekday_on_peak_creditable_per_kwh=0.5)
+        st = SimTime()
+        grid.set_time_obj(st)
+        timestamps = [datetime(2025,1,3,0,0) + timedelta(minutes=15*i) for i in range(4*24*3)]
+        tariff = grid.compile_tariff(timestamps)
+        self.assertEqual(len(tariff), len(timestamps))
+        for i, ts in enumerate(timestamps):
+            st.sim_time = ts
+            self.assertEqual(tariff.is_peak[i], grid.is_peak())
+            self.assertEqual(tariff.is_weekend[i], grid.is_weekend())
+            self.assertEqual(tariff.cost_per_kwh[i], grid.cur_energy_cost_per_kwh())
+            self.assertEqual(tariff.creditable_per_kwh[i], grid.cur_energy_creditable_per_kwh())
+            self.assertEqual(tariff.gen_pay_per_kwh[i], grid.cur_credit_pay_per_kwh())
+
+    def test_tariff_timeline_lookup(self):
+        grid = Grid(initial_credits=0)
+        tariff = grid.compile_tariff([datetime(2025,1,6,12,0), datetime(2025,1,6,16,0)]) #Monday
+        grid.set_tariff_timeline(tariff)
+        grid.tariff_step = 1
+        self.assertTrue(grid.is_peak())
+        self.assertEqual(grid.cur_energy_cost_per_kwh(), grid.weekday_on_peak_cost_per_kwh)
+        grid.set_tariff_timeline(None)
+        grid.set_time_obj(get_example_sim_time())
+        self.assertFalse(grid.is_peak())
+
 class TestEnergyLoad(unittest.TestCase):
     def setUp(self):
         self.load = EnergyLoad()
@@ -185,5 +304,195 @@ class TestEnergyLoad(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.load.draw_energy([self.battery])
 
+class TestSimResults(unittest.TestCase):
+    def test_typed_columns(self):
+        results = SimResults(96)
+        self.assertEqual(len(results), 96)
+        self.assertEqual(results["timestamp"].dtype, np.dtype("datetime64[us]"))
+        self.assertEqual(results["is_peak"].dtype, bool)
+        self.assertEqual(results["soc"].dtype, np.float64)
+        self.assertEqual(results.nbytes, 96 * SimResults.BYTES_PER_INTERVAL)
+
+    def test_dataframe_shares_buffers(self):
+        results = SimResults(4)
+        results["soc"][:] = 0.5
+        df = results.to_dataframe()
+        self.assertEqual(list(df.columns), RESULT_COLUMNS)
+        self.assertTrue(np.shares_memory(df["soc"].values, results["soc"]))
+
+    def test_object_engine_typed_output(self):
+        out, _, _, _ = run_example_simulation(ENGINE_OBJECT, get_example_timeseries(days=1))
+        self.assertEqual(out["is_peak"].dtype, bool)
+        self.assertEqual(out["imported_wh"].dtype, np.float64)
+
+class TestArraySimKernel(unittest.TestCase):
+    def assert_engines_match(self, **kwargs):
+        timeseries = get_example_timeseries()
+        obj_out, obj_panels, obj_battery, obj_grid = run_example_simulation(ENGINE_OBJECT, timeseries, **kwargs)
+        arr_out, arr_panels, arr_battery, arr_grid = run_example_simulation(ENGINE_ARRAY, timeseries, **kwargs)
+
+        self.assertEqual(list(arr_out.columns), RESULT_COLUMNS)
+        self.assertEqual(len(arr_out), len(obj_out))
+        self.assertTrue((arr_out["timestamp"].values == obj_out["timestamp"].values.astype("datetime64[us]")).all())
+        for col in ("is_peak", "is_weekend"):
+            self.assertEqual(arr_out[col].dtype, bool)
+            self.assertTrue((arr_out[col].values == obj_out[col].values.astype(bool)).all(), col)
+        for col in RESULT_COLUMNS[1:-2]:
+            self.assertEqual(arr_out[col].dtype, np.float64)
+            np.testing.assert_allclose(arr_out[col].values, obj_out[col].values.astype(float), rtol=0, atol=1e-6, err_msg=col)
+
+        self.assertAlmostEqual(arr_panels.lifetime_energy_wh, obj_panels.lifetime_energy_wh, places=6)
+        self.assertAlmostEqual(arr_battery.throughput_wh, obj_battery.throughput_wh, places=6)
+        self.assertAlmostEqual(arr_battery.soc, obj_battery.soc, places=9)
+        self.assertAlmostEqual(arr_grid.money_spent_dollars, obj_grid.money_spent_dollars, places=9)
+        self.assertAlmostEqual(arr_grid.available_credits_dollars, obj_grid.available_credits_dollars, places=9)
+        return arr_out
+
+    def test_matches_object_engine(self):
+        arr_out = self.assert_engines_match()
+        # The example should exercise a depleted and a saturated battery
+        self.assertTrue((arr_out["soc"] == 0).any())
+        self.assertTrue((arr_out["soc"] == 1).any())
+
+    def test_matches_object_engine_without_battery(self):
+        self.assert_engines_match(usable_energy_kwh=0, panel_num=0)
+
+    def test_cost_limit_stops_early(self):
+        columns = IntervalColumns.from_records(get_example_timeseries())
+        full = ArraySimKernel(SolarArray(panel_num=0), SolarBattery(usable_energy_kwh=0), Grid(initial_credits=0), 10).run(columns)
+        kernel = ArraySimKernel(SolarArray(panel_num=0), SolarBattery(usable_energy_kwh=0), Grid(initial_credits=0), 10)
+        limited = kernel.run(columns, cost_limit=1.0)
+        self.assertTrue(kernel.stopped_early)
+        self.assertGreater(limited["lifetime_import_cost"][-1], 1.0)
+        self.assertLessEqual(limited["lifetime_import_cost"][-2], 1.0)
+        self.assertEqual(limited["import_cost"].tolist(), full["import_cost"][:len(limited)].tolist())
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            run_example_simulation("bogus", get_example_timeseries(days=1))
+
+    def test_interval_columns_from_records(self):
+        timeseries = get_example_timeseries(days=1)
+        columns = IntervalColumns.from_records(timeseries)
+        self.assertEqual(len(columns), len(timeseries))
+        self.assertEqual(columns.timestamp_start[0], np.datetime64(timeseries[0].timestamp_start, "us"))
+        self.assertEqual(columns.production_wh.dtype, np.float64)
+
+class TestSimulateSweep(unittest.TestCase):
+    def setUp(self):
+        self.timeseries = get_example_timeseries()
+        self.scenarios = sweep_scenarios([0, 12, 20], [0, 2.5, 10], batt_charge_eff=[0.9], batt_discharge_eff=[0.9], batt_max_c_rate=[3])
+        self.sweep = simulate_sweep(IntervalColumns.from_records(self.timeseries), self.scenarios, Grid(initial_credits=1.0), 10,
+                                    solar_consumption_bias=0.2, keep_series=True)
+
+    def test_scenario_grid(self):
+        self.assertEqual(len(self.scenarios), 9)
+        self.assertEqual(len(self.sweep.summary), 9)
+        self.assertEqual(self.sweep.savings_matrix().shape, (3, 3))
+
+    def test_matches_single_runs(self):
+        for i, scenario in self.scenarios.iterrows():
+            expected, panels, battery, grid = run_example_simulation(ENGINE_ARRAY, self.timeseries,
+                                                                     usable_energy_kwh=scenario["batt_usable_energy_kwh"],
+                                                                     panel_num=scenario["module_count"])
+            series = self.sweep.series(i)
+            self.assertEqual(list(series.columns), RESULT_COLUMNS)
+            for col in RESULT_COLUMNS[1:]:
+                np.testing.assert_allclose(series[col].values, expected[col].values, rtol=0, atol=1e-6, err_msg=f"{col} {i}")
+
+            row = self.sweep.summary.iloc[i]
+            self.assertAlmostEqual(row["sum_import_kwh"], expected["imported_wh"].sum()/1000, places=6)
+            self.assertAlmostEqual(row["sum_import_cost"], expected["import_cost"].sum(), places=6)
+            self.assertAlmostEqual(row["credits_remaining"], grid.available_credits_dollars, places=9)
+            self.assertAlmostEqual(row["sum_generated_energy_kwh"], panels.lifetime_energy_wh/1000, places=6)
+
+    def test_savings_against_grid_only(self):
+        summary = self.sweep.summary.set_index(["module_count", "batt_usable_energy_kwh"])
+        self.assertAlmostEqual(summary.loc[(0, 0), "solar_savings_dollars"], 0)
+        self.assertGreater(summary.loc[(20, 10), "solar_savings_dollars"], summary.loc[(12, 0), "solar_savings_dollars"])
+
+    def test_series_requires_keep_series(self):
+        sweep = simulate_sweep(IntervalColumns.from_records(self.timeseries), self.scenarios, Grid(initial_credits=0), 10)
+        with self.assertRaises(ValueError):
+            sweep.series(0)
+
+class TestSimulateBaseline(unittest.TestCase):
+    def assert_matches_engine(self, initial_credits):
+        timeseries = get_example_timeseries()
+        panels = SolarArray(panel_num=0)
+        battery = SolarBattery(usable_energy_kwh=0)
+        grid = Grid(initial_credits=initial_credits)
+        expected = SimController(panels=panels, battery=battery, grid=grid).simulate(timeseries, 10, solar_consumption_bias=0.2,
+                                                                                     engine=ENGINE_ARRAY)
+        baseline = simulate_baseline(IntervalColumns.from_records(timeseries), Grid(initial_credits=initial_credits), 0.2)
+
+        self.assertEqual(list(baseline.columns), RESULT_COLUMNS)
+        self.assertTrue((baseline["is_peak"].values == expected["is_peak"].values).all())
+        for col in RESULT_COLUMNS[1:-2]:
+            np.testing.assert_allclose(baseline[col].values, expected[col].values, rtol=0, atol=1e-6, err_msg=col)
+        return baseline
+
+    def test_matches_array_engine(self):
+        baseline = self.assert_matches_engine(1.0)
+        # Credits run out and are earned again during the example
+        self.assertTrue((baseline["credits_available"] == 0).any())
+
+    def test_matches_array_engine_with_large_credit(self):
+        baseline = self.assert_matches_engine(1000.0)
+        self.assertTrue((baseline["credits_available"] > 0).all())
+
+    def test_cache(self):
+        cache = BaselineCache(max_entries=2)
+        columns = IntervalColumns.from_records(get_example_timeseries(days=1))
+        grid = Grid(initial_credits=0)
+        key = BaselineCache.make_key(3, 1, "start", "end", columns.content_hash(), grid, 0.2)
+        first = cache.get(key, columns, grid, 0.2)
+        self.assertIs(cache.get(key, columns, grid, 0.2), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        grid.weekday_on_peak_cost_per_kwh = 0.5
+        other_key = BaselineCache.make_key(3, 1, "start", "end", columns.content_hash(), grid, 0.2)
+        self.assertNotEqual(key, other_key)
+        self.assertGreater(cache.get(other_key, columns, grid, 0.2)["import_cost"].sum(), first["import_cost"].sum())
+        cache.get(BaselineCache.make_key(3, 2, "start", "end", columns.content_hash(), grid, 0.2), columns, grid, 0.2)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.misses, 3)
+        self.assertNotEqual(BaselineCache.make_key(4, 2, "start", "end", columns.content_hash(), grid, 0.2),
+                            BaselineCache.make_key(3, 2, "start", "end", columns.content_hash(), grid, 0.2)) # Cached per user
+
+class TestSimulateStream(unittest.TestCase):
+    def test_matches_single_run(self):
+        timeseries = get_example_timeseries()
+        expected, exp_panels, exp_battery, exp_grid = run_example_simulation(ENGINE_ARRAY, timeseries)
+
+        panels = SolarArray(panel_num=12)
+        battery = SolarBattery(usable_energy_kwh=2.5, charge_eff=0.9, discharge_eff=0.9, max_c_rate=3)
+        grid = Grid(initial_credits=1.0)
+        baseline_grid = Grid(initial_credits=1.0)
+        controller = SimController(panels=panels, battery=battery, grid=grid)
+        aggregates = RunningAggregates()
+        baseline_chunks = []
+        chunk_lengths = []
+        for results, baseline in controller.simulate_stream(iter_interval_columns(iter(timeseries), chunk_size=50), 10,
+                                                            solar_consumption_bias=0.2, baseline_grid=baseline_grid):
+            aggregates.update(results)
+            baseline_chunks.append(baseline)
+            chunk_lengths.append(len(results))
+
+        self.assertEqual(chunk_lengths, [50]*5 + [38])
+        self.assertAlmostEqual(battery.soc, exp_battery.soc, places=12)
+        self.assertAlmostEqual(grid.available_credits_dollars, exp_grid.available_credits_dollars, places=12)
+        self.assertAlmostEqual(aggregates.lifetime_import_cost, expected["lifetime_import_cost"].iloc[-1], places=9)
+        for col in RunningAggregates.SUM_COLUMNS:
+            self.assertAlmostEqual(aggregates.peak[col], expected.loc[expected["is_peak"], col].sum(), places=6)
+            self.assertAlmostEqual(aggregates.total(col), expected[col].sum(), places=6)
+        self.assertEqual(aggregates.count_depleted, (expected["soc"] == 0).sum())
+        self.assertEqual(aggregates.count_saturated, (expected["soc"] == 1).sum())
+
+        full_baseline = simulate_baseline(IntervalColumns.from_records(timeseries), Grid(initial_credits=1.0), 0.2)
+        streamed_baseline = np.concatenate([chunk["credits_available"].values for chunk in baseline_chunks])
+        np.testing.assert_allclose(streamed_baseline, full_baseline["credits_available"].values, rtol=0, atol=1e-9)
+        self.assertAlmostEqual(baseline_grid.money_spent_dollars, full_baseline["lifetime_import_cost"].iloc[-1], places=9)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,99 @@
+"""
+Which data "weeks" of a system are fully populated.
+
+Weeks start on day 1, 8, 15, 22 and 29 of each month; the week starting on the
+29th runs to the 1st of the next month.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+WEEK_START_DAYS = (1, 8, 15, 22, 29)
+MAX_GAP = timedelta(minutes=15) # Longest allowed time between intervals (one interval)
+END_TOLERANCE = timedelta(minutes=1)
+
+def week_start_days(first_day:datetime, last_day:datetime) -> list:
+    """
+    Every week start day (midnight) with first_day <= day <= last_day
+    """
+    week_starts = []
+    year, month = first_day.year, first_day.month
+    while datetime(year, month, 1) <= last_day:
+        for day in WEEK_START_DAYS:
+            try:
+                week_start = datetime(year, month, day)
+            except ValueError:
+                break #No 29th in February
+            if first_day <= week_start <= last_day:
+                week_starts.append(week_start)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return week_starts
+
+def next_week_start(week_start:datetime) -> datetime:
+    """
+    Start of the week after the one starting on week_start
+    """
+    if week_start.day < WEEK_START_DAYS[-1]:
+        following = [day for day in WEEK_START_DAYS if day > week_start.day]
+        try:
+            return datetime(week_start.year, week_start.month, following[0])
+        except ValueError:
+            pass #No 29th in February
+    if week_start.month == 12:
+        return datetime(week_start.year + 1, 1, 1)
+    return datetime(week_start.year, week_start.month + 1, 1)
+
+def week_start_of(timestamp_end:datetime) -> datetime:
+    """
+    Start of the week an interval ending at timestamp_end belongs to (week_start < timestamp_end <= next week start)
+    """
+    day = timestamp_end - timedelta(microseconds=1)
+    return datetime(day.year, day.month, max(d for d in WEEK_START_DAYS if d <= day.day))
+
+def week_stats(week_starts:list, final_stop:datetime, timestamp_end) -> dict:
+    """
+    Per-week summary of the sorted interval end times in timestamp_end: week k spans
+    (week_starts[k], week_starts[k+1]], the last one (week_starts[-1], final_stop].
+    Returns arrays (one entry per week) row_count, first_timestamp_end, last_timestamp_end
+    (NaT if no rows), max_gap_sec (longest time between intervals, the first measured
+    from the week start) and complete.
+
+    A week is complete when no interval ends more than MAX_GAP after the previous one
+    (or after the week start, plus END_TOLERANCE) and the last interval ends within
+    END_TOLERANCE of the week end. One pass over the end times, however many weeks there are.
+    """
+    n_weeks = len(week_starts)
+    stats = {"row_count": np.zeros(n_weeks, dtype=np.int64),
+             "first_timestamp_end": np.full(n_weeks, np.datetime64("NaT"), dtype="datetime64[us]"),
+             "last_timestamp_end": np.full(n_weeks, np.datetime64("NaT"), dtype="datetime64[us]"),
+             "max_gap_sec": np.zeros(n_weeks, dtype=np.float64),
+             "complete": np.zeros(n_weeks, dtype=bool)}
+    if n_weeks == 0:
+        return stats
+    bounds = np.array(week_starts + [final_stop], dtype="datetime64[us]")
+    times = np.asarray(timestamp_end, dtype="datetime64[us]")
+
+    week_idx = np.searchsorted(bounds, times, side="left") - 1
+    in_range = (week_idx >= 0) & (week_idx < n_weeks)
+    times = times[in_range]
+    week_idx = week_idx[in_range]
+    if len(times) == 0:
+        return stats
+
+    first_in_week = np.concatenate(([True], week_idx[1:] != week_idx[:-1]))
+    last_in_week = np.concatenate((week_idx[1:] != week_idx[:-1], [True]))
+
+    prev_times = np.concatenate((times[:1], times[:-1]))
+    prev_times[first_in_week] = bounds[week_idx[first_in_week]]
+    gaps = times - prev_times
+    np.maximum.at(stats["max_gap_sec"], week_idx, gaps.astype(np.int64) / 1e6)
+    np.add.at(stats["row_count"], week_idx, 1)
+    stats["first_timestamp_end"][week_idx[first_in_week]] = times[first_in_week]
+    stats["last_timestamp_end"][week_idx[last_in_week]] = times[last_in_week]
+
+    #The first interval may end up to END_TOLERANCE later than the others
+    gaps[first_in_week] -= np.timedelta64(END_TOLERANCE)
+    gap_too_long = gaps > np.timedelta64(MAX_GAP)
+    stats["complete"][week_idx[last_in_week]] = (bounds[week_idx[last_in_week] + 1] - times[last_in_week]) <= np.timedelta64(END_TOLERANCE)
+    stats["complete"][week_idx[gap_too_long]] = False
+    return stats
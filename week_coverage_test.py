@@ -0,0 +1,72 @@
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from week_coverage import week_start_days, week_stats
+
+def week_complete(week_starts, final_stop, timestamps):
+    return week_stats(week_starts, final_stop, timestamps)["complete"].tolist()
+
+def reference_week_coverage(week_starts, final_stop, timestamps):
+    # Week by week check, as get_populated_data_week_list used to do it
+    fifteen_min = timedelta(minutes=15)
+    populated = []
+    for index, cur_start_day in enumerate(week_starts):
+        stop_day = week_starts[index+1] if index < len(week_starts) - 1 else final_stop
+        entries = [t for t in timestamps if cur_start_day < t <= stop_day]
+        if len(entries) == 0 or (entries[0] - cur_start_day) > fifteen_min + timedelta(minutes=1) or \
+                (stop_day - entries[-1]) > timedelta(minutes=1):
+            populated.append(False)
+            continue
+        prev_time = cur_start_day + timedelta(minutes=1)
+        all_data_present = True
+        for cur_time in entries:
+            if cur_time - prev_time > fifteen_min:
+                all_data_present = False
+                break
+            prev_time = cur_time
+        populated.append(all_data_present)
+    return populated
+
+class TestWeekCoverage(unittest.TestCase):
+    def test_week_start_days(self):
+        first, last = datetime(2023, 12, 30), datetime(2024, 3, 8)
+        expected = []
+        day = first
+        while day <= last:
+            if day.day % 7 == 1:
+                expected.append(day)
+            day += timedelta(days=1)
+        self.assertEqual(week_start_days(first, last), expected)
+        self.assertIn(datetime(2024, 2, 29), expected)
+        self.assertEqual(week_start_days(datetime(2023, 2, 20), datetime(2023, 3, 1)), [datetime(2023, 2, 22), datetime(2023, 3, 1)])
+        self.assertEqual(week_start_days(datetime(2024, 1, 2), datetime(2024, 1, 7)), [])
+
+    def test_matches_week_by_week_check(self):
+        week_starts = week_start_days(datetime(2024, 1, 1), datetime(2024, 3, 29))
+        final_stop = datetime(2024, 4, 3)
+        full = [week_starts[0] + timedelta(minutes=15*(i+1)) for i in range(int((final_stop - week_starts[0]) / timedelta(minutes=15)))]
+
+        rng = np.random.default_rng(3)
+        cases = [full, [], full[:-1], full[1:], full[:500] + full[502:], full[:1000] + full[1000:1000]*2 + full[1000:]]
+        for _ in range(20):
+            keep = rng.random(len(full)) > rng.choice([0.0, 0.0001, 0.001])
+            cases.append([t for t, k in zip(full, keep) if k])
+        #Slightly late intervals (within and beyond the tolerance)
+        cases.append([t + timedelta(seconds=int(rng.integers(0, 90))) for t in full])
+
+        for timestamps in cases:
+            self.assertEqual(week_complete(week_starts, final_stop, timestamps),
+                             reference_week_coverage(week_starts, final_stop, timestamps))
+
+    def test_ignores_data_outside_weeks(self):
+        week_starts = [datetime(2024, 1, 1)]
+        final_stop = datetime(2024, 1, 1, 1)
+        timestamps = [datetime(2023, 12, 31, 23, 45)] + [datetime(2024, 1, 1) + timedelta(minutes=15*i) for i in range(1, 5)] + \
+                     [datetime(2024, 1, 1, 1, 15)]
+        self.assertEqual(week_complete(week_starts, final_stop, timestamps), [True])
+        self.assertEqual(week_complete([], final_stop, timestamps), [])
+
+if __name__ == "__main__":
+    unittest.main()